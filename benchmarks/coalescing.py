@@ -0,0 +1,80 @@
+"""
+@file coalescing.py
+
+Issue HGETs in a loop against a local Redis server, with and without write
+coalescing, and report throughput and the number of transport writes. Also
+reports the latency of single PINGs to show coalescing does not delay them.
+
+Needs a Redis server on localhost:6379.
+Run with: python benchmarks/coalescing.py
+"""
+import time
+
+from twisted.internet import defer, protocol, reactor
+
+from txredis.client import RedisClient
+
+
+HOST = 'localhost'
+PORT = 6379
+ROUNDS = 50
+FANOUT = 1000
+PINGS = 10000
+
+
+class CountingClient(RedisClient):
+
+    def connectionMade(self):
+        self.writes = 0
+        for name in ('write', 'writeSequence'):
+            self._countWrites(name)
+        return RedisClient.connectionMade(self)
+
+    def _countWrites(self, name):
+        write = getattr(self.transport, name)
+
+        def counted(data):
+            self.writes += 1
+            write(data)
+        setattr(self.transport, name, counted)
+
+
+@defer.inlineCallbacks
+def run(label, coalesce):
+    creator = protocol.ClientCreator(
+        reactor, CountingClient, coalesce_writes=coalesce)
+    redis = yield creator.connectTCP(HOST, PORT)
+    yield redis.hmset('bench:hash', dict(('f%d' % i, i)
+                                         for i in xrange(FANOUT)))
+    redis.writes = 0
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        yield defer.gatherResults([redis.hget_value('bench:hash', 'f%d' % i)
+                                   for i in xrange(FANOUT)])
+    elapsed = time.time() - start
+    writes = redis.writes
+
+    start = time.time()
+    for _ in xrange(PINGS):
+        yield redis.ping()
+    ping = (time.time() - start) / PINGS
+
+    print '%-10s %10.0f HGET/s %8d writes %8.1f us/PING' % (
+        label, ROUNDS * FANOUT / elapsed, writes, ping * 1e6)
+    yield redis.delete('bench:hash')
+    redis.transport.loseConnection()
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        for _ in xrange(2):
+            yield run('direct', False)
+            yield run('coalesced', True)
+    finally:
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,65 @@
+"""
+@file commands.py
+
+Measure how many commands per second the command encoder serializes, and
+how many a RedisClient can encode and hand to its transport, for small-key
+workloads. The transport discards the data, so only client-side cost is
+measured.
+
+Run with: python benchmarks/commands.py
+"""
+import time
+
+from txredis.client import RedisClient
+
+
+COMMANDS = 200000
+
+
+class NullTransport(object):
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+
+    def writeSequence(self, data):
+        self.writes += 1
+
+
+def measure(label, issue):
+    proto = RedisClient()
+    transport = NullTransport()
+    proto.makeConnection(transport)
+    start = time.time()
+    for i in xrange(COMMANDS):
+        issue(proto, i)
+        if not i % 1000:
+            proto._request_queue.clear()
+    elapsed = time.time() - start
+    print '%-8s %10.0f commands/s %8d writes' % (
+        label, COMMANDS / elapsed, transport.writes)
+
+
+def measure_encoder(label, args):
+    encoder = RedisClient.commandEncoder()
+    start = time.time()
+    for i in xrange(COMMANDS):
+        encoder.encode(args)
+    elapsed = time.time() - start
+    print '%-8s %10.0f encodes/s' % (label, COMMANDS / elapsed)
+
+
+def main():
+    measure_encoder('GET', ('GET', 'key:12'))
+    measure_encoder('SET', ('SET', 'key:12', 42))
+    measure_encoder('HGET', ('HGET', 'hash', 'field'))
+    measure('GET', lambda proto, i: proto.get('key:%d' % (i % 1000)))
+    measure('SET', lambda proto, i: proto.set('key:%d' % (i % 1000), i))
+    measure('HGET', lambda proto, i: proto.hget_value('hash', 'f%d' % i))
+    measure('INCRBY', lambda proto, i: proto.incr('counter', i % 100 + 2))
+
+
+if __name__ == '__main__':
+    main()
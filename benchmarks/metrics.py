@@ -0,0 +1,101 @@
+"""
+@file metrics.py
+
+Measure the overhead of per-command metrics and of the slow log on the
+client.
+
+Batches of GETs are issued on a RedisClient and answered with canned replies,
+so only the work done by the client is timed: encoding, queueing, parsing
+and, when enabled, counting the requests and recording the latency and size
+of those sampled. The best rate of a few runs is printed for plain,
+pipelined and HiRedis clients, without either, with a CommandMetrics hook
+timing every command or one in sixteen, and with a SlowLog timing every
+command or one in a hundred. The runs with and without them alternate, with
+the garbage collector off, so that the comparisons hold on a busy machine.
+
+Run with: python benchmarks/metrics.py
+"""
+import gc
+import time
+
+from twisted.test.proto_helpers import StringTransport
+
+from txredis.client import RedisClient, HiRedisClient
+from txredis.metrics import CommandMetrics
+from txredis.slowlog import SlowLog
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+ROUNDS = 100
+RUNS = 7
+BATCH = 1000
+REPLY = '$5\r\nvalue\r\n' * BATCH
+
+
+def plain(proto):
+    for i in xrange(BATCH):
+        proto.get('key')
+
+
+def pipelined(proto):
+    p = proto.pipeline()
+    for i in xrange(BATCH):
+        p.get('key')
+    p.execute()
+
+
+def run(protocol, issue, **kwargs):
+    proto = protocol(**kwargs)
+    transport = StringTransport()
+    proto.makeConnection(transport)
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        for _ in xrange(ROUNDS):
+            issue(proto)
+            proto.dataReceived(REPLY)
+            transport.clear()
+        return time.time() - start
+    finally:
+        gc.enable()
+
+
+def compare(protocol, issue, kwargs):
+    """Return the best times of alternate runs without and with kwargs."""
+    offs, ons = [], []
+    for _ in xrange(RUNS):
+        offs.append(run(protocol, issue))
+        ons.append(run(protocol, issue, **kwargs()))
+    return min(offs), min(ons)
+
+
+def main():
+    protocols = [('RedisClient', RedisClient)]
+    if hiredis is not None:
+        protocols.append(('HiRedisClient', HiRedisClient))
+    requests = ROUNDS * BATCH
+    configs = [
+        ('metrics', lambda: {'hooks': [CommandMetrics()]}),
+        ('metrics 1/16', lambda: {'hooks': [CommandMetrics(sampleEvery=16)]}),
+        ('slowlog', lambda: {'slowlog': SlowLog()}),
+        ('slowlog 1/100', lambda: {'slowlog': SlowLog(sampleEvery=100)}),
+    ]
+    for name, protocol in protocols:
+        for label, issue in (('GET', plain), ('pipelined GET', pipelined)):
+            off = min(run(protocol, issue) for _ in xrange(RUNS))
+            print '%-14s %-14s %-14s %10.0f req/s' % (
+                name, label, 'plain', requests / off)
+            for config, kwargs in configs:
+                off, on = compare(protocol, issue, kwargs)
+                print '%-14s %-14s %-14s %10.0f req/s %+6.1f%%' % (
+                    name, label, config, requests / on,
+                    (on - off) / off * 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+@file multibulk.py
+
+The test_large_multibulk scenario (SMEMBERS of a big set) with the reply
+collected whole by smembers, and delivered in batches by smembers_batches.
+
+Each mode runs in its own process so that peak RSS reflects only that mode.
+The reply is generated and fed in 64KB chunks as it would arrive off the
+wire, so the only large allocations are the ones the client makes.
+
+Run with: python benchmarks/multibulk.py
+"""
+import resource
+import subprocess
+import sys
+import time
+
+from twisted.test.proto_helpers import StringTransport
+
+from txredis.client import RedisClient
+
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+
+
+def reply_chunks(count):
+    yield '*%d\r\n' % count
+    pending = []
+    size = 0
+    for i in xrange(count):
+        member = str(i)
+        pending.append('$%d\r\n%s\r\n' % (len(member), member))
+        size += len(pending[-1])
+        if size >= CHUNK_SIZE:
+            yield ''.join(pending)
+            pending = []
+            size = 0
+    yield ''.join(pending)
+
+
+def run(mode, count):
+    proto = RedisClient()
+    proto.makeConnection(StringTransport())
+    seen = [0]
+
+    def consume(members):
+        seen[0] += len(members)
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if mode == 'whole':
+        d = proto.smembers('s').addCallback(consume)
+    else:
+        d = proto.smembers_batches('s', consume, BATCH_SIZE)
+    for chunk in reply_chunks(count):
+        proto.dataReceived(chunk)
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert d.called and seen[0] == count
+    return elapsed, (peak_rss - base_rss) / 1024.0
+
+
+def main():
+    if len(sys.argv) > 1:
+        print '%.4f %.1f' % run(sys.argv[1], int(sys.argv[2]))
+        return
+    for count in (100000, 1000000):
+        for mode in ('whole', 'batches'):
+            out = subprocess.check_output(
+                [sys.executable, __file__, mode, str(count)])
+            elapsed, rss = map(float, out.split())
+            print '%8d members %-8s %8.3f s %8.1f MB peak RSS growth' % (
+                count, mode, elapsed, rss)
+
+
+if __name__ == '__main__':
+    main()
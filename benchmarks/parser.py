@@ -0,0 +1,61 @@
+"""
+@file parser.py
+
+Measure the throughput of the pure-Python reply parser.
+
+Replies of increasing size are fed to a RedisClient in 64KB chunks, the way
+they arrive off the wire, and the parse rate is printed for each size. With
+a linear-time receive buffer the parse time grows in proportion to the reply
+size: the rate holds steady from about a megabyte on. Smaller replies parse
+somewhat faster.
+
+Run with: python benchmarks/parser.py
+"""
+import time
+
+from twisted.test.proto_helpers import StringTransport
+
+from txredis.client import RedisClient
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def multibulk_reply(count, element_size):
+    element = 'x' * element_size
+    bulk = '$%d\r\n%s\r\n' % (element_size, element)
+    return '*%d\r\n' % count + bulk * count
+
+
+def bulk_reply(size):
+    return '$%d\r\n%s\r\n' % (size, 'x' * size)
+
+
+def parse(reply, command, *args):
+    proto = RedisClient()
+    proto.makeConnection(StringTransport())
+    d = getattr(proto, command)(*args)
+    start = time.time()
+    for i in xrange(0, len(reply), CHUNK_SIZE):
+        proto.dataReceived(reply[i:i + CHUNK_SIZE])
+    elapsed = time.time() - start
+    assert d.called
+    return elapsed
+
+
+def report(label, size, elapsed):
+    print '%-10s %10.1f MB %10.3f s %10.1f MB/s' % (
+        label, size / 1e6, elapsed, size / 1e6 / elapsed)
+
+
+def main():
+    for count in (10000, 100000, 500000, 1000000):
+        reply = multibulk_reply(count, 40)
+        report('LRANGE', len(reply), parse(reply, 'lrange', 'k', 0, -1))
+    for size in (1, 10, 50, 100):
+        reply = bulk_reply(size * 1000 * 1000)
+        report('GET', len(reply), parse(reply, 'get', 'k'))
+
+
+if __name__ == '__main__':
+    main()
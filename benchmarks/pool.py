@@ -0,0 +1,70 @@
+"""
+@file pool.py
+
+Issue small GETs while large SMEMBERS replies are being fetched, on a single
+connection and on connection pools of increasing size, and report the GET
+throughput and mean GET latency.
+
+Needs a Redis server on localhost:6379.
+Run with: python benchmarks/pool.py
+"""
+import time
+
+from twisted.internet import defer, reactor
+
+from txredis.pool import RedisConnectionPool
+
+
+HOST = 'localhost'
+PORT = 6379
+MEMBERS = 200000
+ROUNDS = 20
+FANOUT = 200
+
+
+@defer.inlineCallbacks
+def run(size):
+    pool = yield RedisConnectionPool(
+        HOST, PORT, minSize=size, maxSize=size).connect()
+    latencies = []
+
+    def timed(d):
+        start = time.time()
+
+        def done(res):
+            latencies.append(time.time() - start)
+            return res
+        return d.addCallback(done)
+
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        big = pool.smembers('bench:set')
+        yield defer.gatherResults([timed(pool.get('bench:key'))
+                                   for i in xrange(FANOUT)] + [big])
+    elapsed = time.time() - start
+
+    print '%2d connections %10.0f GET/s %10.2f ms/GET' % (
+        size, ROUNDS * FANOUT / elapsed,
+        sum(latencies) / len(latencies) * 1e3)
+    yield pool.disconnect()
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        setup = yield RedisConnectionPool(HOST, PORT).connect()
+        yield setup.delete('bench:set')
+        for i in xrange(0, MEMBERS, 1000):
+            yield setup.sadd('bench:set', *range(i, i + 1000))
+        yield setup.set('bench:key', 'x')
+        for size in (1, 2, 4, 8):
+            yield run(size)
+        yield setup.delete('bench:set', 'bench:key')
+        yield setup.disconnect()
+    finally:
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,61 @@
+"""
+@file zerocopy.py
+
+Compare big GETs with get and with zero-copy get_buffer.
+
+Each mode runs in its own process so that peak RSS reflects only that mode.
+A 20MB payload is fed to the client in 64KB chunks and the reply is held
+until the next GET completes, as a caller handing it to another layer
+would.
+
+Run with: python benchmarks/zerocopy.py
+"""
+import resource
+import subprocess
+import sys
+import time
+
+from twisted.test.proto_helpers import StringTransport
+
+from txredis.client import RedisClient
+
+
+CHUNK_SIZE = 64 * 1024
+PAYLOAD_SIZE = 20 * 1000 * 1000
+ROUNDS = 20
+
+
+def run(zero_copy):
+    reply = '$%d\r\n%s\r\n' % (PAYLOAD_SIZE, 'x' * PAYLOAD_SIZE)
+    chunks = [reply[i:i + CHUNK_SIZE]
+              for i in xrange(0, len(reply), CHUNK_SIZE)]
+    del reply
+    proto = RedisClient()
+    proto.makeConnection(StringTransport())
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    held = []
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        get = proto.get_buffer if zero_copy else proto.get
+        get('k').addCallback(held.append)
+        for chunk in chunks:
+            proto.dataReceived(chunk)
+        del held[:-1]
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed / ROUNDS, (peak_rss - base_rss) / 1024.0
+
+
+def main():
+    if len(sys.argv) > 1:
+        print '%.4f %.1f' % run(sys.argv[1] == 'zero-copy')
+        return
+    for label in ('copy', 'zero-copy'):
+        out = subprocess.check_output([sys.executable, __file__, label])
+        per_get, rss = map(float, out.split())
+        print '%-10s %8.2f ms/GET %8.1f MB peak RSS growth' % (
+            label, per_get * 1000, rss)
+
+
+if __name__ == '__main__':
+    main()
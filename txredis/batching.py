@@ -0,0 +1,136 @@
+"""
+@file batching.py
+
+Automatic batching of single key GET and HGET requests into MGET and HMGET.
+"""
+from collections import OrderedDict
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from txredis.client import RedisCommands
+
+
+class AutoBatcher(RedisCommands):
+    """A Redis client wrapper that batches GET and HGET requests.
+
+    get calls are collected and sent as a single MGET, and hget_value and
+    hget calls for one field of the same hash as a single HMGET, once
+    flushDelay seconds have passed since the first of them, or as soon as
+    a batch holds maxBatchSize distinct keys or fields. Each caller is
+    given its own value; repeated keys in a batch are only asked for once.
+    With the default flushDelay of 0, the requests issued in the same
+    reactor iteration are batched.
+
+    Every other command sends the collected batches first, so commands
+    still run in the order they were issued. MGET answers None for a key
+    holding a value that is not a string, where GET would fail with
+    WRONGTYPE.
+    """
+
+    def __init__(self, client, maxBatchSize=100, flushDelay=0, reactor=None):
+        """
+        @param client : The client to wrap (RedisClient, RedisConnectionPool,
+                        ShardedRedis, ...).
+        @param maxBatchSize : Maximum number of keys or fields per request.
+        @param flushDelay : Seconds the first request of a batch waits for
+                            others.
+        @param reactor : Reactor to schedule the batches with; the global
+                         one by default.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.client = client
+        self.maxBatchSize = maxBatchSize
+        self.flushDelay = flushDelay
+        self._reactor = reactor
+        # lists of Deferreds waiting for a key or field, by hash key, or
+        # None for GET
+        self._batches = OrderedDict()
+        self._flushCall = None
+        self._pending = None
+        self.batches = 0
+        self.batchedRequests = 0
+
+    def flush(self):
+        """
+        Send the collected batches now.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        batches, self._batches = self._batches, OrderedDict()
+        for hashKey, batch in batches.iteritems():
+            self._sendBatch(hashKey, batch)
+
+    def _send(self, *args):
+        name = args[0].upper()
+        if (name == 'GET' and len(args) == 2 or
+                name == 'HGET' and len(args) == 3):
+            # collected by getResponse
+            self._pending = args
+            return
+        self.flush()
+        self.client._send(*args)
+
+    def getResponse(self):
+        args, self._pending = self._pending, None
+        if args is None:
+            return self.client.getResponse()
+        if len(args) == 2:
+            hashKey, key = None, args[1]
+        else:
+            hashKey, key = args[1], args[2]
+        batch = self._batches.get(hashKey)
+        if batch is None:
+            batch = self._batches[hashKey] = OrderedDict()
+        waiters = batch.get(key)
+        if waiters is None:
+            waiters = batch[key] = []
+        d = defer.Deferred()
+        waiters.append(d)
+        self.batchedRequests += 1
+        if len(batch) >= self.maxBatchSize:
+            del self._batches[hashKey]
+            self._sendBatch(hashKey, batch)
+        elif self._flushCall is None:
+            self._flushCall = self._reactor.callLater(
+                self.flushDelay, self.flush)
+        return d
+
+    def _unbatched(self, method, *margs):
+        args, self._pending = self._pending, None
+        if args is not None:
+            self.flush()
+            self.client._send(*args)
+        return getattr(self.client, method)(*margs)
+
+    def getStreamingResponse(self, consumer):
+        return self._unbatched('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._unbatched('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._unbatched('getBatchedResponse', callback, batch_size)
+
+    def _sendBatch(self, hashKey, batch):
+        keys = batch.keys()
+        self.batches += 1
+        if hashKey is None:
+            d = self.client.mget(*keys)
+        else:
+            self.client._send('HMGET', hashKey, *keys)
+            d = self.client.getResponse()
+        d.addBoth(self._distribute, batch)
+
+    def _distribute(self, result, batch):
+        if isinstance(result, failure.Failure):
+            for waiters in batch.itervalues():
+                for d in waiters:
+                    d.errback(result)
+            return
+        for value, waiters in zip(result, batch.itervalues()):
+            for d in waiters:
+                d.callback(value)
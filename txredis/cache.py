@@ -0,0 +1,272 @@
+"""
+@file cache.py
+
+An in-process near-cache of hot string and hash values in front of a Redis
+client.
+"""
+from collections import OrderedDict
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from txredis.client import RedisCommands
+from txredis.replication import READ_COMMANDS
+from txredis.routing import commandKeys
+
+
+# read commands whose replies are cached
+CACHED_COMMANDS = frozenset(['GET', 'HGET', 'HMGET', 'HGETALL'])
+
+# commands that invalidate every cached value
+_CLEARING_COMMANDS = frozenset(['FLUSHALL', 'FLUSHDB', 'SELECT', 'SWAPDB'])
+
+
+def _sizeOf(value):
+    """
+    Estimate the memory held by a cached reply, in bytes.
+    """
+    if isinstance(value, str):
+        return len(value) + 40
+    if isinstance(value, list):
+        return sum(_sizeOf(v) for v in value) + 8 * len(value) + 72
+    return 24
+
+
+class _Fill(object):
+    """A request filling a cache entry, and the callers waiting for it."""
+
+    def __init__(self):
+        self.waiters = []
+        self.stale = False
+
+
+class NearCache(RedisCommands):
+    """A Redis client wrapper that caches the replies of GET, HGET, HMGET
+    and HGETALL in process.
+
+    The wrapper provides the command set of the client it wraps, so get,
+    hget, hget_value, hmget and hgetall are served from the cache while
+    their entries are fresh, and every other command is passed through.
+    Concurrent reads of a value that is not cached share one request.
+
+    Entries are fresh for ttl seconds. For staleWindow seconds after that
+    they are still served, while a single request refreshes them in the
+    background. The least recently used entries are evicted when there
+    are more than maxEntries of them or they hold more than about maxBytes.
+
+    Any other command on a key through the wrapper, such as set, delete,
+    hset, hdel or expire, invalidates the cached values of that key when it
+    is sent and again when its reply arrives; FLUSHDB, FLUSHALL and SELECT
+    clear the cache. A value being fetched when its key is invalidated is
+    handed to the callers already waiting for it, but not cached. Writes by
+    other clients, and by pipelines or transactions run on the wrapped
+    client, are only seen once the entries expire; call invalidate for
+    those.
+    """
+
+    def __init__(self, client, maxEntries=10000, maxBytes=64 * 1024 * 1024,
+                 ttl=1.0, staleWindow=0, reactor=None):
+        """
+        @param client : The client to wrap (RedisClient, RedisConnectionPool,
+                        ...).
+        @param maxEntries : Maximum number of cached replies.
+        @param maxBytes : Maximum estimated memory of the cached replies.
+        @param ttl : Seconds a cached reply is fresh.
+        @param staleWindow : Seconds an expired reply is still served while
+                             it is refreshed.
+        @param reactor : Reactor to measure time with; the global one by
+                         default.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.client = client
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.staleWindow = staleWindow
+        self._reactor = reactor
+        # cached replies by command arguments: (value, size, fresh until)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._fills = {}
+        # command arguments cached or being fetched, by Redis key
+        self._byKey = {}
+        self._pending = None
+        self.resetStats()
+
+    def stats(self):
+        """
+        Return a dict of the numbers of entries and bytes cached, and of the
+        hits, stale hits, misses, evictions and invalidations counted since
+        the last resetStats.
+        """
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'staleHits': self.staleHits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def resetStats(self):
+        self.hits = 0
+        self.staleHits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def invalidate(self, *keys):
+        """
+        Drop the cached values of keys.
+        """
+        for key in keys:
+            cached = self._byKey.pop(key, None)
+            if not cached:
+                continue
+            self.invalidations += 1
+            for args in cached:
+                entry = self._entries.pop(args, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+                fill = self._fills.pop(args, None)
+                if fill is not None:
+                    fill.stale = True
+
+    def clear(self):
+        """
+        Drop all cached values.
+        """
+        self.invalidate(*self._byKey.keys())
+
+    def _send(self, *args):
+        name = args[0].upper()
+        if name in CACHED_COMMANDS:
+            # sent by getResponse, unless the reply is cached
+            self._pending = args
+            return
+        if name in _CLEARING_COMMANDS:
+            self.clear()
+            self._pending = args
+        elif name not in READ_COMMANDS:
+            self.invalidate(*commandKeys(args))
+            self._pending = args
+        self.client._send(*args)
+
+    def _response(self, method, *margs):
+        args, self._pending = self._pending, None
+        if args is None:
+            return getattr(self.client, method)(*margs)
+        name = args[0].upper()
+        if name in CACHED_COMMANDS:
+            # streamed or batched replies are not cached
+            self.client._send(*args)
+            return getattr(self.client, method)(*margs)
+        d = getattr(self.client, method)(*margs)
+        if name in _CLEARING_COMMANDS:
+            return d.addBoth(self._cleared)
+        return d.addBoth(self._written, commandKeys(args))
+
+    def getResponse(self):
+        args = self._pending
+        if args is None or args[0].upper() not in CACHED_COMMANDS:
+            return self._response('getResponse')
+        self._pending = None
+        entry = self._entries.get(args)
+        if entry is not None:
+            value, size, freshUntil = entry
+            now = self._reactor.seconds()
+            if now < freshUntil:
+                self.hits += 1
+                return defer.succeed(self._touch(args, entry))
+            if now < freshUntil + self.staleWindow:
+                self.staleHits += 1
+                if args not in self._fills:
+                    self._fill(args)
+                return defer.succeed(self._touch(args, entry))
+            self._remove(args)
+        self.misses += 1
+        fill = self._fills.get(args)
+        if fill is None:
+            fill = self._fill(args)
+        d = defer.Deferred()
+        fill.waiters.append(d)
+        return d
+
+    def getStreamingResponse(self, consumer):
+        return self._response('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._response('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._response('getBatchedResponse', callback, batch_size)
+
+    def _touch(self, args, entry):
+        del self._entries[args]
+        self._entries[args] = entry
+        value = entry[0]
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def _fill(self, args):
+        fill = _Fill()
+        self._fills[args] = fill
+        self._byKey.setdefault(args[1], set()).add(args)
+        self.client._send(*args)
+        self.client.getResponse().addBoth(self._filled, args, fill)
+        return fill
+
+    def _filled(self, result, args, fill):
+        if self._fills.get(args) is fill:
+            del self._fills[args]
+        if not isinstance(result, failure.Failure) and not fill.stale:
+            self._store(args, result)
+        elif args not in self._entries and args not in self._fills:
+            self._forget(args)
+        for d in fill.waiters:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            elif isinstance(result, list):
+                d.callback(list(result))
+            else:
+                d.callback(result)
+
+    def _store(self, args, value):
+        if args in self._entries:
+            self._remove(args)
+        size = _sizeOf(value) + sum(len(str(arg)) for arg in args)
+        self._entries[args] = (value, size,
+                               self._reactor.seconds() + self.ttl)
+        self._byKey.setdefault(args[1], set()).add(args)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.maxEntries or
+                                 self._bytes > self.maxBytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, args):
+        value, size, _ = self._entries.pop(args)
+        self._bytes -= size
+        if args not in self._fills:
+            self._forget(args)
+
+    def _forget(self, args):
+        cached = self._byKey.get(args[1])
+        if cached is not None:
+            cached.discard(args)
+            if not cached:
+                del self._byKey[args[1]]
+
+    def _written(self, result, keys):
+        # reads sent on other connections before the write was applied may
+        # still bring back old values
+        self.invalidate(*keys)
+        return result
+
+    def _cleared(self, result):
+        self.clear()
+        return result
@@ -1,10 +1,12 @@
 """
 @file client.py
 """
+import hashlib
 import itertools
 
 from twisted.internet import defer
 from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.python import failure
 
 try:
     import hiredis
@@ -12,14 +14,21 @@ except ImportError:
     pass
 
 from txredis import exceptions
-from txredis.protocol import RedisBase, HiRedisBase
+from txredis.encoder import (
+    CommandEncoder, HiRedisEncoder, hiRedisEncoderAvailable)
+from txredis.protocol import (
+    MULTI_STATES, RedisBase, HiRedisBase, streamCompleteValue,
+    bufferCompleteValue, batchCompleteList)
 
 
-class RedisClient(RedisBase):
-    """The main Redis client."""
+class RedisCommands(object):
+    """The Redis command set.
 
-    def __init__(self, *args, **kwargs):
-        RedisBase.__init__(self, *args, **kwargs)
+    Every command encodes its request with _send and returns the Deferred
+    from getResponse (or one of its streaming variants), so the commands can
+    be shared by anything that provides those methods: the client protocols
+    as well as pipelines.
+    """
 
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
     # REDIS COMMANDS
@@ -167,6 +176,29 @@ class RedisClient(RedisBase):
         self._send('GET', key)
         return self.getResponse()
 
+    def get_stream(self, key, consumer):
+        """
+        Get the value of a key, passing it to consumer in pieces as they
+        arrive instead of buffering it.
+        @param key : The Redis key to get.
+        @param consumer : A file-like object with a write method (or a
+                          callable such as a hash object's update) that is
+                          given each piece of the value.
+
+        Returns the number of bytes streamed, or None if the key does not
+        exist.
+        """
+        self._send('GET', key)
+        return self.getStreamingResponse(consumer)
+
+    def get_buffer(self, key):
+        """
+        Get the value of a key as a read-only buffer, sliced from the receive
+        buffer without copying it if it is large; see zero_copy_threshold.
+        """
+        self._send('GET', key)
+        return self.getBufferResponse()
+
     def getset(self, key, value):
         """
         Set the string value of a key and return its old value
@@ -284,22 +316,63 @@ class RedisClient(RedisBase):
         return self.getResponse()
 
     # Commands operating on the key space
-    def keys(self, pattern):
+    def keys(self, pattern, sort=True):
         """
-        Find all keys matching the given pattern
+        Find all keys matching the given pattern. KEYS blocks the server
+        while it walks the whole key space; use scan_iter on large
+        databases.
+        @param sort : If True, the keys are returned sorted.
         """
         self._send('KEYS', pattern)
 
         def post_process(res):
-            if res is not None:
-                # XXX is sort ok?
-                res.sort()
-            else:
+            if res is None:
                 res = []
+            elif sort:
+                res.sort()
             return res
 
         return self.getResponse().addCallback(post_process)
 
+    def scan(self, cursor=0, pattern=None, count=None):
+        """
+        Get a page of the keys of the database, starting at cursor.
+        @param pattern : Only return keys matching this pattern.
+        @param count : Number of keys the server looks at for the page.
+
+        Returns a (next cursor, keys) tuple; the iteration is complete when
+        the next cursor is 0.
+        """
+        return self._scan('SCAN', None, cursor, pattern, count)
+
+    def scan_iter(self, pattern=None, count=None, prefetch=False):
+        """
+        Iterate over the keys of the database with SCAN; see Scanner.
+        """
+        return Scanner(lambda cursor: self.scan(cursor, pattern, count),
+                       prefetch)
+
+    def _scan(self, command, key, cursor, pattern, count, convert=None):
+        """Send a command of the SCAN family and parse its reply."""
+        args = [command]
+        if key is not None:
+            args.append(key)
+        args.append(cursor)
+        if pattern is not None:
+            args.extend(['MATCH', pattern])
+        if count is not None:
+            args.extend(['COUNT', count])
+        self._send(*args)
+
+        def post_process(reply):
+            cursor, elements = reply
+            if convert is not None:
+                elements = [convert(elements[i], elements[i + 1])
+                            for i in xrange(0, len(elements) - 1, 2)]
+            return int(cursor), elements
+
+        return self.getResponse().addCallback(post_process)
+
     def randomkey(self):
         """
         Return a random key from the keyspace
@@ -499,6 +572,17 @@ class RedisClient(RedisBase):
         self._send('LRANGE', key, start, end)
         return self.getResponse()
 
+    def lrange_batches(self, key, start, end, callback, batch_size=1000):
+        """
+        Like lrange, but callback is called with each batch of batch_size
+        elements as soon as it has been received, and only one batch is
+        held in memory at a time.
+
+        Returns the number of elements delivered.
+        """
+        self._send('LRANGE', key, start, end)
+        return self.getBatchedResponse(callback, batch_size)
+
     def ltrim(self, key, start, end):
         """
         @param key Redis key
@@ -832,6 +916,29 @@ class RedisClient(RedisBase):
         self._send('SMEMBERS', key)
         return self.getResponse().addCallback(self._list_to_set)
 
+    def smembers_batches(self, key, callback, batch_size=1000):
+        """
+        Get all the members in a set, calling callback with each list of
+        batch_size members as soon as it has been received.
+
+        Returns the number of members delivered.
+        """
+        self._send('SMEMBERS', key)
+        return self.getBatchedResponse(callback, batch_size)
+
+    def sscan(self, key, cursor=0, pattern=None, count=None):
+        """
+        Get a page of the members of a set, starting at cursor; see scan.
+        """
+        return self._scan('SSCAN', key, cursor, pattern, count)
+
+    def sscan_iter(self, key, pattern=None, count=None, prefetch=False):
+        """
+        Iterate over the members of a set with SSCAN; see Scanner.
+        """
+        return Scanner(
+            lambda cursor: self.sscan(key, cursor, pattern, count), prefetch)
+
     def smove(self, srckey, dstkey, member):
         """Move member from the set at srckey to the set at dstkey."""
         self._send('SMOVE', srckey, dstkey, member)
@@ -1160,6 +1267,47 @@ class RedisClient(RedisBase):
 
         return self.getResponse().addCallback(post_process)
 
+    def hgetall_batches(self, key, callback, batch_size=1000):
+        """
+        Get all fields and values of the hash stored at key, calling
+        callback with each list of batch_size (field, value) tuples as soon
+        as it has been received.
+
+        Returns the number of fields delivered.
+        """
+        self._send('HGETALL', key)
+        return self._getPairBatches(callback, batch_size, lambda f, v: (f, v))
+
+    def hscan(self, key, cursor=0, pattern=None, count=None):
+        """
+        Get a page of the fields of a hash, starting at cursor; see scan.
+        The page is a list of (field, value) tuples.
+        """
+        return self._scan('HSCAN', key, cursor, pattern, count,
+                          lambda f, v: (f, v))
+
+    def hscan_iter(self, key, pattern=None, count=None, prefetch=False):
+        """
+        Iterate over the (field, value) tuples of a hash with HSCAN; see
+        Scanner.
+        """
+        return Scanner(
+            lambda cursor: self.hscan(key, cursor, pattern, count), prefetch)
+
+    def _getPairBatches(self, callback, batch_size, convert):
+        """Deliver a flat multi-bulk of pairs in batches of converted pairs."""
+        def pair_up(elements):
+            callback([convert(elements[i], elements[i + 1])
+                      for i in xrange(0, len(elements) - 1, 2)])
+
+        def count_pairs(count):
+            if count is not None:
+                count //= 2
+            return count
+
+        d = self.getBatchedResponse(pair_up, batch_size * 2)
+        return d.addCallback(count_pairs)
+
     def publish(self, channel, message):
         """
         Publishes a message to all subscribers of a specified channel.
@@ -1323,6 +1471,24 @@ class RedisClient(RedisBase):
             dfr.addCallback(post_process)
         return dfr
 
+    def zrange_batches(self, key, start, end, callback, batch_size=1000,
+                       withscores=False, reverse=False):
+        """
+        Like zrange, but callback is called with each batch of batch_size
+        members (or (member, score) tuples) as soon as it has been received.
+
+        Returns the number of members delivered.
+        """
+        cmd = 'ZREVRANGE' if reverse else 'ZRANGE'
+        args = [cmd, key, start, end]
+        if withscores:
+            args.append('WITHSCORES')
+        self._send(*args)
+        if withscores:
+            return self._getPairBatches(
+                callback, batch_size, lambda v, s: (v, float(s)))
+        return self.getBatchedResponse(callback, batch_size)
+
     def zrevrange(self, key, start, end, withscores=False):
         """
         Return a range of members in a sorted set, by index, with scores
@@ -1358,6 +1524,22 @@ class RedisClient(RedisBase):
                 return res
         return self.getResponse().addCallback(post_process)
 
+    def zscan(self, key, cursor=0, pattern=None, count=None):
+        """
+        Get a page of the members of a sorted set, starting at cursor; see
+        scan. The page is a list of (member, score) tuples.
+        """
+        return self._scan('ZSCAN', key, cursor, pattern, count,
+                          lambda m, s: (m, float(s)))
+
+    def zscan_iter(self, key, pattern=None, count=None, prefetch=False):
+        """
+        Iterate over the (member, score) tuples of a sorted set with ZSCAN;
+        see Scanner.
+        """
+        return Scanner(
+            lambda cursor: self.zscan(key, cursor, pattern, count), prefetch)
+
     def zrangebyscore(self, key, min='-inf', max='+inf', offset=None,
                       count=None, withscores=False):
         """
@@ -1413,6 +1595,22 @@ class RedisClient(RedisBase):
         self._send(*args)
         return self.getResponse()
 
+    def register_script(self, source):
+        """
+        Register Lua script source and return a Script running it on this
+        client with EVALSHA. Clients that connect to the server, such as
+        RedisClient and RedisConnectionPool, load the registered scripts
+        every time they connect, and at once on the connections already
+        open, so that the commands sent after a script call never run
+        before it.
+        """
+        script = Script(self, source)
+        registry = getattr(self, 'scripts', None)
+        if registry is not None:
+            registry[script.sha1] = script.source
+            self._loadScript(script.source)
+        return script
+
     def script_load(self, source):
         """
         Load Lua script source into cache. This returns the SHA1 of the loaded
@@ -1447,14 +1645,496 @@ class RedisClient(RedisBase):
         self._send(*args)
         return self.getResponse()
 
+    # # # # # # # # #
+    # Cluster Commands:
+    # CLUSTER SLOTS
+
+    def cluster_slots(self):
+        """
+        Get the mapping of cluster hash slots to nodes.
+
+        Returns a list of (start, end, master, replicas) tuples for the
+        ranges of slots from start to end inclusive, where master is the
+        (host, port) address of the master serving the range and replicas
+        the list of addresses of its replicas.
+        """
+        self._send('CLUSTER', 'SLOTS')
+
+        def post_process(ranges):
+            return [(r[0], r[1], (r[2][0], r[2][1]),
+                     [(node[0], node[1]) for node in r[3:]])
+                    for r in ranges]
+        return self.getResponse().addCallback(post_process)
+
+    # # # # # # # # #
+    # Sentinel Commands:
+    # SENTINEL GET-MASTER-ADDR-BY-NAME
+
+    def sentinel_get_master_addr_by_name(self, name):
+        """
+        Ask a Sentinel for the address of the current master of the service
+        name.
+
+        Returns a (host, port) pair, or None if the Sentinel does not
+        monitor the service.
+        """
+        self._send('SENTINEL', 'GET-MASTER-ADDR-BY-NAME', name)
+
+        def post_process(address):
+            if address is None:
+                return None
+            return address[0], int(address[1])
+        return self.getResponse().addCallback(post_process)
+
+
+class RedisClient(RedisCommands, RedisBase):
+    """The main Redis client."""
+
+    def __init__(self, *args, **kwargs):
+        RedisBase.__init__(self, *args, **kwargs)
+
+    def with_timeout(self, timeout):
+        """
+        Return a view of this client whose commands fail with RequestTimeout
+        if they get no reply within timeout seconds, as in
+        client.with_timeout(0.05).get(key). The connection is kept; see
+        max_late_replies.
+        """
+        return _Deadline(self, timeout)
+
+    def pipeline(self):
+        """
+        Start a pipeline: commands called on it are queued locally and sent
+        in a single write by its execute method.
+        """
+        return Pipeline(self)
+
+    def transaction(self):
+        """
+        Start a transaction: commands called on it are queued locally and
+        sent wrapped in MULTI/EXEC in a single write by its execute method.
+        """
+        return Transaction(self)
+
+    def transact(self, watch_keys, read, build, max_attempts=10):
+        """
+        Run an optimistic transaction, retrying it while watched keys are
+        modified by other clients.
+
+        @param watch_keys : Keys to WATCH.
+        @param read : Called with a pipeline to queue the reads the
+                      transaction depends on.
+        @param build : Called with a transaction and the list of read
+                       results to queue the transaction's commands. May
+                       return a Deferred to finish queueing later.
+        @param max_attempts : Give up with WatchError after this many
+                              aborted attempts.
+
+        The WATCH and reads for a retry are sent speculatively in the same
+        write as the previous attempt's MULTI/EXEC, so every attempt after
+        the first needs a single round trip. When the transaction commits
+        they are discarded and the keys are unwatched. Other transactions
+        must not run on this connection in the meantime, since their EXEC
+        would unwatch the keys.
+
+        Returns the transaction's results, as Transaction.execute does.
+        """
+        def queue_reads():
+            pipeline = self.pipeline()
+            pipeline.watch(*watch_keys)
+            read(pipeline)
+            return pipeline
+
+        def release():
+            self.unwatch().addErrback(lambda _: None)
+
+        def attempt(values, attempts):
+            transaction = self.transaction()
+
+            def failed(reason):
+                release()
+                return reason
+
+            d = defer.maybeDeferred(build, transaction, values[1:])
+            return d.addCallbacks(
+                lambda _: execute(transaction, attempts), failed)
+
+        def execute(transaction, attempts):
+            retry = queue_reads() if attempts < max_attempts else None
+            d, retried = transaction._execute(retry)
+
+            def committed(results):
+                if retried is not None:
+                    release()
+                return results
+
+            def aborted(reason):
+                if retried is not None:
+                    if reason.check(exceptions.WatchError):
+                        return retried.addCallback(attempt, attempts + 1)
+                    release()
+                return reason
+
+            return d.addCallbacks(committed, aborted)
+
+        return queue_reads().execute().addCallback(attempt, 1)
+
+
+class _Deadline(RedisCommands):
+    """Commands sent on a client with a deadline for their replies."""
+
+    def __init__(self, client, timeout):
+        self.client = client
+        self.timeout = timeout
+
+    def _send(self, *args):
+        self.client._send(*args)
+
+    def _respond(self, method, *args):
+        client = self.client
+        # a request shared with single_flight could not time out alone
+        client._sendFlight()
+        # this deadline replaces the one given by setTimeout
+        timeOut, client.timeOut = client.timeOut, None
+        try:
+            d = getattr(client, method)(*args)
+        finally:
+            client.timeOut = timeOut
+        client.setDeadline(d, self.timeout)
+        return d
+
+    def getResponse(self):
+        return self._respond('getResponse')
+
+    def getStreamingResponse(self, consumer):
+        return self._respond('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._respond('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._respond('getBatchedResponse', callback, batch_size)
+
+
+class Script(object):
+    """A Lua script run by its SHA1 digest, so that its source is not sent
+    with every call.
+
+    Calls send EVALSHA. If the server does not have the script, for instance
+    after a SCRIPT FLUSH or a failover, the call is sent again with EVAL,
+    which also loads the script for the next calls; the retries of
+    concurrent calls are sent in the order of the calls. Commands sent after
+    such a call may run before its retry, which is why clients load their
+    registered scripts as soon as they connect or a script is registered.
+    """
+
+    def __init__(self, client, source):
+        """
+        @param client : The client (RedisClient, RedisConnectionPool, ...)
+                        to run the script on.
+        @param source : The Lua source of the script.
+        """
+        if isinstance(source, unicode):
+            source = source.encode('utf8')
+        self.client = client
+        self.source = source
+        self.sha1 = hashlib.sha1(source).hexdigest()
+
+    def __call__(self, keys=(), args=()):
+        """
+        Run the script with keys and arguments.
+        """
+        d = self.client.evalsha(self.sha1, keys, args)
+        return d.addErrback(self._notLoaded, keys, args)
+
+    def _notLoaded(self, reason, keys, args):
+        reason.trap(exceptions.NoScript)
+        return self.client.eval(self.source, keys, args)
+
+
+class Scanner(object):
+    """Iteration over a key space, set, hash or sorted set with a command of
+    the SCAN family, one page at a time.
+
+    Pages are only asked for when the consumer is ready for them: next
+    requests one, and foreach waits for the callback to be done with a page
+    before requesting the next one. With prefetch, the next page is
+    requested as soon as a page arrives, so that it comes over the network
+    while the consumer is busy; at most one page is held in advance.
+
+    As with SCAN, elements added or removed during the iteration may or may
+    not be returned, and an element may be returned more than once.
+    """
+
+    def __init__(self, fetch, prefetch=False):
+        """
+        @param fetch : Callable given a cursor and returning a Deferred that
+                       fires with a (next cursor, elements) tuple.
+        @param prefetch : Request the next page as soon as a page arrives.
+        """
+        self._fetch = fetch
+        self._prefetch = prefetch
+        self._cursor = None
+        self._ahead = None
+
+    @property
+    def done(self):
+        """Whether the last page has been requested."""
+        return self._cursor == 0
+
+    def next(self):
+        """
+        Request the next page; call it again once that page has arrived.
+
+        @retval a deferred which will fire with the next non-empty list of
+        elements, or None once the iteration is complete.
+        """
+        if self._ahead is not None:
+            d, self._ahead = self._ahead, None
+        else:
+            d = self._page()
+        if self._prefetch:
+            d.addCallback(self._fetchAhead)
+        return d
+
+    def foreach(self, callback):
+        """
+        Call callback with each page of elements until the iteration is
+        complete. If callback returns a Deferred, the next page is not
+        delivered before it has fired.
+
+        @retval a deferred which will fire with the number of elements
+        delivered.
+        """
+        counted = [0]
+
+        def deliver(elements):
+            if elements is None:
+                return counted[0]
+            counted[0] += len(elements)
+            d = defer.maybeDeferred(callback, elements)
+            return d.addCallback(lambda _: self.next()).addCallback(deliver)
+
+        return self.next().addCallback(deliver)
+
+    def _page(self):
+        if self.done:
+            return defer.succeed(None)
+        return self._fetch(self._cursor or 0).addCallback(self._received)
+
+    def _received(self, page):
+        self._cursor, elements = page
+        if not elements:
+            # the server may answer empty pages before the end
+            return self._page()
+        return elements
+
+    def _fetchAhead(self, elements):
+        if elements is not None and not self.done:
+            self._ahead = self._page()
+        return elements
+
+
+class Pipeline(RedisCommands):
+    """A batch of commands sent to a client in a single write.
+
+    Pipelines provide the full command set. Each command returns a Deferred
+    for its own post-processed result; nothing is sent until execute is
+    called.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+        self._responses = []
+        # what the client's hooks and slow log are told about each command
+        self._labels = []
+        # whether the queued commands leave a MULTI block open, if they
+        # open or close one and the client shares reads
+        self._in_multi = None
+
+    def __len__(self):
+        return len(self._commands)
+
+    def _send(self, *args):
+        data = self.client._encoder.encode(args)
+        self._commands.append(data)
+        if self.client._tracked:
+            self._labels.append((args, len(data)))
+        if self.client._in_flight is not None:
+            self._in_multi = MULTI_STATES.get(args[0].upper(), self._in_multi)
+
+    def _queueResponse(self, method, *args):
+        d = defer.Deferred()
+        self._responses.append((d, method, args))
+        return d
+
+    def getResponse(self):
+        return self._queueResponse('getResponse')
+
+    def getStreamingResponse(self, consumer):
+        return self._queueResponse('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._queueResponse('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._queueResponse('getBatchedResponse', callback, batch_size)
+
+    def execute(self):
+        """
+        Send all queued commands in a single write.
+
+        Returns a Deferred that fires with the list of results, in the order
+        the commands were queued. A command that failed has the exception it
+        failed with in its place; errors are not raised.
+        """
+        commands, responses, labels = self._take()
+        if not commands:
+            return defer.succeed([])
+        self.client._write(''.join(commands))
+        return self._register(responses, labels)
+
+    def _take(self):
+        """
+        Remove and return the queued commands, their responses and their
+        labels for the hooks and slow log.
+        """
+        commands, self._commands = self._commands, []
+        responses, self._responses = self._responses, []
+        labels, self._labels = self._labels, []
+        if self._in_multi is not None:
+            # the commands are written by the caller
+            self.client._in_multi = self._in_multi
+            self._in_multi = None
+        if len(labels) != len(commands):
+            labels = []
+        return commands, responses, labels
+
+    def _register(self, responses, labels):
+        """Wait for the responses of commands written to the client."""
+        client = self.client
+        for i, (d, method, args) in enumerate(responses):
+            if labels:
+                client._command_args, client._command_bytes = labels[i]
+            getattr(client, method)(*args).chainDeferred(d)
+        return _gatherResults([d for d, _, _ in responses])
+
+
+class Transaction(Pipeline):
+    """A batch of commands run atomically by MULTI/EXEC in a single write.
+
+    Each command's Deferred fires with its own element of the EXEC reply,
+    converted exactly as the command converts a direct reply.
+    """
+
+    _multi = CommandEncoder().encode(('MULTI',))
+    _exec = CommandEncoder().encode(('EXEC',))
+
+    def getStreamingResponse(self, consumer):
+        return self.getResponse().addCallback(streamCompleteValue(consumer))
+
+    def getBufferResponse(self):
+        return self.getResponse().addCallback(bufferCompleteValue)
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self.getResponse().addCallback(
+            batchCompleteList(callback, batch_size))
+
+    def execute(self):
+        """
+        Send MULTI, the queued commands and EXEC in a single write.
+
+        Returns a Deferred that fires with the list of results, in the order
+        the commands were queued; a command that failed has the exception it
+        failed with in its place. Fails with WatchError if a watched key was
+        modified, or with the error EXEC failed with.
+        """
+        if not self._commands:
+            return defer.succeed([])
+        return self._execute()[0]
+
+    def _execute(self, after=None):
+        """
+        Write the transaction, followed by the commands queued on the
+        pipeline after, if given.
+
+        Returns the Deferred for the transaction's results and the one for
+        the results of after.
+        """
+        commands, responses, labels = self._take()
+        data = [self._multi] + commands + [self._exec]
+        if after is not None:
+            after_commands, after_responses, after_labels = after._take()
+            data.extend(after_commands)
+        client = self.client
+        client._write(''.join(data))
+
+        if labels:
+            labels = ([(('MULTI',), len(self._multi))] + labels +
+                      [(('EXEC',), len(self._exec))])
+        replies = []
+        for i in xrange(len(commands) + 2):
+            if labels:
+                client._command_args, client._command_bytes = labels[i]
+            replies.append(client.getResponse())
+        # MULTI and every queued command reply OK/QUEUED; a command that
+        # can't be queued makes EXEC fail as well, so these are only waited
+        # for to consume their errors
+        exec_d = replies.pop()
+        _gatherResults(replies)
+        after_d = None
+        if after is not None:
+            after_d = after._register(after_responses, after_labels)
+
+        deferreds = [d for d, _, _ in responses]
+        results = _gatherResults(deferreds)
+
+        def distribute(reply):
+            if reply is None:
+                return abort(failure.Failure(exceptions.WatchError(
+                    'Watched keys were modified; transaction aborted')))
+            for d, element in itertools.izip(deferreds, reply):
+                if isinstance(element, Exception):
+                    d.errback(element)
+                else:
+                    d.callback(element)
+            return results
+
+        def abort(reason):
+            for d in deferreds:
+                d.errback(reason)
+            return results.addCallback(lambda _: reason)
+
+        return exec_d.addCallbacks(distribute, abort), after_d
+
+
+def _gatherResults(deferreds):
+    """
+    Wait for all deferreds; fire with their results in order, with the
+    exception in place of each failure.
+    """
+    def collect(results):
+        return [result if success else result.value
+                for success, result in results]
+    return defer.DeferredList(deferreds, consumeErrors=True).addCallback(
+        collect)
+
 
 class HiRedisClient(HiRedisBase, RedisClient):
     """A subclass of the Redis protocol that uses the hiredis library for
     parsing.
     """
+
+    if hiRedisEncoderAvailable():
+        commandEncoder = HiRedisEncoder
+    else:
+        commandEncoder = CommandEncoder
+
     def __init__(self, db=None, password=None, charset='utf8',
-                 errors='strict'):
-        super(HiRedisClient, self).__init__(db, password, charset, errors)
+                 errors='strict', **kwargs):
+        super(HiRedisClient, self).__init__(
+            db, password, charset, errors, **kwargs)
         self._reader = hiredis.Reader(protocolError=exceptions.InvalidData,
                                       replyError=exceptions.ResponseError)
 
@@ -1581,6 +2261,7 @@ class RedisClientFactory(ReconnectingClientFactory):
         self._args = args
         self._kwargs = kwargs
         self.client = None
+        self.scripts = {}
         self.deferred = defer.Deferred()
 
     def buildProtocol(self, addr):
@@ -1591,6 +2272,8 @@ class RedisClientFactory(ReconnectingClientFactory):
             self.deferred = defer.Deferred()
         self.client = self.protocol(*self._args, **self._kwargs)
         self.client.factory = self
+        # scripts registered on any of the clients are loaded on reconnect
+        self.client.scripts = self.scripts
         reactor.callLater(0, fire, self.client)
         self.resetDelay()
         return self.client
@@ -0,0 +1,232 @@
+"""
+@file cluster.py
+
+A client for Redis Cluster: commands are routed to the master serving the
+hash slot of their keys, following the redirections of the cluster.
+"""
+from twisted.internet import defer
+from twisted.python import failure
+
+from txredis import exceptions
+from txredis.pool import RedisConnectionPool
+from txredis.routing import SplittingClient, hashTag
+
+
+SLOTS = 16384
+
+
+def _crc16Table():
+    table = []
+    for i in xrange(256):
+        crc = i << 8
+        for _ in xrange(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc <<= 1
+        table.append(crc & 0xffff)
+    return table
+
+
+_CRC16_TABLE = _crc16Table()
+
+
+def crc16(data):
+    """
+    Compute the CRC16 (XMODEM) checksum Redis Cluster hashes keys with.
+    """
+    crc = 0
+    table = _CRC16_TABLE
+    for c in data:
+        crc = ((crc << 8) & 0xff00) ^ table[((crc >> 8) ^ ord(c)) & 0xff]
+    return crc
+
+
+def keySlot(key):
+    """
+    Return the hash slot of key.
+    """
+    key = hashTag(key)
+    if isinstance(key, unicode):
+        key = key.encode('utf8')
+    return crc16(key) % SLOTS
+
+
+class RedisCluster(SplittingClient):
+    """Client of a Redis Cluster.
+
+    The client loads the slot map with CLUSTER SLOTS when connect is called
+    and sends each command to the master serving the hash slot of its keys,
+    over a RedisConnectionPool per node. A MOVED redirection updates the
+    slot map, reloads it in the background and resends the command to the
+    new node; an ASK redirection resends the command to the node given,
+    preceded by ASKING on the same connection. Only the redirected command
+    is resent, so the requests sent along with it are unaffected.
+
+    Commands on keys of several slots raise InvalidCommand, except mget,
+    delete and mset, which are split into one request per slot. Commands
+    without keys raise InvalidCommand as well; the pool of every node is
+    available from the node method for those.
+    """
+
+    maxRedirects = 5
+
+    def __init__(self, startupNodes, reactor=None, **poolKwargs):
+        """
+        @param startupNodes : List of (host, port) addresses of cluster
+                              nodes to load the slot map from.
+        @param reactor : Reactor to connect with; the global one by default.
+
+        Other keyword arguments are passed to the RedisConnectionPool of
+        every node.
+        """
+        self.startupNodes = list(startupNodes)
+        self._reactor = reactor
+        self._poolKwargs = poolKwargs
+        self._nodes = {}
+        self._slots = None
+        self._refreshWaiters = []
+
+    def connect(self):
+        """
+        Load the slot map.
+
+        Returns a Deferred that fires with the cluster once it is loaded.
+        """
+        return self.refreshSlots().addCallback(lambda _: self)
+
+    def disconnect(self):
+        """
+        Close the connections to all nodes.
+        """
+        nodes, self._nodes = self._nodes, {}
+        return defer.DeferredList([pool.disconnect()
+                                   for pool in nodes.itervalues()])
+
+    def node(self, address):
+        """
+        Return the connection pool of the node at address, a (host, port)
+        pair.
+        """
+        pool = self._nodes.get(address)
+        if pool is None:
+            host, port = address
+            pool = RedisConnectionPool(host, port, reactor=self._reactor,
+                                       **self._poolKwargs)
+            pool.connect()
+            self._nodes[address] = pool
+        return pool
+
+    def refreshSlots(self):
+        """
+        Reload the slot map from the first node that answers, trying the
+        known masters before the startup nodes. Concurrent calls share a
+        single reload.
+
+        Returns a Deferred that fires once the slot map is loaded.
+        """
+        d = defer.Deferred()
+        self._refreshWaiters.append(d)
+        if len(self._refreshWaiters) == 1:
+            addresses = []
+            if self._slots is not None:
+                addresses.extend(set(self._slots) - set([None]))
+            addresses.extend(self.startupNodes)
+            self._loadSlots(addresses).addBoth(self._slotsLoaded)
+        return d
+
+    def _loadSlots(self, addresses):
+        address = addresses[0]
+
+        def loaded(ranges):
+            slots = [None] * SLOTS
+            for start, end, (host, port), _ in ranges:
+                # an empty host means the node that was asked
+                master = (host or address[0], port)
+                for slot in xrange(start, end + 1):
+                    slots[slot] = master
+            self._slots = slots
+
+        def failed(reason):
+            if len(addresses) == 1:
+                return reason
+            return self._loadSlots(addresses[1:])
+
+        return self.node(address).cluster_slots().addCallbacks(
+            loaded, failed)
+
+    def _slotsLoaded(self, result):
+        waiters, self._refreshWaiters = self._refreshWaiters, []
+        for d in waiters:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(None)
+
+    def _group(self, key):
+        return keySlot(key)
+
+    def _groupClient(self, slot):
+        if self._slots is None:
+            raise exceptions.ConnectionError(
+                'The slot map is not loaded; call connect first')
+        address = self._slots[slot]
+        if address is None:
+            raise exceptions.ConnectionError(
+                'Hash slot %d is not served by any node' % slot)
+        return self.node(address)
+
+    def _send(self, *args):
+        SplittingClient._send(self, *args)
+        self._currentArgs = args
+
+    def _respond(self, method, *margs):
+        args = self._currentArgs
+        d = getattr(self._routed(), method)(*margs)
+        return d.addErrback(self._redirected, args, method, margs, 1)
+
+    def getResponse(self):
+        return self._respond('getResponse')
+
+    def getStreamingResponse(self, consumer):
+        return self._respond('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._respond('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._respond('getBatchedResponse', callback, batch_size)
+
+    def _redirected(self, reason, args, method, margs, redirects):
+        """
+        Resend a command a node redirected.
+        """
+        reason.trap(exceptions.MovedError, exceptions.AskError)
+        if redirects > self.maxRedirects:
+            return reason
+        error = reason.value
+        address = (error.host, error.port)
+        pool = self.node(address)
+        if reason.check(exceptions.MovedError):
+            if self._slots is not None:
+                self._slots[error.slot] = address
+            self.refreshSlots().addErrback(lambda _: None)
+            pool._send(*args)
+            d = getattr(pool, method)(*margs)
+        else:
+            d = pool.connect().addCallback(self._ask, args, method, margs)
+        return d.addErrback(
+            self._redirected, args, method, margs, redirects + 1)
+
+    def _ask(self, pool, args, method, margs):
+        """
+        Send a command preceded by ASKING on one connection of pool.
+        """
+        pipeline = pool.pipeline()
+        pipeline._send('ASKING')
+        pipeline.getResponse()
+        pipeline._send(*args)
+        d = defer.Deferred()
+        getattr(pipeline, method)(*margs).chainDeferred(d)
+        pipeline.execute()
+        return d
@@ -0,0 +1,99 @@
+"""
+@file encoder.py
+
+Command encoders serialize a command and its arguments into the unified
+request protocol (aka multi-bulk) in a single pass. A protocol picks its
+encoder through its commandEncoder attribute, so a C or hiredis-backed
+encoder can be swapped in where one is available.
+"""
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+from txredis import exceptions
+
+
+class CommandEncoder(object):
+    """Pure Python command encoder.
+
+    The RESP prefix of each command name (argument count and name) and the
+    encodings of small integers are computed once and shared by all
+    encoders.
+    """
+
+    # encodings of the non-negative integers below this are cached
+    SMALL_INT_LIMIT = 1024
+    # prefixes are cached for commands with fewer arguments than this
+    MAX_CACHED_COUNT = 32
+
+    _prefixes = {}
+    _ints = ['$%s\r\n%s\r\n' % (len(str(i)), i)
+             for i in xrange(SMALL_INT_LIMIT)]
+
+    def __init__(self, charset='utf8', errors='strict'):
+        self.charset = charset
+        self.errors = errors
+
+    def encodeValue(self, s):
+        """Encode a single value to a byte string."""
+        if isinstance(s, str):
+            return s
+        if isinstance(s, unicode):
+            try:
+                return s.encode(self.charset, self.errors)
+            except UnicodeEncodeError, e:
+                raise exceptions.InvalidData(
+                    "Error encoding unicode value '%s': %s" % (
+                        s.encode(self.charset, 'replace'), e))
+        return str(s)
+
+    def encode(self, args):
+        """Encode a command, given as a sequence of name and arguments."""
+        try:
+            parts = [self._prefixes[args[0], len(args)]]
+        except (KeyError, TypeError):
+            parts = [self._prefix(args[0], len(args))]
+        append = parts.append
+        ints = self._ints
+        for arg in args[1:]:
+            kind = type(arg)
+            if kind is str:
+                append('$%s\r\n%s\r\n' % (len(arg), arg))
+            elif kind is int and 0 <= arg < self.SMALL_INT_LIMIT:
+                append(ints[arg])
+            else:
+                append(self._encodeArgument(arg))
+        return ''.join(parts)
+
+    def _prefix(self, name, count):
+        prefix = '*%s\r\n%s' % (count, self._encodeArgument(name))
+        if type(name) is str and count < self.MAX_CACHED_COUNT:
+            self._prefixes[name, count] = prefix
+        return prefix
+
+    def _encodeArgument(self, arg):
+        v = self.encodeValue(arg)
+        return '$%s\r\n%s\r\n' % (len(v), v)
+
+
+class HiRedisEncoder(CommandEncoder):
+    """Command encoder backed by hiredis.pack_command.
+
+    Only usable with hiredis releases that provide pack_command; see
+    hiRedisEncoderAvailable.
+    """
+
+    def encode(self, args):
+        packed = []
+        for arg in args:
+            kind = type(arg)
+            if kind is not str and kind is not int:
+                arg = self.encodeValue(arg)
+            packed.append(arg)
+        return hiredis.pack_command(tuple(packed))
+
+
+def hiRedisEncoderAvailable():
+    """Whether the installed hiredis can back a HiRedisEncoder."""
+    return hiredis is not None and hasattr(hiredis, 'pack_command')
@@ -17,6 +17,40 @@ class NoScript(RedisError):
     pass
 
 
+class RequestTimeout(RedisError):
+    pass
+
+
+class BackpressureError(RedisError):
+    pass
+
+
+class RedirectError(ResponseError):
+    """A cluster node redirected a command to the node given by host and
+    port, for the hash slot slot.
+    """
+
+    def __init__(self, message):
+        ResponseError.__init__(self, message)
+        _, slot, address = message.split()
+        self.slot = int(slot)
+        host, _, port = address.rpartition(':')
+        self.host = host
+        self.port = int(port)
+
+
+class MovedError(RedirectError):
+    pass
+
+
+class AskError(RedirectError):
+    pass
+
+
+class WatchError(RedisError):
+    pass
+
+
 class InvalidResponse(RedisError):
     pass
 
@@ -0,0 +1,116 @@
+"""
+@file hooks.py
+
+Hooks told about the lifecycle of the requests of Redis clients.
+
+Hooks are given to a client with its hooks argument, or added with
+add_hook; a RedisConnectionPool passes its hooks argument on to all of its
+connections.
+
+@code
+class Tracer(RequestHooks):
+
+    def reply_received(self, cmd, latency, reply_size):
+        currentSpan().annotate('redis %s %.6f' % (cmd, latency))
+
+pool = RedisConnectionPool(hooks=[Tracer(), CommandMetrics()])
+@endcode
+"""
+
+
+class RequestHooks(object):
+    """The methods clients call on their hooks, which do nothing here.
+
+    Each command sent gets a call of command_sent. The commands of
+    pipelines and transactions are reported one by one, in the order they
+    were queued; MULTI and EXEC are reported like any other command. The
+    data received is reported as it arrives by bytes_received, whatever
+    replies it holds. Commands that could not be sent at all only get a
+    call of request_failed.
+
+    Only one in sampleEvery commands is followed until its reply: it then
+    gets a call of reply_received or request_failed. The others only cost
+    the call of command_sent and a counter increment; neither the clock
+    nor anything about them is kept. Clients read sampleEvery when they are
+    given the hooks, and follow requests for the hook that wants them most
+    often.
+
+    Hooks are called synchronously while the client is sending or parsing,
+    so they should be quick and must not raise.
+    """
+
+    sampleEvery = 1
+
+    def command_sent(self, cmd, nargs, nbytes):
+        """
+        A command was written, or queued to be written.
+
+        @param cmd : The command name, in upper case.
+        @param nargs : The number of arguments, the name not included.
+        @param nbytes : The size of the encoded command.
+        """
+
+    def bytes_received(self, nbytes):
+        """
+        Data was received, before the replies it completes are parsed.
+
+        @param nbytes : The size of the data.
+        """
+
+    def reply_received(self, cmd, latency, reply_size):
+        """
+        The reply to a sampled command was parsed, just before its Deferred
+        fires.
+
+        @param latency : Seconds from sending the command to the arrival of
+        the data that completed its reply. The replies completed by the
+        same data share one reading of the clock, taken when the first of
+        them that is sampled is parsed.
+        @param reply_size : The size of the reply on the wire; HiRedisClient
+        estimates it from the parsed reply.
+        """
+
+    def request_failed(self, cmd, reason):
+        """
+        A sampled command failed with an error reply, a RequestTimeout or the
+        loss of the connection, or a command could not be sent.
+
+        @param reason : A Failure.
+        """
+
+
+class HookSet(RequestHooks):
+    """Passes every call on to several hooks, in order."""
+
+    def __init__(self, hooks):
+        self.hooks = tuple(hooks)
+        self.sampleEvery = min(getattr(hook, 'sampleEvery', 1)
+                               for hook in self.hooks)
+
+    def command_sent(self, cmd, nargs, nbytes):
+        for hook in self.hooks:
+            hook.command_sent(cmd, nargs, nbytes)
+
+    def bytes_received(self, nbytes):
+        for hook in self.hooks:
+            hook.bytes_received(nbytes)
+
+    def reply_received(self, cmd, latency, reply_size):
+        for hook in self.hooks:
+            hook.reply_received(cmd, latency, reply_size)
+
+    def request_failed(self, cmd, reason):
+        for hook in self.hooks:
+            hook.request_failed(cmd, reason)
+
+
+def combineHooks(hooks):
+    """
+    Return the object to call for a sequence of hooks: None if it is empty,
+    the hook itself if there is one, or a HookSet.
+    """
+    if not hooks:
+        return None
+    if len(hooks) == 1:
+        return hooks[0]
+    return HookSet(hooks)
@@ -0,0 +1,242 @@
+"""
+@file metrics.py
+
+Latency histograms and counters of the commands sent by Redis clients.
+
+A CommandMetrics is a hook (see txredis.hooks) given to the clients it
+collects for.
+
+@code
+from txredis.metrics import CommandMetrics
+
+metrics = CommandMetrics(sampleEvery=16)
+pool = RedisConnectionPool(hooks=[metrics])
+...
+get = metrics.snapshot()['GET']
+print get['sent'], get['latencySum'] / get['replies'], metrics.bytesIn
+@endcode
+"""
+import math
+
+from txredis import exceptions
+from txredis.hooks import RequestHooks
+
+
+# the latency buckets are bounded by powers of two seconds, from about a
+# microsecond up to a minute
+MIN_EXPONENT = -20
+MAX_EXPONENT = 6
+BUCKET_BOUNDS = [2.0 ** e for e in xrange(MIN_EXPONENT, MAX_EXPONENT + 1)]
+
+
+class Histogram(object):
+    """Counts of values in buckets that each cover twice the range of the
+    one before them.
+
+    Adding a value takes a frexp and an increment, whatever the number of
+    buckets.
+    """
+
+    def __init__(self):
+        # the last bucket counts the values above the last bound
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        index = 0
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            if mantissa == 0.5:
+                # a power of two is the upper bound of its bucket
+                exponent -= 1
+            index = exponent - MIN_EXPONENT
+            if index < 0:
+                index = 0
+            elif index > len(BUCKET_BOUNDS):
+                index = len(BUCKET_BOUNDS)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Return a list of (upper bound, number of values up to it) tuples,
+        the last bound being infinity.
+        """
+        total = 0
+        buckets = []
+        for bound, count in zip(BUCKET_BOUNDS + [float('inf')], self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, q):
+        """
+        Estimate the q quantile (0 <= q <= 1) as the upper bound of the
+        bucket it falls in, or None if no value was added.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+
+class _CommandStats(object):
+    """The counters of one command."""
+
+    __slots__ = ('sent', 'replies', 'errors', 'timeouts', 'bytesOut',
+                 'latency')
+
+    def __init__(self):
+        self.sent = 0
+        self.replies = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bytesOut = 0
+        self.latency = Histogram()
+
+
+class CommandMetrics(RequestHooks):
+    """Per command latency histograms and counters.
+
+    Failures are counted as errors, or as timeouts for RequestTimeout.
+    Latencies are measured from the time the command was sent until the
+    data completing its reply arrived, so they include the time spent
+    queued behind other requests on the same connection. The commands of
+    a transaction are counted one by one, MULTI and EXEC included; their
+    latencies are those of their QUEUED replies, while the results all
+    arrive with EXEC.
+
+    The commands sent and their bytes are counted for every command, and
+    the bytes received for all the data received, in bytesIn. Replies,
+    errors, timeouts and latencies are only counted for the commands
+    sampled by the clients, one in sampleEvery; see
+    RequestHooks.sampleEvery.
+    """
+
+    def __init__(self, sampleEvery=1):
+        """
+        @param sampleEvery : Follow one in this many commands until its
+        reply.
+        """
+        self.sampleEvery = sampleEvery
+        self._commands = {}
+        self.bytesIn = 0
+
+    def _stats(self, cmd):
+        stats = self._commands.get(cmd)
+        if stats is None:
+            stats = self._commands[cmd] = _CommandStats()
+        return stats
+
+    def command_sent(self, cmd, nargs, nbytes):
+        try:
+            stats = self._commands[cmd]
+        except KeyError:
+            stats = self._stats(cmd)
+        stats.sent += 1
+        stats.bytesOut += nbytes
+
+    def bytes_received(self, nbytes):
+        self.bytesIn += nbytes
+
+    def reply_received(self, cmd, latency, reply_size):
+        try:
+            stats = self._commands[cmd]
+        except KeyError:
+            stats = self._stats(cmd)
+        stats.replies += 1
+        stats.latency.add(latency)
+
+    def request_failed(self, cmd, reason):
+        stats = self._stats(cmd)
+        if reason.check(exceptions.RequestTimeout):
+            stats.timeouts += 1
+        else:
+            stats.errors += 1
+
+    def snapshot(self):
+        """
+        Return a dict by command name of dicts holding the numbers of
+        commands sent, of replies, errors and timeouts, the bytes sent, the
+        sum of the latencies and the cumulative latency buckets, as (upper
+        bound, count) tuples.
+        """
+        snapshot = {}
+        for cmd, stats in self._commands.iteritems():
+            snapshot[cmd] = {
+                'sent': stats.sent,
+                'replies': stats.replies,
+                'errors': stats.errors,
+                'timeouts': stats.timeouts,
+                'bytesOut': stats.bytesOut,
+                'latencySum': stats.latency.sum,
+                'buckets': stats.latency.cumulative(),
+            }
+        return snapshot
+
+    def histogram(self, cmd):
+        """
+        Return the latency Histogram of a command, or None if it was not
+        sent.
+        """
+        stats = self._commands.get(cmd)
+        if stats is not None:
+            return stats.latency
+
+    def reset(self):
+        """
+        Forget all counts.
+        """
+        self._commands = {}
+        self.bytesIn = 0
+
+
+def _label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def prometheusText(metrics, prefix='redis_client'):
+    """
+    Format the counters of a CommandMetrics in the Prometheus text
+    exposition format.
+    """
+    snapshot = metrics.snapshot()
+    commands = sorted(snapshot)
+    lines = []
+
+    def counter(name, key, help):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help))
+        lines.append('# TYPE %s_%s counter' % (prefix, name))
+        for cmd in commands:
+            lines.append('%s_%s{command="%s"} %d' % (
+                prefix, name, _label(cmd), snapshot[cmd][key]))
+
+    counter('commands_sent_total', 'sent', 'Commands sent.')
+    counter('errors_total', 'errors',
+            'Commands failed with an error reply or without a reply.')
+    counter('timeouts_total', 'timeouts', 'Commands timed out.')
+    counter('sent_bytes_total', 'bytesOut', 'Bytes of commands sent.')
+    lines.append('# HELP %s_received_bytes_total Bytes of replies received.'
+                 % prefix)
+    lines.append('# TYPE %s_received_bytes_total counter' % prefix)
+    lines.append('%s_received_bytes_total %d' % (prefix, metrics.bytesIn))
+
+    name = prefix + '_request_duration_seconds'
+    lines.append('# HELP %s Time from sending a command to its reply.' % name)
+    lines.append('# TYPE %s histogram' % name)
+    for cmd in commands:
+        stats = snapshot[cmd]
+        command = _label(cmd)
+        for bound, count in stats['buckets']:
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s_bucket{command="%s",le="%s"} %d' % (
+                name, command, le, count))
+        lines.append('%s_sum{command="%s"} %r' % (
+            name, command, stats['latencySum']))
+        lines.append('%s_count{command="%s"} %d' % (
+            name, command, stats['replies']))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,386 @@
+"""
+@file pool.py
+
+A pool of connections to a single Redis server that spreads commands over
+its members.
+"""
+from twisted.internet import defer
+
+from txredis import exceptions
+from txredis.client import RedisClient, RedisClientFactory, RedisCommands
+
+
+# commands that may park their connection on the server
+BLOCKING_COMMANDS = frozenset([
+    'BLPOP', 'BRPOP', 'BRPOPLPUSH', 'BLMOVE', 'BZPOPMIN', 'BZPOPMAX'])
+
+# _current value marking a blocking command waiting for its lane connection
+_BLOCKING = object()
+
+
+class _PoolMemberFactory(RedisClientFactory):
+    """Reconnecting factory of one pool member that reports its connection
+    state to the pool.
+    """
+
+    def __init__(self, pool, blocking, *args, **kwargs):
+        RedisClientFactory.__init__(self, *args, **kwargs)
+        self.pool = pool
+        self.blocking = blocking
+        self.protocol = pool.protocol
+        self.connector = None
+        self.ready = False
+
+    def buildProtocol(self, addr):
+        client = RedisClientFactory.buildProtocol(self, addr)
+        self.deferred.addCallback(self.pool._clientReady)
+        return client
+
+    def clientConnectionLost(self, connector, reason):
+        self.pool._clientLost(self)
+        RedisClientFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.pool._clientLost(self)
+        RedisClientFactory.clientConnectionFailed(self, connector, reason)
+
+
+class RedisConnectionPool(RedisCommands):
+    """A pool of RedisClient connections to one server.
+
+    The pool provides the command methods of RedisClient. Each command goes
+    to the connected member with the fewest outstanding requests, so a slow
+    reply only holds up the requests queued behind it on its own
+    connection. Commands issued while no member is connected wait for the
+    first one.
+
+    The pool opens minSize connections when connect is called and adds one
+    more, up to maxSize, whenever every member has at least growPending
+    outstanding requests. Every member reconnects on its own, like a
+    RedisClientFactory.
+
+    Blocking commands (bpop, brpop, brpoplpush and the other commands in
+    BLOCKING_COMMANDS) never share a connection: each one is sent on a
+    connection of its own from a separate lane, so the requests on the
+    shared connections keep flowing while it is parked on the server. The
+    lane opens connections on demand, at most maxBlocking at a time, and
+    keeps up to maxIdleBlocking of them open between blocking commands.
+    Blocking commands beyond maxBlocking wait for a lane connection to free
+    up.
+
+    Commands that change the state of their connection (select, auth,
+    watch, multi, the pub/sub commands) are not meaningful on a pool; use
+    pipeline, transaction or transact, which keep to one connection.
+    """
+
+    protocol = RedisClient
+
+    def __init__(self, host='localhost', port=6379, minSize=1, maxSize=10,
+                 growPending=1, maxBlocking=10, maxIdleBlocking=1,
+                 reactor=None, *args, **kwargs):
+        """
+        @param host : Address of the Redis server.
+        @param port : Port of the Redis server.
+        @param minSize : Number of connections opened by connect.
+        @param maxSize : Maximum number of connections.
+        @param growPending : Open another connection when every member has
+                             at least this many outstanding requests.
+        @param maxBlocking : Maximum number of concurrent blocking commands.
+        @param maxIdleBlocking : Number of blocking lane connections kept
+                                 open while unused.
+        @param reactor : Reactor to connect with; the global one by default.
+
+        Other arguments are passed to the protocol of every member.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        if not 0 < minSize <= maxSize:
+            raise ValueError('Need 0 < minSize <= maxSize')
+        self.host = host
+        self.port = port
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.growPending = growPending
+        self.maxBlocking = maxBlocking
+        self.maxIdleBlocking = maxIdleBlocking
+        self._reactor = reactor
+        self._args = args
+        self._kwargs = kwargs
+        self._factories = []
+        self._clients = []
+        self._connecting = 0
+        self._waiting = []
+        self._readyWaiters = []
+        self._lostWaiters = []
+        self._current = None
+        self._deferredArgs = None
+        self._closed = False
+        self._requests = 0
+        self._connections = 0
+        self._blockingFactories = []
+        self._blockingIdle = []
+        self._blockingBusy = 0
+        self._blockingConnecting = 0
+        self._blockingWaiting = []
+        # Lua sources loaded by every connection, by SHA1
+        self.scripts = {}
+
+    def connect(self):
+        """
+        Open the minimum number of connections.
+
+        Returns a Deferred that fires with the pool once they are all up.
+        """
+        self._closed = False
+        while len(self._factories) < self.minSize:
+            self._addConnection()
+        return self._whenConnected(self.minSize)
+
+    def disconnect(self):
+        """
+        Close every connection and stop reconnecting. Requests waiting for a
+        connection fail with ConnectionError.
+
+        Returns a Deferred that fires once all connections are closed.
+        """
+        self._closed = True
+        waiting = self._waiting + self._blockingWaiting
+        self._waiting = []
+        self._blockingWaiting = []
+        for _, _, _, d in waiting:
+            d.errback(exceptions.ConnectionError('Connection pool closed'))
+        lost = []
+        for factory in self._factories + self._blockingFactories:
+            factory.stopTrying()
+            if factory.connector.state == 'connected':
+                d = defer.Deferred()
+                self._lostWaiters.append((factory, d))
+                lost.append(d)
+            factory.connector.disconnect()
+        self._factories = []
+        self._connecting = 0
+        self._blockingFactories = []
+        self._blockingIdle = []
+        self._blockingConnecting = 0
+        return defer.DeferredList(lost)
+
+    def stats(self):
+        """
+        Return a dict describing the pool: the number of members, connected
+        members and connections being opened, the outstanding requests per
+        connected member, the requests waiting for a connection, and the
+        totals of requests routed and connections opened, as well as the
+        number of blocking commands running and waiting and of idle blocking
+        lane connections.
+        """
+        return {
+            'size': len(self._factories),
+            'connected': len(self._clients),
+            'connecting': self._connecting,
+            'pending': [len(f.client._request_queue) for f in self._clients],
+            'waiting': len(self._waiting),
+            'requests': self._requests,
+            'connections': self._connections,
+            'blocking': self._blockingBusy,
+            'blockingWaiting': len(self._blockingWaiting),
+            'blockingIdle': len(self._blockingIdle),
+        }
+
+    def pipeline(self):
+        """
+        Start a pipeline on the least busy connection.
+        """
+        return self._pick().pipeline()
+
+    def transaction(self):
+        """
+        Start a transaction on the least busy connection.
+        """
+        return self._pick().transaction()
+
+    def transact(self, watch_keys, read, build, max_attempts=10):
+        """
+        Run an optimistic transaction on the least busy connection; see
+        RedisClient.transact.
+        """
+        return self._pick().transact(watch_keys, read, build, max_attempts)
+
+    def _pick(self):
+        """
+        Return the connected member with the fewest outstanding requests,
+        opening another connection if they are all busy.
+        """
+        if not self._clients:
+            if not self._factories and not self._closed:
+                self._addConnection()
+            raise exceptions.ConnectionError('No connection available')
+        best = None
+        fewest = None
+        for factory in self._clients:
+            pending = len(factory.client._request_queue)
+            if fewest is None or pending < fewest:
+                best = factory.client
+                fewest = pending
+                if not pending:
+                    break
+        if (fewest >= self.growPending and not self._connecting and
+                len(self._factories) < self.maxSize and not self._closed):
+            self._addConnection()
+        return best
+
+    def _send(self, *args):
+        self._requests += 1
+        if args[0] in BLOCKING_COMMANDS:
+            self._current = _BLOCKING
+            self._deferredArgs = args
+        elif self._clients:
+            self._current = self._pick()
+            self._current._send(*args)
+        else:
+            if not self._factories and not self._closed:
+                self._addConnection()
+            self._current = None
+            self._deferredArgs = args
+
+    def _queueResponse(self, method, *args):
+        client = self._current
+        self._current = None
+        if client is not None and client is not _BLOCKING:
+            return getattr(client, method)(*args)
+        if self._closed:
+            return defer.fail(
+                exceptions.ConnectionError('Connection pool closed'))
+        d = defer.Deferred()
+        if client is _BLOCKING:
+            self._blockingWaiting.append((self._deferredArgs, method, args, d))
+            self._dispatchBlocking()
+        else:
+            self._waiting.append((self._deferredArgs, method, args, d))
+        return d
+
+    def getResponse(self):
+        return self._queueResponse('getResponse')
+
+    def getStreamingResponse(self, consumer):
+        return self._queueResponse('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._queueResponse('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._queueResponse('getBatchedResponse', callback, batch_size)
+
+    def _loadScript(self, source):
+        """Load a newly registered script on the open connections."""
+        for factory in self._factories + self._blockingFactories:
+            if factory.client is not None:
+                factory.client._loadScript(source)
+
+    def _addConnection(self, blocking=False):
+        factory = _PoolMemberFactory(
+            self, blocking, *self._args, **self._kwargs)
+        factory.scripts = self.scripts
+        if blocking:
+            self._blockingFactories.append(factory)
+            self._blockingConnecting += 1
+        else:
+            self._factories.append(factory)
+            self._connecting += 1
+        factory.connector = self._reactor.connectTCP(
+            self.host, self.port, factory)
+
+    def _dispatchBlocking(self):
+        """
+        Send waiting blocking commands on idle lane connections and open
+        more lane connections for the rest, within maxBlocking.
+        """
+        waiting = self._blockingWaiting
+        while waiting and self._blockingIdle:
+            client = self._blockingIdle.pop()
+            args, method, margs, d = waiting.pop(0)
+            self._blockingBusy += 1
+            client._send(*args)
+            getattr(client, method)(*margs).addBoth(
+                self._releaseBlocking, client).chainDeferred(d)
+        missing = len(waiting) - self._blockingConnecting
+        while (missing > 0 and
+               len(self._blockingFactories) < self.maxBlocking):
+            self._addConnection(blocking=True)
+            missing -= 1
+
+    def _releaseBlocking(self, result, client):
+        self._blockingBusy -= 1
+        if (client.factory in self._blockingFactories and
+                not client._disconnected):
+            self._blockingIdle.append(client)
+            self._dispatchBlocking()
+            while len(self._blockingIdle) > self.maxIdleBlocking:
+                self._blockingIdle.pop(0).factory.connector.disconnect()
+        return result
+
+    def _whenConnected(self, count):
+        if len(self._clients) >= count:
+            return defer.succeed(self)
+        d = defer.Deferred()
+        self._readyWaiters.append((count, d))
+        return d
+
+    def _clientReady(self, client):
+        factory = client.factory
+        if factory.blocking:
+            if factory in self._blockingFactories and not factory.ready:
+                factory.ready = True
+                self._blockingConnecting -= 1
+                self._blockingIdle.append(client)
+                self._dispatchBlocking()
+            return client
+        if factory not in self._factories or factory in self._clients:
+            return client
+        self._connecting -= 1
+        self._clients.append(factory)
+        self._connections += 1
+
+        # requests issued while nothing was connected go to the first
+        # connection, in order
+        waiting, self._waiting = self._waiting, []
+        for args, method, margs, d in waiting:
+            client._send(*args)
+            getattr(client, method)(*margs).chainDeferred(d)
+
+        readyWaiters, self._readyWaiters = self._readyWaiters, []
+        for count, d in readyWaiters:
+            if len(self._clients) >= count:
+                d.callback(self)
+            else:
+                self._readyWaiters.append((count, d))
+        return client
+
+    def _clientLost(self, factory):
+        if factory.blocking:
+            self._blockingLost(factory)
+        elif factory in self._clients:
+            self._clients.remove(factory)
+            if factory in self._factories:
+                self._connecting += 1
+        lostWaiters, self._lostWaiters = self._lostWaiters, []
+        for lostFactory, d in lostWaiters:
+            if lostFactory is factory:
+                d.callback(None)
+            else:
+                self._lostWaiters.append((lostFactory, d))
+
+    def _blockingLost(self, factory):
+        # lane connections are opened on demand, never reopened
+        factory.stopTrying()
+        if factory not in self._blockingFactories:
+            return
+        self._blockingFactories.remove(factory)
+        if factory.client in self._blockingIdle:
+            self._blockingIdle.remove(factory.client)
+        if not factory.ready:
+            self._blockingConnecting -= 1
+            if self._blockingWaiting:
+                _, _, _, d = self._blockingWaiting.pop(0)
+                d.errback(exceptions.ConnectionError(
+                    'Could not open a blocking connection'))
+        self._dispatchBlocking()
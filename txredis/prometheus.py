@@ -0,0 +1,31 @@
+"""
+@file prometheus.py
+
+A twisted.web resource serving the counters of a CommandMetrics to
+Prometheus.
+
+@code
+from twisted.web import server
+
+root.putChild('metrics', MetricsResource(metrics))
+reactor.listenTCP(9090, server.Site(root))
+@endcode
+"""
+from twisted.web import resource
+
+from txredis.metrics import prometheusText
+
+
+class MetricsResource(resource.Resource):
+    """Renders a CommandMetrics in the Prometheus text format."""
+
+    isLeaf = True
+
+    def __init__(self, metrics, prefix='redis_client'):
+        resource.Resource.__init__(self)
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return prometheusText(self.metrics, self.prefix)
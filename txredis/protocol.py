@@ -37,15 +37,29 @@ Redis google code project: http://code.google.com/p/redis/
 Command doc strings taken from the CommandReference wiki page.
 
 """
+import heapq
+import itertools
 from collections import deque
 
-from twisted.internet import defer, protocol
-from twisted.protocols import policies
+from twisted.internet import defer, interfaces, protocol
+from twisted.python import failure
+from zope.interface import implementer
 
 from txredis import exceptions
+from txredis.encoder import CommandEncoder
+from txredis.hooks import combineHooks
 
 
-class RedisBase(protocol.Protocol, policies.TimeoutMixin, object):
+# whether a MULTI block is open after each of the commands opening or
+# closing one
+MULTI_STATES = {'MULTI': True, 'EXEC': False, 'DISCARD': False}
+
+# the reply consumer of requests whose bulk payload is delivered in place
+_IN_PLACE = object()
+
+
+@implementer(interfaces.IPushProducer)
+class RedisBase(protocol.Protocol, object):
     """The main Redis client."""
 
     ERROR = "-"
@@ -54,108 +68,494 @@ class RedisBase(protocol.Protocol, policies.TimeoutMixin, object):
     BULK = "$"
     MULTI_BULK = "*"
 
+    # consumed bytes kept in the receive buffer before it is compacted
+    COMPACT_THRESHOLD = 64 * 1024
+
+    # serializes outgoing commands; see txredis.encoder
+    commandEncoder = CommandEncoder
+
+    # coalesced commands are written out early once they reach this size
+    MAX_COALESCED_BYTES = 64 * 1024
+
+    # read commands that identical requests in flight share with single_flight
+    SINGLE_FLIGHT_COMMANDS = frozenset([
+        'EXISTS', 'GET', 'GETRANGE', 'HEXISTS', 'HGET', 'HGETALL', 'HKEYS',
+        'HLEN', 'HMGET', 'HVALS', 'LINDEX', 'LLEN', 'LRANGE', 'MGET',
+        'SCARD', 'SISMEMBER', 'SMEMBERS', 'STRLEN', 'TTL', 'TYPE', 'ZCARD',
+        'ZCOUNT', 'ZRANGE', 'ZRANGEBYSCORE', 'ZRANK', 'ZREVRANGE',
+        'ZREVRANGEBYSCORE', 'ZREVRANK', 'ZSCORE'])
+
     def __init__(self, db=None, password=None, charset='utf8',
-                 errors='strict'):
+                 errors='strict', zero_copy_threshold=None,
+                 coalesce_writes=False, single_flight=False,
+                 max_late_replies=10, max_in_flight=None,
+                 max_queued_bytes=None, backpressure='wait', hooks=(),
+                 slowlog=None, clock=None):
+        """
+        @param zero_copy_threshold : Bulk payloads requested with
+        getBufferResponse (see RedisClient.get_buffer) are delivered as
+        read-only C{buffer} objects. If set, only those of at least this many
+        bytes are slices of the receive buffer and smaller ones are copies;
+        otherwise all of them are slices. Other replies are never affected.
+
+        Lifetime of zero-copy payloads: once a payload has been handed out,
+        the protocol stops using the receive buffer backing it and carries on
+        with a copy of the unconsumed tail, so the payload stays valid and
+        unchanged for as long as it is referenced. Holding on to it also keeps
+        the rest of that receive buffer alive; call C{str()} on it to take a
+        compact copy if it is kept around.
+
+        @param coalesce_writes : If True, the first command issued in a
+        reactor iteration is written at once and the ones following it are
+        buffered and written with a single writeSequence at the end of the
+        iteration, or as soon as C{MAX_COALESCED_BYTES} are buffered. Lone
+        commands are therefore not delayed.
+
+        @param single_flight : If True, a command in
+        C{SINGLE_FLIGHT_COMMANDS} issued while an identical one is waiting
+        for its reply is not sent; it is given the reply of the one in
+        flight instead, and counted in C{saved_requests}. Any other command
+        ends the sharing of the requests already in flight, so that reads
+        issued after a write never get a reply from before it. Reads are
+        not shared between MULTI and the EXEC or DISCARD that ends it,
+        since each of them is queued in the transaction.
+
+        @param max_late_replies : Requests given a deadline (see
+        RedisClient.with_timeout) fail with RequestTimeout when it passes,
+        and their replies are discarded when they arrive. The connection is
+        only closed once this many timed out requests are waiting for their
+        replies; None never closes it.
+
+        @param max_in_flight : If set, commands are only written while fewer
+        requests than this are waiting for their replies. The protocol also
+        registers as a producer of its transport when a limit is set, and
+        stops writing while the transport buffer is full. The connection
+        setup commands (AUTH, SELECT and SCRIPT LOAD) are always written.
+
+        @param max_queued_bytes : If set, commands held back by these limits
+        may take up at most this many bytes; commands beyond that fail with
+        BackpressureError.
+
+        @param backpressure : 'wait' to hold commands back until they can be
+        written, their Deferreds firing once they have been answered, or
+        'fail' to fail them at once with BackpressureError.
+
+        @param hooks : Objects told about every command sent and its
+        outcome, such as a txredis.metrics.CommandMetrics; see
+        txredis.hooks.RequestHooks. The same hooks may be shared by many
+        connections.
+
+        @param slowlog : A txredis.slowlog.SlowLog the commands that take
+        long to complete are logged to; it may be shared by many
+        connections.
+
+        @param clock : Reactor to measure time and schedule the coalesced
+        writes and the deadlines with; the global one by default.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
         self.charset = charset
         self.db = db if db is not None else 0
         self.password = password
         self.errors = errors
-        self._buffer = ''
+        self._encoder = self.commandEncoder(charset, errors)
+        self._buffer = bytearray()
+        self._pos = 0
+        # bytes dropped from the front of the buffer so far
+        self._buffer_base = 0
+        self._parsing = False
         self._bulk_length = None
+        self._zero_copy_threshold = zero_copy_threshold
+        # whether the pending bulk was requested with getBufferResponse
+        self._bulk_in_place = False
+        self._reply_consumers = {}
+        self._bulk_consumer = None
+        self._write_buffer = [] if coalesce_writes else None
+        self._write_buffer_size = 0
+        self._flush_call = None
         self._disconnected = False
-        self._multi_bulk_stack = deque() # [[length-remaining, [replies] | None]]
+        self._multi_bulk_stack = [] # [[length-remaining, [replies]]]
         self._request_queue = deque()
+        self._in_flight = {} if single_flight else None
+        # whether a MULTI block is open, followed with single_flight
+        self._in_multi = False
+        # Lua sources loaded when connecting, by SHA1
+        self.scripts = {}
+        self.clock = clock
+        # deadline given to every request by setTimeout
+        self.timeOut = None
+        self.max_late_replies = max_late_replies
+        # heap of [deadline, sequence, request] entries; the request is
+        # cleared once it has fired
+        self._deadlines = []
+        self._answered_deadlines = 0
+        self._deadline_sequence = itertools.count()
+        self._deadline_call = None
+        self._expired = set()
+        self.timed_out = 0
+        self.late_replies = 0
+        if backpressure not in ('wait', 'fail'):
+            raise ValueError("backpressure must be 'wait' or 'fail'")
+        self.max_in_flight = max_in_flight
+        self.max_queued_bytes = max_queued_bytes
+        self.backpressure = backpressure
+        self._limited = (max_in_flight is not None or
+                         max_queued_bytes is not None)
+        # [data, number of requests] of the commands held back
+        self._held = deque()
+        self._held_bytes = 0
+        self._held_requests = 0
+        # whether the last commands written were held back or rejected
+        self._write_status = None
+        self._paused = False
+        self.rejected = 0
+        self._flight_args = None
+        self.saved_requests = 0
+        self.hooks = tuple(hooks)
+        # what is called for the hooks, None without any
+        self._hooks = combineHooks(self.hooks)
+        self.slowlog = slowlog
+        # one in this many requests is sampled for the hooks
+        self._hooks_sample_every = getattr(self._hooks, 'sampleEvery', 1)
+        # whether requests are followed, for the hooks or the slow log
+        self._tracked = self._hooks is not None or slowlog is not None
+        # arguments and size of the command the next getResponse is for
+        self._command_args = None
+        self._command_bytes = 0
+        # number of requests made while followed, and the numbers of the
+        # next ones sampled for the hooks, for the slow log and for either
+        self._followed = 0
+        self._hooks_next = self._slowlog_next = self._next_sample = 0
+        # [Deferred, command name, time sent, whether timed for the hooks,
+        # arguments if sampled for the slow log, queue depth, number] for
+        # each sampled request, in the order of _request_queue; the name is
+        # None once its failure has been reported
+        self._sampled = deque()
+        # while requests are sampled, the number of replies to come before
+        # that of the first one
+        self._ahead = 0
+        # where in the received data the reply of the first sampled
+        # request starts
+        self._reply_start = 0
+        # when the first data of that reply arrived, if it is logged
+        self._reply_data_at = None
+        # when the data being parsed arrived, or when the first timed reply
+        # it completed was parsed; None until either is needed
+        self._received_at = None
+        self._setChecked()
 
     def dataReceived(self, data):
         """Receive data.
 
+        Incoming data is appended to a bytearray and consumed through a read
+        cursor, so a reply that arrives in many small chunks is copied a
+        constant number of times rather than once per chunk. Consumed bytes
+        are only discarded once they cross C{COMPACT_THRESHOLD}.
+
         Spec: http://redis.io/topics/protocol
         """
-        self.resetTimeout()
-        self._buffer = self._buffer + data
+        if self._tracked:
+            self._dataArrived(data)
+        self._buffer += data
+        if self._parsing:
+            # re-entered from a callback; the outer call picks the data up
+            return
+        self._parsing = True
+        try:
+            self._parseBuffer()
+        finally:
+            self._parsing = False
+            self._compactBuffer()
 
-        while self._buffer:
+    def _dataArrived(self, data):
+        """
+        Count the data received, for connections following their requests.
 
-            # if we're expecting bulk data, read that many bytes
-            if self._bulk_length is not None:
-                # wait until there's enough data in the buffer
-                # we add 2 to _bulk_length to account for \r\n
-                if len(self._buffer) < self._bulk_length + 2:
-                    return
-                data = self._buffer[:self._bulk_length]
-                self._buffer = self._buffer[self._bulk_length + 2:]
-                self.bulkDataReceived(data)
-                continue
+        The clock is read at most once for all the replies completed by
+        data, and only if one of them is sampled: the hooks are given the
+        time it was first read for data. It is read here if the reply of a
+        request sampled for the slow log starts in data; such replies are
+        timed again when they are handed out.
+        """
+        self._received_at = None
+        if self._hooks is not None:
+            self._hooks.bytes_received(len(data))
+        sampled = self._sampled
+        if (sampled and not self._ahead and self._reply_data_at is None and
+                sampled[0][4] is not None):
+            self._reply_data_at = self._received_at = self.clock.seconds()
 
-            # wait until we have a line
-            if '\r\n' not in self._buffer:
-                return
+    def _startReply(self):
+        """
+        Note where the reply of the first sampled request, which is next,
+        starts, and when if it has begun to arrive and is to be logged.
+        """
+        self._reply_start = self._buffer_base + self._pos
+        self._reply_data_at = None
+        if self._sampled[0][4] is not None and self._hasBufferedData():
+            if self._received_at is None:
+                self._received_at = self.clock.seconds()
+            self._reply_data_at = self._received_at
 
-            # grab a line
-            line, self._buffer = self._buffer.split('\r\n', 1)
-            if len(line) == 0:
-                continue
+    def _parseBuffer(self):
+        """Consume as many complete replies as the buffer holds.
 
-            # first byte indicates reply type
-            reply_type = line[0]
-            reply_data = line[1:]
-
-            # Error message (-)
-            if reply_type == self.ERROR:
-                self.errorReceived(reply_data)
-            # Integer number (:)
-            elif reply_type == self.INTEGER:
-                self.integerReceived(reply_data)
-            # Single line (+)
-            elif reply_type == self.SINGLE_LINE:
-                self.singleLineReceived(reply_data)
-            # Bulk data (&)
-            elif reply_type == self.BULK:
-                try:
-                    self._bulk_length = int(reply_data)
-                except ValueError:
-                    r = exceptions.InvalidResponse(
-                        "Cannot convert data '%s' to integer" % reply_data)
-                    self.responseReceived(r)
-                    return
-                # requested value may not exist
-                if self._bulk_length == -1:
-                    self.bulkDataReceived(None)
-            # Multi-bulk data (*)
-            elif reply_type == self.MULTI_BULK:
-                # reply_data will contain the # of bulks we're about to get
-                try:
-                    multi_bulk_length = int(reply_data)
-                except ValueError:
-                    r = exceptions.InvalidResponse(
-                        "Cannot convert data '%s' to integer" % reply_data)
-                    self.responseReceived(r)
-                    return
-                if multi_bulk_length == -1:
-                    self._multi_bulk_stack.append([-1, None])
-                    self.multiBulkDataReceived()
-                    return
+        This is an explicit state machine: the only state carried between
+        calls is the read cursor, the length of a pending bulk and the stack
+        of partially filled multi-bulk replies. Elements of a multi-bulk are
+        appended in place and completed levels are unwound in a loop, so
+        nesting adds no Python stack frames and only complete top-level
+        replies are dispatched.
+        """
+        buf = self._buffer
+        pos = self._pos
+        stack = self._multi_bulk_stack
+        try:
+            while True:
+                if self._bulk_consumer is not None:
+                    # feed whatever part of a streamed payload has arrived
+                    if self._bulk_length:
+                        count = min(len(buf) - pos, self._bulk_length)
+                        if count:
+                            self._streamBulkData(str(buffer(buf, pos, count)))
+                            pos += count
+                            self._bulk_length -= count
+                        if self._bulk_length:
+                            return
+                    if len(buf) - pos < 2:
+                        return
+                    pos += 2
+                    self._pos = pos
+                    self._finishBulkStream()
+                    continue
+                elif self._bulk_length is not None:
+                    # wait until the payload and its \r\n are buffered
+                    length = self._bulk_length
+                    if len(buf) - pos < length + 2:
+                        return
+                    if self._bulk_in_place:
+                        self._bulk_in_place = False
+                        if (self._zero_copy_threshold is None or
+                                length >= self._zero_copy_threshold):
+                            # hand the payload out in place and detach the
+                            # buffer backing it
+                            reply = buffer(buf, pos, length)
+                            buf = self._buffer = buf[pos + length + 2:]
+                            self._buffer_base += pos + length + 2
+                            pos = 0
+                        else:
+                            reply = buffer(buf[pos:pos + length])
+                            pos += length + 2
+                    else:
+                        reply = str(buffer(buf, pos, length))
+                        pos += length + 2
+                    self._bulk_length = None
+                else:
+                    # wait until we have a line
+                    eol = buf.find('\r\n', pos)
+                    if eol == -1:
+                        return
+                    line = str(buffer(buf, pos, eol - pos))
+                    pos = eol + 2
+
+                    # first byte indicates reply type
+                    reply_type = line[:1]
+
+                    # Bulk data ($)
+                    if reply_type == self.BULK:
+                        try:
+                            length = int(line[1:])
+                        except ValueError:
+                            reply = self._invalidInteger(line[1:])
+                        else:
+                            if length >= 0:
+                                self._bulk_length = length
+                                if self._reply_consumers and not stack:
+                                    self._startBulkStream()
+                                continue
+                            # requested value may not exist
+                            reply = None
+                    # Multi-bulk data (*)
+                    elif reply_type == self.MULTI_BULK:
+                        try:
+                            length = int(line[1:])
+                        except ValueError:
+                            reply = self._invalidInteger(line[1:])
+                        else:
+                            if self._reply_consumers and not stack:
+                                elements = self._startElementBatches()
+                            else:
+                                elements = []
+                            if length > 0:
+                                stack.append([length, elements])
+                                continue
+                            reply = elements if length == 0 else None
+                    # Integer number (:)
+                    elif reply_type == self.INTEGER:
+                        try:
+                            reply = int(line[1:])
+                        except ValueError:
+                            reply = self._invalidInteger(line[1:])
+                    # Single line (+)
+                    elif reply_type == self.SINGLE_LINE:
+                        reply = line[1:]
+                        if reply == 'none':
+                            # should this happen here in the client?
+                            reply = None
+                    # Error message (-)
+                    elif reply_type == self.ERROR:
+                        if not stack:
+                            self._pos = pos
+                            if self._reply_consumers:
+                                self._reply_consumers.pop(
+                                    self._request_queue[0], None)
+                            self.errorReceived(line[1:])
+                            continue
+                        # errors inside a multi-bulk (e.g. EXEC) become
+                        # elements, as they do with hiredis
+                        reply = self.errorReply(line[1:])
+                    else:
+                        continue
+
+                # add the reply to the innermost multi-bulk, unwinding every
+                # level it completes
+                while stack:
+                    top = stack[-1]
+                    top[1].append(reply)
+                    top[0] -= 1
+                    if top[0]:
+                        break
+                    stack.pop()
+                    reply = top[1]
                 else:
-                    self._multi_bulk_stack.append([multi_bulk_length, []])
-                    if multi_bulk_length == 0:
-                        self.multiBulkDataReceived()
+                    self._pos = pos
+                    if self._reply_consumers:
+                        self._reply_consumers.pop(self._request_queue[0], None)
+                    if type(reply) is list:
+                        self.handleCompleteMultiBulkData(reply)
+                    elif type(reply) is _ElementBatches:
+                        self._finishElementBatches(reply)
+                    else:
+                        self.responseReceived(reply)
+        finally:
+            self._pos = pos
+
+    def _startBulkStream(self):
+        """
+        Stream the upcoming bulk if its request asked for a consumer, or
+        deliver it in place if it asked for a buffer.
+        """
+        if self._request_queue:
+            write = self._reply_consumers.pop(self._request_queue[0], None)
+            if write is _IN_PLACE:
+                self._bulk_in_place = True
+            elif write is not None and not isinstance(write, _ElementBatches):
+                self._bulk_consumer = write
+                self._bulk_streamed = 0
+                self._bulk_stream_error = None
+
+    def _streamBulkData(self, data):
+        """Pass part of a streamed bulk payload to its consumer."""
+        self._bulk_streamed += len(data)
+        if self._bulk_stream_error is None:
+            try:
+                self._bulk_consumer(data)
+            except Exception:
+                # keep draining the payload so later replies stay in sync
+                self._bulk_stream_error = failure.Failure()
+
+    def _finishBulkStream(self):
+        """Fire the request of a completely streamed bulk payload."""
+        d = self._popRequest()
+        error = self._bulk_stream_error
+        streamed = self._bulk_streamed
+        self._bulk_consumer = self._bulk_stream_error = None
+        self._bulk_length = None
+        if d is None:
+            return
+        if error is not None:
+            d.errback(error)
+        else:
+            d.callback(streamed)
+
+    def _startElementBatches(self):
+        """
+        Collect the upcoming multi-bulk in batches if its request asked for
+        them.
+        """
+        if self._request_queue:
+            batches = self._reply_consumers.pop(self._request_queue[0], None)
+            if isinstance(batches, _ElementBatches):
+                return batches
+        return []
+
+    def _finishElementBatches(self, batches):
+        """Fire the request of a multi-bulk that was delivered in batches."""
+        batches.flush()
+        d = self._popRequest()
+        if d is None:
+            return
+        if batches.error is not None:
+            d.errback(batches.error)
+        else:
+            d.callback(batches.count)
+
+    def _invalidInteger(self, data):
+        return exceptions.InvalidResponse(
+            "Cannot convert data '%s' to integer" % data)
+
+    def _compactBuffer(self):
+        """Drop consumed bytes from the receive buffer.
+
+        A fully consumed buffer is simply replaced; otherwise the unconsumed
+        tail is only moved to the front once the cursor has passed
+        C{COMPACT_THRESHOLD}, which keeps the total copying linear in the
+        amount of data received.
+        """
+        if self._pos >= len(self._buffer):
+            self._buffer = bytearray()
+            self._buffer_base += self._pos
+            self._pos = 0
+        elif self._pos > self.COMPACT_THRESHOLD:
+            del self._buffer[:self._pos]
+            self._buffer_base += self._pos
+            self._pos = 0
 
     def failRequests(self, reason):
+        self._reply_consumers.clear()
+        self._reply_data_at = self._received_at = None
+        sampled = self._sampled
         while self._request_queue:
             d = self._request_queue.popleft()
-            d.errback(reason)
+            if sampled and sampled[0][0] is d:
+                self._failed(sampled.popleft(), reason)
+            if not d.called:
+                d.errback(reason)
+        self._expired.clear()
 
     def connectionMade(self):
         """ Called when incoming connections is made to the server. """
-        d = defer.succeed(True)
+        if self._limited:
+            self.transport.registerProducer(self, True)
+
+        # the setup commands are sent at once, so that they run before any
+        # command sent once connected
+        setup = []
 
         # if we have a password set, make sure we auth
         if self.password:
-            d.addCallback(lambda _res: self.auth(self.password))
+            setup.append(self._sendSetup('AUTH', self.password))
 
         # select the db passsed in
         if self.db:
-            d.addCallback(lambda _res: self.select(self.db))
+            setup.append(self._sendSetup('SELECT', self.db))
+
+        d = defer.gatherResults(setup, consumeErrors=True)
+
+        # load the registered scripts before any command that runs them
+        for source in self.scripts.itervalues():
+            self._sendSetup('SCRIPT', 'LOAD', source).addErrback(
+                lambda _: None)
 
         def done_connecting(_res):
             # set our state as soon as we're properly connected
@@ -164,6 +564,23 @@ class RedisBase(protocol.Protocol, policies.TimeoutMixin, object):
 
         return d
 
+    def _sendSetup(self, *args):
+        """
+        Send a connection setup command, which is never held back or
+        rejected by the limits on the requests in flight.
+        """
+        self._transmit(self._encodeCommand(args))
+        return self.getResponse()
+
+    def _loadScript(self, source):
+        """
+        Load a newly registered script ahead of the commands that run it, if
+        connected; otherwise it is loaded when the connection is made.
+        """
+        if self.transport is not None and not self._disconnected:
+            self._sendSetup('SCRIPT', 'LOAD', source).addErrback(
+                lambda _: None)
+
     def connectionLost(self, reason):
         """Called when the connection is lost.
 
@@ -171,117 +588,502 @@ class RedisBase(protocol.Protocol, policies.TimeoutMixin, object):
 
         """
         self._disconnected = True
+        self._in_multi = False
+        if self._deadline_call is not None:
+            self._deadline_call.cancel()
+            self._deadline_call = None
+        del self._deadlines[:]
+        self._answered_deadlines = 0
+        self._held.clear()
+        self._held_bytes = self._held_requests = 0
+        self._write_status = None
+        if self._flush_call is not None:
+            self._flush_call.cancel()
+            self._flush_call = None
+        if self._write_buffer:
+            del self._write_buffer[:]
+            self._write_buffer_size = 0
         self.failRequests(reason)
 
-    def timeoutConnection(self):
-        """Called when the connection times out.
-
-        Will fail all pending requests with a TimeoutError.
+    def setTimeout(self, period):
+        """
+        Give the requests sent from now on a deadline of period seconds, as
+        with_timeout does, or none if period is None.
 
+        Unlike a connection-wide timeout, a request past its deadline fails
+        alone; see max_late_replies.
         """
-        self.failRequests(defer.TimeoutError("Connection timeout"))
-        self.transport.loseConnection()
+        self.timeOut = period
+        self._setChecked()
+
+    def errorReply(self, data):
+        """Build the exception for an error reply."""
+        if data[:9] == 'NOSCRIPT ':
+            return exceptions.NoScript(data[9:])
+        if data[:6] == 'MOVED ':
+            return exceptions.MovedError(data)
+        if data[:4] == 'ASK ':
+            return exceptions.AskError(data)
+        return exceptions.ResponseError(data)
 
     def errorReceived(self, data):
         """Error response received."""
-        if data[:9] == 'NOSCRIPT ':
-            reply = exceptions.NoScript(data[9:])
-        else:
-            reply = exceptions.ResponseError(
-                data if data[:4] == 'ERR ' else data)
+        reply = self.errorReply(data)
         if self._request_queue:
             # properly errback this reply
-            self._request_queue.popleft().errback(reply)
+            d = self._popRequest(reply)
+            if d is not None:
+                d.errback(reply)
         else:
             # we should have a request queue. if not, just raise this exception
             raise reply
 
-    def singleLineReceived(self, data):
-        """Single line response received."""
-        if data == 'none':
-            # should this happen here in the client?
-            reply = None
-        else:
-            reply = data
-
+    def handleCompleteMultiBulkData(self, reply):
         self.responseReceived(reply)
 
-    def handleMultiBulkElement(self, element):
-        top = self._multi_bulk_stack[-1]
-        top[1].append(element)
-        top[0] -= 1
-        if top[0] == 0:
-            self.multiBulkDataReceived()
+    def responseReceived(self, reply):
+        """Handle a complete server response.
 
-    def integerReceived(self, data):
-        """Integer response received."""
-        try:
-            reply = int(data)
-        except ValueError:
-            reply = exceptions.InvalidResponse(
-                "Cannot convert data '%s' to integer" % data)
-        if self._multi_bulk_stack:
-            self.handleMultiBulkElement(reply)
+        Provide the reply to the waiting request.
+
+        """
+        if self._request_queue:
+            sampled = self._sampled
+            if self._held or self._expired or sampled and self._ahead < 2:
+                d = self._popRequest()
+                if d is None:
+                    return
+            else:
+                # _popRequest without the call
+                d = self._request_queue.popleft()
+                if sampled:
+                    self._ahead -= 1
+            d.callback(reply)
+
+    def _popRequest(self, error=None):
+        """
+        Take the request the next reply is for, or None if it has timed out
+        and the reply is to be discarded.
+
+        @param error : The exception of an error reply.
+        """
+        d = self._request_queue.popleft()
+        sampled = self._sampled
+        if sampled:
+            if self._ahead:
+                self._ahead -= 1
+            else:
+                entry = sampled.popleft()
+                if sampled:
+                    self._ahead = sampled[0][6] - entry[6] - 1
+                self._replied(entry, error)
+            if sampled and not self._ahead:
+                self._startReply()
+        if self._held:
+            self._releaseHeld()
+        if self._expired and d in self._expired:
+            self._expired.discard(d)
+            self.late_replies += 1
+            return None
+        return d
+
+    def _replied(self, entry, error):
+        """Report the reply to a sampled request."""
+        _, name, sent_at, timed, args, depth, _ = entry
+        reply_data_at, self._reply_data_at = self._reply_data_at, None
+        if name is None:
             return
+        reply_size = self._replySize()
+        if timed and self._hooks is not None:
+            if error is not None:
+                self._hooks.request_failed(name, failure.Failure(error))
+            else:
+                received_at = self._received_at
+                if received_at is None:
+                    received_at = self._received_at = self.clock.seconds()
+                self._hooks.reply_received(name, received_at - sent_at,
+                                           reply_size)
+        if args is not None and self.slowlog is not None:
+            # the reply is handed out right after this; the replies ahead
+            # of it and their callbacks delayed it as well
+            now = self.clock.seconds()
+            parse_time = None
+            if reply_data_at is not None:
+                parse_time = now - reply_data_at
+            self.slowlog.record(args, depth, now - sent_at, parse_time,
+                                reply_size, error)
 
-        self.responseReceived(reply)
+    def _failed(self, entry, reason):
+        """Report that a sampled request got no reply."""
+        _, name, sent_at, timed, args, depth, _ = entry
+        if name is None:
+            return
+        if not isinstance(reason, failure.Failure):
+            reason = failure.Failure(reason)
+        if timed and self._hooks is not None:
+            self._hooks.request_failed(name, reason)
+        if args is not None and self.slowlog is not None:
+            self.slowlog.record(args, depth, self.clock.seconds() - sent_at,
+                                None, None, reason.value)
 
-    def bulkDataReceived(self, data):
-        """Bulk data response received."""
-        self._bulk_length = None
-        self.responseReceived(data)
+    def _replySize(self):
+        """Return the size of the reply of the first sampled request, just
+        parsed."""
+        return self._buffer_base + self._pos - self._reply_start
 
-    def multiBulkDataReceived(self):
-        """Multi bulk response received.
+    def _hasBufferedData(self):
+        """Whether received data is waiting to be parsed."""
+        return self._pos < len(self._buffer)
 
-        The bulks making up this response have been collected in
-        the last entry in self._multi_bulk_stack.
+    def add_hook(self, hook):
+        """
+        Tell hook about the requests sent from now on; see
+        txredis.hooks.RequestHooks.
+        """
+        self.hooks += (hook,)
+        self._setTracking()
 
+    def remove_hook(self, hook):
         """
-        reply = self._multi_bulk_stack.pop()[1]
-        if self._multi_bulk_stack:
-            self.handleMultiBulkElement(reply)
-        else:
-            self.handleCompleteMultiBulkData(reply)
+        Stop telling hook about requests.
+        """
+        self.hooks = tuple(h for h in self.hooks if h is not hook)
+        self._setTracking()
 
-    def handleCompleteMultiBulkData(self, reply):
-        self.responseReceived(reply)
+    def set_slowlog(self, slowlog):
+        """
+        Log the slow commands sent from now on to slowlog, a
+        txredis.slowlog.SlowLog, or stop logging them if None.
+        """
+        self.slowlog = slowlog
+        self._reply_data_at = None
+        self._setTracking()
 
-    def responseReceived(self, reply):
-        """Handle a server response.
+    def _setTracking(self):
+        self._hooks = combineHooks(self.hooks)
+        self._hooks_sample_every = getattr(self._hooks, 'sampleEvery', 1)
+        self._tracked = self._hooks is not None or self.slowlog is not None
+        # the next request is sampled for whatever follows requests now
+        self._hooks_next = self._slowlog_next = self._next_sample = (
+            self._followed)
+        if not self._tracked:
+            self._sampled.clear()
+            self._command_args = None
+        self._setChecked()
 
-        If we're waiting for multibulk elements, store this reply. Otherwise
-        provide the reply to the waiting request.
+    def _setChecked(self):
+        """
+        Note whether getResponse has more to do than queue a Deferred, so
+        that the options that are off cost a single test per request.
+        """
+        self._checked = (self._in_flight is not None or self._limited or
+                         self._tracked or self.timeOut is not None)
+
+    def setDeadline(self, d, timeout):
+        """
+        Fail the request d, as returned by getResponse, with RequestTimeout
+        if it has no reply within timeout seconds.
+
+        Deadlines are kept in a heap served by a single timer, rather than
+        with a delayed call per request.
+        """
+        if d.called:
+            return
+        deadline = self.clock.seconds() + timeout
+        entry = [deadline, next(self._deadline_sequence), d]
+        heapq.heappush(self._deadlines, entry)
+        d.addBoth(self._answeredDeadline, entry)
+        self._scheduleDeadlines(deadline)
 
+    def _answeredDeadline(self, result, entry):
         """
-        if self._multi_bulk_stack:
-            self.handleMultiBulkElement(reply)
-        elif self._request_queue:
-            self._request_queue.popleft().callback(reply)
+        Forget a request that fired before its deadline, so that the heap
+        does not keep it and its reply alive until the deadline passes.
+        """
+        if entry[2] is not None:
+            entry[2] = None
+            self._answered_deadlines += 1
+            heap = self._deadlines
+            if self._answered_deadlines > len(heap) // 2:
+                heap[:] = [e for e in heap if e[2] is not None]
+                heapq.heapify(heap)
+                self._answered_deadlines = 0
+        return result
+
+    def _checkDeadlines(self):
+        """Time out the requests whose deadline has passed."""
+        self._deadline_call = None
+        now = self.clock.seconds()
+        heap = self._deadlines
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            d = entry[2]
+            if d is None:
+                self._answered_deadlines -= 1
+                continue
+            entry[2] = None
+            if not d.called:
+                self._expire(d)
+        if heap:
+            self._scheduleDeadlines(heap[0][0])
+
+    def _scheduleDeadlines(self, deadline):
+        """Make sure the deadline timer runs by deadline."""
+        call = self._deadline_call
+        if call is None or deadline < call.getTime():
+            if call is not None:
+                call.cancel()
+            self._deadline_call = self.clock.callLater(
+                deadline - self.clock.seconds(), self._checkDeadlines)
+
+    def _expire(self, d):
+        """Fail a request whose deadline has passed."""
+        if self._request_queue and self._request_queue[0] is d:
+            # stop passing a reply being received on to its consumer
+            if self._bulk_consumer is not None:
+                self._bulk_consumer = lambda data: None
+            elif self._multi_bulk_stack:
+                batches = self._multi_bulk_stack[0][1]
+                if isinstance(batches, _ElementBatches):
+                    batches.callback = lambda batch: None
+        self._reply_consumers.pop(d, None)
+        self._expired.add(d)
+        self.timed_out += 1
+        error = exceptions.RequestTimeout('Request timeout')
+        for entry in self._sampled:
+            if entry[0] is d:
+                # report the timeout now rather than with the late reply
+                self._failed(entry, error)
+                entry[1] = None
+                break
+        d.errback(error)
+        if (self.max_late_replies is not None and
+                len(self._expired) >= self.max_late_replies and
+                self.transport is not None):
+            # the server is stuck or too far behind; start over
+            self.transport.loseConnection()
 
     def getResponse(self):
         """
         @retval a deferred which will fire with response from server.
         """
+        if self._checked:
+            return self._getCheckedResponse()
         if self._disconnected:
-            return defer.fail(RuntimeError("Not connected"))
+            return self._refuse(RuntimeError("Not connected"))
+        d = defer.Deferred()
+        self._request_queue.append(d)
+        return d
+
+    def _getCheckedResponse(self):
+        """
+        getResponse for connections sharing reads, limiting the requests in
+        flight, following them for the hooks and slow log or giving them
+        a deadline.
+        """
+        if self._flight_args is not None:
+            return self._getSharedResponse()
+        if self._disconnected:
+            return self._refuse(RuntimeError("Not connected"))
+        if self._write_status is not None:
+            if self._write_status == 'rejected':
+                self.rejected += 1
+                return self._refuse(exceptions.BackpressureError(
+                    'Too many requests queued'))
+            self._held[-1][1] += 1
+            self._held_requests += 1
 
         d = defer.Deferred()
         self._request_queue.append(d)
+        if self._tracked:
+            n = self._followed
+            self._followed = n + 1
+            args = self._command_args
+            if args is not None:
+                # the command is reported once it has a request to answer
+                self._command_args = None
+                if self._hooks is not None:
+                    self._hooks.command_sent(args[0].upper(), len(args) - 1,
+                                             self._command_bytes)
+                if n >= self._next_sample:
+                    self._sample(d, args, n)
+        if self.timeOut is not None:
+            self.setDeadline(d, self.timeOut)
+        return d
+
+    def _sample(self, d, args, n):
+        """
+        Follow the request d, the nth made, if it is sampled for the hooks or
+        the slow log, and work out the number of the next one sampled.
+        """
+        timed = False
+        logged = None
+        if self._hooks is not None:
+            if n >= self._hooks_next:
+                self._hooks_next = n + self._hooks_sample_every
+                timed = True
+            self._next_sample = self._hooks_next
+        if self.slowlog is not None:
+            if n >= self._slowlog_next:
+                self._slowlog_next = n + self.slowlog.sampleEvery
+                logged = args
+            if self._hooks is None or self._slowlog_next < self._next_sample:
+                self._next_sample = self._slowlog_next
+        if timed or logged is not None:
+            depth = len(self._request_queue) - 1
+            if not self._sampled:
+                self._ahead = depth
+            self._sampled.append([d, args[0].upper(), self.clock.seconds(),
+                                  timed, logged, depth, n])
+            if not depth:
+                self._startReply()
+
+    def _refuse(self, error):
+        """Fail a request that could not be sent."""
+        args, self._command_args = self._command_args, None
+        if args is not None and self._hooks is not None:
+            self._hooks.request_failed(args[0].upper(),
+                                       failure.Failure(error))
+        return defer.fail(error)
+
+    def queue_stats(self):
+        """
+        Return a dict of the numbers of requests waiting for their replies
+        (in_flight), of requests held back by the limits (held) and of the
+        bytes they take (held_bytes), of the requests rejected so far
+        (rejected), and whether the transport asked to stop writing
+        (paused).
+        """
+        return {
+            'in_flight': len(self._request_queue) - self._held_requests,
+            'held': self._held_requests,
+            'held_bytes': self._held_bytes,
+            'rejected': self.rejected,
+            'paused': self._paused,
+        }
+
+    def pauseProducing(self):
+        """The transport buffer is full: hold commands back."""
+        self._paused = True
+
+    def resumeProducing(self):
+        """The transport buffer has drained: write held commands."""
+        self._paused = False
+        self._releaseHeld()
+
+    def stopProducing(self):
+        pass
+
+    def _mustHold(self):
+        """Whether commands written now have to be held back."""
+        if self._held or self._paused:
+            return True
+        return (self.max_in_flight is not None and
+                len(self._request_queue) >= self.max_in_flight)
+
+    def _releaseHeld(self):
+        """Write held commands while the limits allow."""
+        held = self._held
+        while held and not self._paused and (
+                self.max_in_flight is None or
+                len(self._request_queue) - self._held_requests <
+                self.max_in_flight):
+            data, requests = held.popleft()
+            self._held_bytes -= len(data)
+            self._held_requests -= requests
+            self._transmit(data)
+
+    def _getSharedResponse(self):
+        """Share the reply of an identical read in flight, or send it."""
+        args, self._flight_args = self._flight_args, None
+        waiters = self._in_flight.get(args)
+        if waiters is not None:
+            self.saved_requests += 1
+            d = defer.Deferred()
+            waiters.append(d)
+            return d
+        self._writeData(self._encodeCommand(args))
+        d = self._getCheckedResponse()
+        if d.called:
+            return d
+        # the caller waits like the others, ahead of them, so that the
+        # callbacks run in the order the reads were issued
+        first = defer.Deferred()
+        waiters = self._in_flight[args] = [first]
+
+        def fan_out(result):
+            if self._in_flight.get(args) is waiters:
+                del self._in_flight[args]
+            for waiter in waiters:
+                if isinstance(result, failure.Failure):
+                    waiter.errback(result)
+                elif isinstance(result, list):
+                    # callbacks may change the list in place
+                    waiter.callback(list(result))
+                else:
+                    waiter.callback(result)
+        d.addBoth(fan_out)
+        return first
+
+    def _sendFlight(self):
+        """Send a read held back for sharing on its own."""
+        if self._flight_args is not None:
+            args, self._flight_args = self._flight_args, None
+            self._write(self._encodeCommand(args))
+
+    def getStreamingResponse(self, consumer):
+        """
+        @param consumer an object with a write method, or a callable, that is
+        given the payload of a bulk reply piece by piece as it arrives
+
+        Large payloads are never held in memory as a whole. Replies that are
+        not bulk data are delivered as by getResponse.
+
+        @retval a deferred which will fire with the number of bytes streamed,
+        or None if the value does not exist.
+        """
+        self._sendFlight()
+        d = self.getResponse()
+        if not d.called:
+            self._reply_consumers[d] = getattr(consumer, 'write', consumer)
+        return d
+
+    def getBufferResponse(self):
+        """
+        Only a bulk reply is affected; other replies, and the elements of a
+        multi-bulk, are delivered as by getResponse.
+
+        @retval a deferred which will fire with the payload of a bulk reply
+        as a read-only buffer; see zero_copy_threshold for its lifetime.
+        """
+        self._sendFlight()
+        d = self.getResponse()
+        if not d.called:
+            self._reply_consumers[d] = _IN_PLACE
+        return d
+
+    def getBatchedResponse(self, callback, batch_size):
+        """
+        @param callback called with a list of up to batch_size elements of a
+        multi-bulk reply each time that many have been parsed
+        @param batch_size number of elements per batch
+
+        Only one batch of elements is held at a time, so consumers can start
+        work before a huge reply has arrived in full. Replies that are not
+        multi-bulk are delivered as by getResponse.
+
+        @retval a deferred which will fire with the number of elements
+        delivered, or None for a null multi-bulk reply.
+        """
+        self._sendFlight()
+        d = self.getResponse()
+        if not d.called:
+            self._reply_consumers[d] = _ElementBatches(callback, batch_size)
         return d
 
     def _encode(self, s):
         """Encode a value for sending to the server."""
-        if isinstance(s, str):
-            return s
-        if isinstance(s, unicode):
-            try:
-                return s.encode(self.charset, self.errors)
-            except UnicodeEncodeError, e:
-                raise exceptions.InvalidData(
-                    "Error encoding unicode value '%s': %s" % (
-                        s.encode(self.charset, 'replace'), e))
-        return str(s)
+        return self._encoder.encodeValue(s)
 
     def _send(self, *args):
         """Encode and send a request
@@ -289,35 +1091,252 @@ class RedisBase(protocol.Protocol, policies.TimeoutMixin, object):
         Uses the 'unified request protocol' (aka multi-bulk)
 
         """
-        cmds = []
-        for i in args:
-            v = self._encode(i)
-            cmds.append('$%s\r\n%s\r\n' % (len(v), v))
-        cmd = '*%s\r\n' % len(args) + ''.join(cmds)
-        self.transport.write(cmd)
+        if self._in_flight is not None:
+            name = args[0].upper()
+            if name in self.SINGLE_FLIGHT_COMMANDS and not self._in_multi:
+                # sent by getResponse unless an identical read is in flight
+                self._flight_args = args
+                return
+            self._in_multi = MULTI_STATES.get(name, self._in_multi)
+        # _encodeCommand without the call
+        data = self._encoder.encode(args)
+        if self._tracked:
+            self._command_args = args
+            self._command_bytes = len(data)
+        self._write(data)
+
+    def _encodeCommand(self, args):
+        """Encode a command, noting it for the hooks and slow log."""
+        data = self._encoder.encode(args)
+        if self._tracked:
+            self._command_args = args
+            self._command_bytes = len(data)
+        return data
+
+    def _write(self, data):
+        """Write encoded commands; this ends the sharing of reads."""
+        if self._in_flight:
+            self._in_flight.clear()
+        if self._limited:
+            self._writeLimited(data)
+        elif self._write_buffer is not None:
+            self._coalesce(data)
+        else:
+            self.transport.write(data)
+
+    def _writeData(self, data):
+        """Write encoded commands without ending the sharing of reads."""
+        if self._limited:
+            self._writeLimited(data)
+        else:
+            self._transmit(data)
+
+    def _writeLimited(self, data):
+        """_writeData for connections limiting the requests in flight."""
+        self._write_status = None
+        if self._mustHold():
+            if (self.backpressure == 'fail' or
+                    self.max_queued_bytes is not None and
+                    self._held_bytes + len(data) > self.max_queued_bytes):
+                self._write_status = 'rejected'
+                return
+            self._held.append([data, 0])
+            self._held_bytes += len(data)
+            self._write_status = 'held'
+            return
+        self._transmit(data)
+
+    def _transmit(self, data):
+        """Write encoded commands without holding them back."""
+        if self._write_buffer is None:
+            self.transport.write(data)
+        else:
+            self._coalesce(data)
+
+    def _coalesce(self, data):
+        """_transmit for connections coalescing their writes."""
+        if self._flush_call is None:
+            # first command of this iteration; buffer the ones after it
+            self.transport.write(data)
+            self._flush_call = self.clock.callLater(0, self.flushWrites)
+            return
+        self._write_buffer.append(data)
+        self._write_buffer_size += len(data)
+        if self._write_buffer_size >= self.MAX_COALESCED_BYTES:
+            self.flushWrites()
+
+    def flushWrites(self):
+        """Write out all coalesced commands at once."""
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if self._write_buffer:
+            data = self._write_buffer
+            self._write_buffer = []
+            self._write_buffer_size = 0
+            self.transport.writeSequence(data)
 
     def send(self, command, *args):
         self._send(command, *args)
         return self.getResponse()
 
 
+class _ElementBatches(list):
+    """The elements of a multi-bulk reply that is passed on in batches.
+
+    Used as the reply's frame on the parser stack, so elements are appended
+    to it like any other multi-bulk and handed to the callback whenever a
+    batch is full.
+    """
+
+    def __init__(self, callback, size):
+        list.__init__(self)
+        self.callback = callback
+        self.size = size
+        self.count = 0
+        self.error = None
+
+    def append(self, element):
+        list.append(self, element)
+        if len(self) >= self.size:
+            self.flush()
+
+    def flush(self):
+        """Pass the collected elements on to the callback."""
+        if not self:
+            return
+        batch = self[:]
+        del self[:]
+        self.count += len(batch)
+        if self.error is None:
+            try:
+                self.callback(batch)
+            except Exception:
+                # keep parsing the reply so later replies stay in sync
+                self.error = failure.Failure()
+
+
 class HiRedisBase(RedisBase):
     """A subclass of the RedisBase protocol that uses the hiredis library for
     parsing.
     """
 
+    # while requests are sampled, the last reply parsed, whose size is
+    # estimated if it is for one of them
+    _reply = None
+
     def dataReceived(self, data):
         """Receive data.
         """
-        self.resetTimeout()
+        if self._tracked:
+            self._dataArrived(data)
         if data:
             self._reader.feed(data)
         res = self._reader.gets()
         while res is not False:
+            if self._sampled:
+                self._reply = res
             if isinstance(res, exceptions.ResponseError):
-                self._request_queue.popleft().errback(res)
+                error = self.errorReply(res.args[0])
+                d = self._popRequest(error)
+            else:
+                error = None
+                d = self._popRequest()
+            if d is None:
+                pass
+            elif error is not None:
+                d.errback(error)
             else:
                 if isinstance(res, basestring) and res == 'none':
                     res = None
-                self._request_queue.popleft().callback(res)
+                d.callback(res)
             res = self._reader.gets()
+        self._reply = None
+
+    def _replySize(self):
+        """hiredis does not tell where replies end, so the size is estimated
+        from the parsed reply."""
+        return replySize(self._reply)
+
+    def _hasBufferedData(self):
+        return self._reader.has_data()
+
+    def getStreamingResponse(self, consumer):
+        """
+        hiredis only hands out complete replies, so the consumer is given
+        the whole payload at once.
+        """
+        return self.getResponse().addCallback(streamCompleteValue(consumer))
+
+    def getBufferResponse(self):
+        """
+        hiredis only hands out str replies, so the payload is wrapped in a
+        buffer once it has arrived.
+        """
+        return self.getResponse().addCallback(bufferCompleteValue)
+
+    def getBatchedResponse(self, callback, batch_size):
+        """
+        hiredis only hands out complete replies, so the batches are cut from
+        the whole reply once it has arrived.
+        """
+        return self.getResponse().addCallback(
+            batchCompleteList(callback, batch_size))
+
+
+def replySize(reply):
+    """
+    Estimate the size of a parsed reply in the unified protocol, counting
+    status replies as bulk strings.
+    """
+    if isinstance(reply, str):
+        return len(reply) + len(str(len(reply))) + 5
+    if reply is None:
+        return 5
+    if isinstance(reply, (int, long)):
+        return len(str(reply)) + 3
+    if isinstance(reply, list):
+        return len(str(len(reply))) + 3 + sum(replySize(r) for r in reply)
+    if isinstance(reply, Exception):
+        return len(str(reply.args[0])) + 3
+    return len(reply) + len(str(len(reply))) + 5
+
+
+def streamCompleteValue(consumer):
+    """
+    Build a callback that passes a complete bulk value to a stream consumer
+    in one piece, for replies that cannot be streamed as they arrive.
+    """
+    write = getattr(consumer, 'write', consumer)
+
+    def stream(value):
+        if isinstance(value, str):
+            write(value)
+            return len(value)
+        return value
+    return stream
+
+
+def bufferCompleteValue(value):
+    """
+    Wrap a complete bulk value in a buffer, for replies that cannot be
+    delivered in place.
+    """
+    if isinstance(value, str):
+        return buffer(value)
+    return value
+
+
+def batchCompleteList(callback, batch_size):
+    """
+    Build a callback that cuts a complete multi-bulk value into batches, for
+    replies that cannot be batched as they arrive.
+    """
+    def batch(elements):
+        if not isinstance(elements, list):
+            return elements
+        for i in xrange(0, len(elements), batch_size):
+            callback(elements[i:i + batch_size])
+        return len(elements)
+    return batch
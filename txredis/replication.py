@@ -0,0 +1,217 @@
+"""
+@file replication.py
+
+Read/write splitting between a Redis master and its replicas.
+"""
+import random
+
+from twisted.internet import error
+
+from txredis import exceptions
+from txredis.routing import RoutingClient
+
+
+# commands that only read data, and can be served by a replica
+READ_COMMANDS = frozenset([
+    'BITCOUNT', 'DBSIZE', 'EXISTS', 'GET', 'GETBIT', 'GETRANGE', 'HEXISTS',
+    'HGET', 'HGETALL', 'HKEYS', 'HLEN', 'HMGET', 'HSCAN', 'HVALS', 'KEYS',
+    'LINDEX', 'LLEN', 'LRANGE', 'MGET', 'RANDOMKEY', 'SCAN', 'SCARD',
+    'SDIFF', 'SINTER', 'SISMEMBER', 'SMEMBERS', 'SRANDMEMBER', 'SSCAN',
+    'STRLEN', 'SUNION', 'TTL', 'TYPE', 'ZCARD', 'ZCOUNT', 'ZRANGE',
+    'ZRANGEBYSCORE', 'ZRANK', 'ZREVRANGE', 'ZREVRANGEBYSCORE', 'ZREVRANK',
+    'ZSCAN', 'ZSCORE'])
+
+# error replies of a replica that can't serve reads at the moment
+_UNAVAILABLE_REPLIES = ('LOADING', 'MASTERDOWN')
+
+
+def _unavailable(reason):
+    """
+    Whether a failed request means its server can't serve requests.
+    """
+    if reason.check(exceptions.ConnectionError, error.ConnectionClosed,
+                    error.ConnectError):
+        return True
+    if reason.check(RuntimeError):
+        # raised by RedisBase.getResponse when not connected
+        return True
+    if reason.check(exceptions.ResponseError):
+        return str(reason.value).startswith(_UNAVAILABLE_REPLIES)
+    return False
+
+
+def _connected(client):
+    """
+    Whether a RedisClient, or any member of a RedisConnectionPool, is
+    connected.
+    """
+    stats = getattr(client, 'stats', None)
+    if stats is not None:
+        return stats()['connected'] > 0
+    return not getattr(client, '_disconnected', False)
+
+
+class ReplicatedRedis(RoutingClient):
+    """Client sending writes to a master and reads to its replicas.
+
+    Commands in READ_COMMANDS go to a healthy replica, picked at random
+    with a weight inversely proportional to an exponentially weighted
+    moving average of its observed latency; all other commands go to the
+    master. A replica whose connection fails, or that answers LOADING or
+    MASTERDOWN, is left out for retryInterval seconds and the read is sent
+    to the master instead; reads go to the master while no replica is
+    healthy. A replica that is not connected is not healthy either.
+
+    Reads between MULTI and the EXEC or DISCARD that ends it always go to
+    the master, which queues them in the transaction. With pinReads, reads
+    also go to the master between WATCH and the EXEC, DISCARD or UNWATCH
+    that ends it, so that they see the data the transaction is checked
+    against. This needs a master client with a single connection; with a
+    RedisConnectionPool as master, use transaction or transact, which run
+    on one master connection.
+    """
+
+    def __init__(self, master, replicas=(), pinReads=True, alpha=0.2,
+                 retryInterval=5, reactor=None):
+        """
+        @param master : The client (RedisClient, RedisConnectionPool, ...)
+                        of the master.
+        @param replicas : The clients of the replicas.
+        @param pinReads : Send reads to the master after WATCH.
+        @param alpha : Weight of the newest sample in the latency averages.
+        @param retryInterval : Seconds an unavailable replica is left out.
+        @param reactor : Reactor to measure time with; the global one by
+                         default.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.master = master
+        self.replicas = list(replicas)
+        self.pinReads = pinReads
+        self.alpha = alpha
+        self.retryInterval = retryInterval
+        self._reactor = reactor
+        self._random = random.Random()
+        self._latency = {}
+        self._downUntil = {}
+        self._watching = False
+        self._inMulti = False
+        self._currentArgs = None
+
+    def latency(self, replica):
+        """
+        Return the average latency of a replica in seconds, or None if it
+        has not served a read yet.
+        """
+        return self._latency.get(replica)
+
+    def healthyReplicas(self):
+        """
+        Return the replicas that reads can currently be sent to.
+        """
+        now = self._reactor.seconds()
+        return [replica for replica in self.replicas
+                if self._downUntil.get(replica, 0) <= now and
+                _connected(replica)]
+
+    def pipeline(self):
+        """
+        Start a pipeline on the master.
+        """
+        return self.master.pipeline()
+
+    def transaction(self):
+        """
+        Start a transaction on the master.
+        """
+        return self.master.transaction()
+
+    def transact(self, watch_keys, read, build, max_attempts=10):
+        """
+        Run an optimistic transaction on the master; see
+        RedisClient.transact.
+        """
+        return self.master.transact(watch_keys, read, build, max_attempts)
+
+    def _pickReplica(self):
+        """
+        Pick a healthy replica, or return None if there is none.
+        """
+        replicas = self.healthyReplicas()
+        if len(replicas) < 2:
+            return replicas and replicas[0] or None
+        latencies = [self._latency.get(replica) for replica in replicas]
+        known = [latency for latency in latencies if latency is not None]
+        # replicas without samples yet are weighted like the fastest one
+        default = known and min(known) or 0
+        weights = [1.0 / max(default if latency is None else latency, 1e-6)
+                   for latency in latencies]
+        point = self._random.random() * sum(weights)
+        for replica, weight in zip(replicas, weights):
+            point -= weight
+            if point < 0:
+                return replica
+        return replicas[-1]
+
+    def _route(self, args):
+        name = args[0].upper()
+        if name in ('WATCH', 'MULTI'):
+            if name == 'WATCH':
+                self._watching = True
+            else:
+                self._inMulti = True
+        elif name in ('EXEC', 'DISCARD'):
+            self._watching = self._inMulti = False
+        elif name == 'UNWATCH':
+            self._watching = False
+        elif name in READ_COMMANDS and not self._inMulti and not (
+                self.pinReads and self._watching):
+            replica = self._pickReplica()
+            if replica is not None:
+                return replica
+        return self.master
+
+    def _send(self, *args):
+        RoutingClient._send(self, *args)
+        self._currentArgs = args
+
+    def _respond(self, method, *margs):
+        client = self._routed()
+        d = getattr(client, method)(*margs)
+        if client is self.master:
+            return d
+        start = self._reactor.seconds()
+        return d.addCallbacks(self._replied, self._replicaFailed,
+                              (client, start),
+                              errbackArgs=(client, self._currentArgs, method,
+                                           margs))
+
+    def getResponse(self):
+        return self._respond('getResponse')
+
+    def getStreamingResponse(self, consumer):
+        return self._respond('getStreamingResponse', consumer)
+
+    def getBufferResponse(self):
+        return self._respond('getBufferResponse')
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._respond('getBatchedResponse', callback, batch_size)
+
+    def _replied(self, result, replica, start):
+        sample = self._reactor.seconds() - start
+        average = self._latency.get(replica)
+        if average is None:
+            self._latency[replica] = sample
+        else:
+            self._latency[replica] = (
+                self.alpha * sample + (1 - self.alpha) * average)
+        return result
+
+    def _replicaFailed(self, reason, replica, args, method, margs):
+        if not _unavailable(reason):
+            return reason
+        self._downUntil[replica] = (
+            self._reactor.seconds() + self.retryInterval)
+        self.master._send(*args)
+        return getattr(self.master, method)(*margs)
@@ -0,0 +1,200 @@
+"""
+@file routing.py
+
+Support for clients that spread commands over several connections: finding
+the keys a command operates on, and a base class that sends each command to
+the connection picked for it.
+"""
+from twisted.internet import defer
+
+from txredis import exceptions
+from txredis.client import RedisCommands
+
+
+# commands that operate on no key
+KEYLESS_COMMANDS = frozenset([
+    'ASKING', 'AUTH', 'BGREWRITEAOF', 'BGSAVE', 'CLUSTER', 'CONFIG',
+    'DBSIZE', 'DISCARD', 'ECHO', 'EXEC', 'FLUSHALL', 'FLUSHDB', 'INFO',
+    'KEYS', 'LASTSAVE', 'MULTI', 'PING', 'PSUBSCRIBE', 'PUBLISH',
+    'PUNSUBSCRIBE', 'QUIT', 'RANDOMKEY', 'SAVE', 'SCAN', 'SCRIPT', 'SELECT',
+    'SHUTDOWN', 'SLAVEOF', 'SUBSCRIBE', 'UNSUBSCRIBE', 'UNWATCH'])
+
+# commands whose arguments are all keys
+ALL_KEYS_COMMANDS = frozenset([
+    'DEL', 'EXISTS', 'MGET', 'RENAME', 'RENAMENX', 'RPOPLPUSH', 'SDIFF',
+    'SDIFFSTORE', 'SINTER', 'SINTERSTORE', 'SUNION', 'SUNIONSTORE', 'TOUCH',
+    'UNLINK', 'WATCH'])
+
+
+def commandKeys(args):
+    """
+    Return the list of keys a command operates on.
+    @param args : The command name and its arguments, as given to _send.
+    """
+    name = args[0].upper()
+    if name in KEYLESS_COMMANDS:
+        return []
+    if name in ALL_KEYS_COMMANDS:
+        return list(args[1:])
+    if name in ('MSET', 'MSETNX'):
+        return list(args[1::2])
+    if name in ('BLPOP', 'BRPOP'):
+        return list(args[1:-1])
+    if name in ('BRPOPLPUSH', 'SMOVE'):
+        return list(args[1:3])
+    if name in ('ZUNIONSTORE', 'ZINTERSTORE'):
+        return [args[1]] + list(args[3:3 + int(args[2])])
+    if name in ('EVAL', 'EVALSHA'):
+        return list(args[3:3 + int(args[2])])
+    if name == 'OBJECT':
+        return list(args[2:3])
+    return list(args[1:2])
+
+
+def hashTag(key):
+    """
+    Return the part of key that decides where it is stored: the hash tag,
+    the text between the first '{' and the next '}', if it is not empty, or
+    else the whole key.
+    """
+    if not isinstance(key, basestring):
+        key = str(key)
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class RoutingClient(RedisCommands):
+    """Base for clients that send each command to one of several clients.
+
+    Subclasses implement _route, which is given the command arguments and
+    returns the client (a RedisClient, a RedisConnectionPool or another
+    RedisCommands provider) to send the command to.
+    """
+
+    _current = None
+
+    def _route(self, args):
+        raise NotImplementedError
+
+    def _send(self, *args):
+        client = self._route(args)
+        client._send(*args)
+        self._current = client
+
+    def _routed(self):
+        client = self._current
+        if client is None:
+            raise exceptions.InvalidCommand('No command was sent')
+        self._current = None
+        return client
+
+    def getResponse(self):
+        return self._routed().getResponse()
+
+    def getStreamingResponse(self, consumer):
+        return self._routed().getStreamingResponse(consumer)
+
+    def getBufferResponse(self):
+        return self._routed().getBufferResponse()
+
+    def getBatchedResponse(self, callback, batch_size):
+        return self._routed().getBatchedResponse(callback, batch_size)
+
+
+class SplittingClient(RoutingClient):
+    """Base for clients that store every key in one of several groups, such
+    as the nodes of a hash ring or the slots of a cluster.
+
+    A command is sent to the client of the group of its keys; if its keys
+    belong to different groups, InvalidCommand is raised, except for mget,
+    delete and mset, which split their keys per group, send the parts in
+    parallel and merge the replies. Subclasses implement _group, returning
+    the group of a key, and _groupClient, returning the client of a group.
+    """
+
+    def _group(self, key):
+        raise NotImplementedError
+
+    def _groupClient(self, group):
+        raise NotImplementedError
+
+    def _route(self, args):
+        keys = commandKeys(args)
+        if not keys:
+            raise exceptions.InvalidCommand(
+                '%s has no key to route by' % args[0])
+        group = self._group(keys[0])
+        for key in keys[1:]:
+            if self._group(key) != group:
+                raise exceptions.InvalidCommand(
+                    'The keys of %s belong to different nodes' % args[0])
+        return self._groupClient(group)
+
+    def _split(self, keys):
+        """
+        Group keys.
+
+        Returns a list of the lists of positions of the keys in each group.
+        """
+        parts = {}
+        for i, key in enumerate(keys):
+            parts.setdefault(self._group(key), []).append(i)
+        return parts.values()
+
+    def mget(self, *args):
+        """
+        Get the values of all the given keys, from all their groups at once
+        """
+        parts = self._split(args)
+        if len(parts) < 2:
+            return RoutingClient.mget(self, *args)
+
+        def merge(replies):
+            values = [None] * len(args)
+            for positions, reply in zip(parts, replies):
+                for i, value in zip(positions, reply):
+                    values[i] = value
+            return values
+        return _gather([self.mget(*[args[i] for i in positions])
+                        for positions in parts]).addCallback(merge)
+
+    def delete(self, key, *keys):
+        """
+        Delete one or more keys from all their groups at once
+        """
+        keys = (key,) + keys
+        parts = self._split(keys)
+        if len(parts) < 2:
+            return RoutingClient.delete(self, *keys)
+        return _gather([self.delete(*[keys[i] for i in positions])
+                        for positions in parts]).addCallback(sum)
+
+    def mset(self, mapping, preserve=False):
+        """
+        Set multiple keys to multiple values in all their groups at once.
+        With preserve (MSETNX), which is atomic, the keys must all belong
+        to the same group.
+        """
+        items = mapping.items()
+        parts = self._split([k for k, _ in items])
+        if preserve or len(parts) < 2:
+            return RoutingClient.mset(self, mapping, preserve)
+        return _gather([self.mset(dict(items[i] for i in positions))
+                        for positions in parts]
+                       ).addCallback(lambda replies: replies[0])
+
+
+def _gather(deferreds):
+    """
+    Wait for the replies of all parts; fail with the first error if any
+    part fails.
+    """
+    def unwrap(reason):
+        reason.trap(defer.FirstError)
+        return reason.value.subFailure
+    return defer.gatherResults(deferreds, consumeErrors=True).addErrback(
+        unwrap)
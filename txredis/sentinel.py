@@ -0,0 +1,250 @@
+"""
+@file sentinel.py
+
+Master discovery and failover through Redis Sentinel.
+"""
+from twisted.internet import defer, protocol
+from twisted.internet.protocol import ReconnectingClientFactory
+
+from txredis import exceptions
+from txredis.client import RedisClient, RedisClientFactory, RedisSubscriber
+
+
+def discoverMaster(sentinels, serviceName, reactor=None):
+    """
+    Ask Sentinels, in turn, for the address of the current master of a
+    service.
+    @param sentinels : List of (host, port) addresses of Sentinels.
+    @param serviceName : Name of the service the Sentinels monitor.
+
+    Returns a Deferred that fires with the (host, port) address of the
+    master given by the first Sentinel that knows it, or fails with
+    ConnectionError if none does.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    creator = protocol.ClientCreator(reactor, RedisClient)
+
+    def ask(client):
+        def close(result):
+            client.transport.loseConnection()
+            return result
+        return client.sentinel_get_master_addr_by_name(
+            serviceName).addBoth(close)
+
+    def tryNext(result, remaining):
+        if result is not None and not isinstance(result, Exception):
+            return result
+        if not remaining:
+            raise exceptions.ConnectionError(
+                'No Sentinel knows the master of %s' % serviceName)
+        host, port = remaining[0]
+        d = creator.connectTCP(host, port).addCallback(ask)
+        return d.addErrback(lambda reason: reason.value).addCallback(
+            tryNext, remaining[1:])
+
+    return tryNext(None, list(sentinels))
+
+
+class _SentinelWatcher(RedisSubscriber):
+    """Subscription to the master switches announced by a Sentinel."""
+
+    def connectionMade(self):
+        d = RedisSubscriber.connectionMade(self)
+        self.subscribe('+switch-master')
+        self.factory.owner._watcherConnected()
+        return d
+
+    def messageReceived(self, channel, message):
+        name, _, _, host, port = message.split()
+        owner = self.factory.owner
+        if name == owner.serviceName:
+            owner.masterSwitched((host, int(port)))
+
+
+class _SentinelWatcherFactory(ReconnectingClientFactory):
+    """Keeps a subscription to one of the Sentinels, moving on to the next
+    one whenever the connection fails.
+    """
+
+    protocol = _SentinelWatcher
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.client = None
+        self._next = 0
+        self._lostWaiters = []
+
+    def buildProtocol(self, addr):
+        self.client = ReconnectingClientFactory.buildProtocol(self, addr)
+        self.resetDelay()
+        return self.client
+
+    def _rotate(self, connector):
+        sentinels = self.owner.sentinels
+        self._next = (self._next + 1) % len(sentinels)
+        connector.host, connector.port = sentinels[self._next]
+
+    def clientConnectionLost(self, connector, reason):
+        self.client = None
+        _fireLost(self)
+        self._rotate(connector)
+        ReconnectingClientFactory.clientConnectionLost(
+            self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        self._rotate(connector)
+        ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
+
+
+class SentinelClientFactory(RedisClientFactory):
+    """A RedisClientFactory that connects to the master of a service
+    monitored by Redis Sentinel.
+
+    connect asks the Sentinels for the address of the master and connects
+    to it. The factory stays subscribed to +switch-master on one of the
+    Sentinels; when the master of the service changes, it drops the
+    connection to the old master and connects to the new one at once,
+    without waiting for a reconnection delay. Whenever the connection is
+    lost for another reason, the address of the master is asked for again
+    before reconnecting.
+
+    Every connection runs the connection setup of its protocol (AUTH and
+    SELECT for the password and db given). Requests waiting for a reply
+    when a connection is lost fail, as they may or may not have been run;
+    the new client is passed to the Deferred in the deferred attribute, as
+    with RedisClientFactory.
+    """
+
+    def __init__(self, sentinels, serviceName, reactor=None, *args,
+                 **kwargs):
+        """
+        @param sentinels : List of (host, port) addresses of Sentinels.
+        @param serviceName : Name of the service the Sentinels monitor.
+        @param reactor : Reactor to connect and wait between reconnections
+                         with; the global one by default.
+
+        Other arguments are passed to the protocol.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        RedisClientFactory.__init__(self, *args, **kwargs)
+        self.sentinels = list(sentinels)
+        self.serviceName = serviceName
+        self.address = None
+        self.clock = reactor
+        self._reactor = reactor
+        self._switching = False
+        self._watcher = _SentinelWatcherFactory(self)
+        self._watcher.clock = reactor
+        self._watcherConnector = None
+        self._lostWaiters = []
+
+    def connect(self):
+        """
+        Connect to the current master of the service and start following
+        its switches.
+
+        Returns a Deferred that fires with the client once connected, or
+        fails with ConnectionError if no Sentinel knows the master. In that
+        case the factory connects as soon as a Sentinel announces a master,
+        and passes the client to the Deferred then in the deferred
+        attribute.
+        """
+        d = self.deferred
+        self.resetDelay()
+        host, port = self.sentinels[0]
+        self._watcherConnector = self._reactor.connectTCP(
+            host, port, self._watcher)
+
+        def notFound(reason):
+            self.deferred = defer.Deferred()
+            d.errback(reason)
+
+        discovered = discoverMaster(
+            self.sentinels, self.serviceName, self._reactor)
+        discovered.addCallbacks(self.masterSwitched, notFound)
+        return d
+
+    def disconnect(self):
+        """
+        Close the connections to the master and the Sentinel and stop
+        reconnecting.
+
+        Returns a Deferred that fires once they are closed.
+        """
+        lost = []
+        for factory, connector in ((self, self.connector),
+                                   (self._watcher, self._watcherConnector)):
+            factory.stopTrying()
+            if connector is None:
+                continue
+            if connector.state == 'connected':
+                d = defer.Deferred()
+                factory._lostWaiters.append(d)
+                lost.append(d)
+            connector.disconnect()
+        return defer.DeferredList(lost)
+
+    def masterSwitched(self, address):
+        """
+        Called when the master of the service moves to address.
+        """
+        if address == self.address:
+            return
+        self.address = address
+        connector = self.connector
+        if not self.continueTrying:
+            return
+        if connector is None:
+            # first connection, or the master was not found by connect
+            self.connector = self._reactor.connectTCP(
+                address[0], address[1], self)
+            return
+        connector.host, connector.port = address
+        if connector.state == 'disconnected':
+            # waiting for a reconnection delay: connect now
+            if self._callID is not None:
+                self._callID.cancel()
+            self.resetDelay()
+            connector.connect()
+        else:
+            self._switching = True
+            connector.disconnect()
+
+    def _watcherConnected(self):
+        # switches may have been missed while not subscribed
+        if self.address is not None:
+            self._rediscover()
+
+    def _rediscover(self):
+        d = discoverMaster(self.sentinels, self.serviceName, self._reactor)
+        d.addCallbacks(self.masterSwitched, lambda _: None)
+
+    def _reconnect(self, connector):
+        if self._switching:
+            self._switching = False
+            if self.continueTrying:
+                self.resetDelay()
+                connector.connect()
+            return True
+        if self.continueTrying:
+            self._rediscover()
+        return False
+
+    def clientConnectionLost(self, connector, reason):
+        _fireLost(self)
+        if not self._reconnect(connector):
+            RedisClientFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        if not self._reconnect(connector):
+            RedisClientFactory.clientConnectionFailed(
+                self, connector, reason)
+
+
+def _fireLost(factory):
+    waiters, factory._lostWaiters = factory._lostWaiters, []
+    for d in waiters:
+        d.callback(None)
@@ -0,0 +1,128 @@
+"""
+@file sharding.py
+
+Client side sharding of keys over independent Redis nodes with a consistent
+hash ring.
+"""
+import bisect
+import hashlib
+import struct
+
+from txredis import exceptions
+from txredis.routing import SplittingClient, hashTag
+
+
+class HashRing(object):
+    """A ketama consistent hash ring.
+
+    Every node is placed on the ring at a number of points proportional to
+    its weight; a key belongs to the node at the first point following the
+    hash of the key. Adding or removing one of N nodes only moves about 1/N
+    of the keys.
+    """
+
+    def __init__(self, replicas=160):
+        """
+        @param replicas : Number of points per node of weight 1, a multiple
+                          of 4.
+        """
+        self.replicas = replicas
+        self.weights = {}
+        self._points = []
+        self._nodes = []
+
+    def __len__(self):
+        return len(self.weights)
+
+    def add_node(self, name, weight=1):
+        """
+        Add a node, or change the weight of a node already on the ring.
+        """
+        self.weights[name] = weight
+        self._build()
+
+    def remove_node(self, name):
+        """
+        Remove a node from the ring.
+        """
+        del self.weights[name]
+        self._build()
+
+    def get_node(self, key):
+        """
+        Return the name of the node key belongs to.
+        """
+        if not self._points:
+            raise exceptions.RedisError('The hash ring has no nodes')
+        i = bisect.bisect(self._points, self._hash(key))
+        if i == len(self._points):
+            i = 0
+        return self._nodes[i]
+
+    def _hash(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf8')
+        return struct.unpack('<I', hashlib.md5(str(key)).digest()[:4])[0]
+
+    def _build(self):
+        ring = []
+        for name, weight in self.weights.iteritems():
+            for i in xrange(int(self.replicas * weight) // 4):
+                digest = hashlib.md5('%s-%d' % (name, i)).digest()
+                for point in struct.unpack('<4I', digest):
+                    ring.append((point, name))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._nodes = [name for _, name in ring]
+
+
+class ShardedRedis(SplittingClient):
+    """Client spreading keys over independent Redis nodes.
+
+    Commands that operate on a single key, or on keys that all map to the
+    same node, are sent to that node. Keys that share a hash tag, such as
+    '{user42}:name' and '{user42}:email', always map to the same node. mget,
+    delete and mset split their keys per node, send the parts to the nodes
+    in parallel and merge the results. Other commands on keys of several
+    nodes, and commands without keys, raise InvalidCommand; the clients of
+    the nodes are available in the nodes attribute for those.
+    """
+
+    def __init__(self, nodes=None, replicas=160):
+        """
+        @param nodes : Dict mapping node names to the clients (RedisClient,
+                       RedisConnectionPool, ...) of the nodes. The names
+                       place the nodes on the ring, so they must stay the
+                       same for the keys to stay on their nodes.
+        @param replicas : Number of ring points per node.
+        """
+        self.nodes = {}
+        self.ring = HashRing(replicas)
+        for name, client in (nodes or {}).iteritems():
+            self.add_node(name, client)
+
+    def add_node(self, name, client, weight=1):
+        """
+        Add a node; about a 1/N share of the keys moves to it.
+        """
+        self.nodes[name] = client
+        self.ring.add_node(name, weight)
+
+    def remove_node(self, name):
+        """
+        Remove a node; its keys move to the remaining nodes.
+        """
+        self.ring.remove_node(name)
+        del self.nodes[name]
+
+    def node_for(self, key):
+        """
+        Return the client of the node key belongs to.
+        """
+        return self.nodes[self.ring.get_node(hashTag(key))]
+
+    def _group(self, key):
+        return self.ring.get_node(hashTag(key))
+
+    def _groupClient(self, name):
+        return self.nodes[name]
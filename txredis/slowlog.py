@@ -0,0 +1,128 @@
+"""
+@file slowlog.py
+
+A log of the commands that took a client long to complete.
+
+Unlike the server's SLOWLOG, which only times the execution of commands, the
+time logged here runs from the sending of a command until its Deferred
+fires: it includes the network, the requests queued ahead of it on the
+connection, the parsing of its reply and the callbacks of the replies
+handed out before it.
+
+@code
+from txredis.slowlog import SlowLog
+
+slowlog = SlowLog(threshold=0.05)
+pool = RedisConnectionPool(slowlog=slowlog)
+...
+for entry in slowlog.get(10):
+    print entry.command, entry.args, entry.elapsed, entry.queueDepth
+@endcode
+"""
+import time
+from collections import deque, namedtuple
+
+
+SlowLogEntry = namedtuple('SlowLogEntry', [
+    # when the command completed, in seconds since the epoch
+    'time',
+    'command',
+    # summary of the arguments, as a tuple of strings
+    'args',
+    # requests waiting for their replies when the command was sent
+    'queueDepth',
+    # seconds from sending the command until its Deferred fired, or until
+    # it failed
+    'elapsed',
+    # seconds from the arrival of the first data of the reply until its
+    # Deferred fired, the callbacks of the replies before it included;
+    # None if it failed without a reply
+    'parseTime',
+    'replySize',
+    # exception the command failed with, or None
+    'error',
+])
+
+
+def _summary(args, maxArgs, maxArgLength):
+    """Truncate arguments the way the server's SLOWLOG does."""
+    summary = []
+    for i, arg in enumerate(args):
+        if i == maxArgs - 1 and len(args) > maxArgs:
+            summary.append('... (%d more arguments)' % (len(args) - i))
+            break
+        if isinstance(arg, unicode):
+            arg = arg.encode('utf8')
+        elif not isinstance(arg, str):
+            arg = str(arg)
+        if len(arg) > maxArgLength:
+            arg = '%s... (%d more bytes)' % (arg[:maxArgLength],
+                                            len(arg) - maxArgLength)
+        summary.append(arg)
+    return tuple(summary)
+
+
+class SlowLog(object):
+    """A ring buffer of the commands slower than a threshold.
+
+    Clients are given a SlowLog with their slowlog argument; one may be
+    shared by many connections. Only one in sampleEvery commands of each
+    connection is timed, which bounds the overhead: the others are only
+    counted, while a sampled command reads the clock and keeps a reference
+    to its arguments until its reply arrives. Their summary is only built
+    for the commands that are logged.
+
+    HiRedisClient does not measure the replies, so it estimates reply sizes
+    from the parsed replies, counting status replies as bulk strings.
+    """
+
+    def __init__(self, threshold=0.01, maxEntries=128, sampleEvery=1,
+                 maxArgs=32, maxArgLength=128):
+        """
+        @param threshold : Seconds a command has to take to be logged.
+        @param maxEntries : Number of entries kept; older entries are
+                            dropped.
+        @param sampleEvery : Time one in this many commands.
+        @param maxArgs : Number of arguments kept in an entry, the command
+                         name included.
+        @param maxArgLength : Length arguments are truncated to.
+        """
+        self.threshold = threshold
+        self.sampleEvery = sampleEvery
+        self.maxArgs = maxArgs
+        self.maxArgLength = maxArgLength
+        self._entries = deque(maxlen=maxEntries)
+        self.sampled = 0
+        self.logged = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, count=None):
+        """
+        Return the count most recent entries, or all of them, newest first.
+        """
+        entries = list(reversed(self._entries))
+        if count is not None:
+            entries = entries[:count]
+        return entries
+
+    def reset(self):
+        """
+        Drop all entries.
+        """
+        self._entries.clear()
+
+    def record(self, args, queueDepth, elapsed, parseTime, replySize,
+               error=None):
+        """
+        Log a sampled command if it took at least threshold seconds.
+        """
+        self.sampled += 1
+        if elapsed < self.threshold:
+            return
+        self.logged += 1
+        self._entries.append(SlowLogEntry(
+            time.time(), args[0].upper(),
+            _summary(args[1:], self.maxArgs - 1, self.maxArgLength),
+            queueDepth, elapsed, parseTime, replySize, error))
@@ -3,10 +3,12 @@
 
 This module provides the basic needs to run txRedis unit tests.
 """
+from twisted.internet import defer
 from twisted.internet import protocol
 from twisted.internet import reactor
 from twisted.trial import unittest
 
+from txredis import exceptions
 from txredis.client import Redis
 
 
@@ -38,4 +40,124 @@ class CommandsBaseTestCase(unittest.TestCase):
         return d
 
     def tearDown(self):
-        self.redis.transport.loseConnection()
\ No newline at end of file
+        self.redis.transport.loseConnection()
+
+
+class Status(str):
+    """A status reply of a FakeRedisServer, such as OK."""
+
+
+def encodeReply(reply):
+    """
+    Encode a reply of a FakeRedisServer: None, an integer, a string, a
+    Status, a RedisError or a list of these.
+    """
+    if reply is None:
+        return '$-1\r\n'
+    if isinstance(reply, Status):
+        return '+%s\r\n' % reply
+    if isinstance(reply, exceptions.RedisError):
+        return '-%s\r\n' % reply.args[0]
+    if isinstance(reply, (int, long)):
+        return ':%d\r\n' % reply
+    if isinstance(reply, (list, tuple)):
+        return '*%d\r\n%s' % (len(reply),
+                               ''.join(encodeReply(r) for r in reply))
+    reply = str(reply)
+    return '$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class FakeRedisConnection(protocol.Protocol):
+    """A connection to a FakeRedisServer.
+
+    Parses commands sent in the unified request protocol and writes the
+    replies of the server's handlers. Handlers may keep per connection
+    state in the state dict.
+    """
+
+    def connectionMade(self):
+        self._buffer = ''
+        self.state = {}
+        self.lost = defer.Deferred()
+        self.factory.connections.append(self)
+
+    def connectionLost(self, reason):
+        self.factory.connections.remove(self)
+        self.lost.callback(None)
+
+    def dataReceived(self, data):
+        self._buffer += data
+        while True:
+            args = self._parseCommand()
+            if args is None:
+                break
+            reply = self.factory.handle(self, args)
+            self.transport.write(encodeReply(reply))
+
+    def _parseCommand(self):
+        buf = self._buffer
+        end = buf.find('\r\n')
+        if end == -1:
+            return None
+        count = int(buf[1:end])
+        pos = end + 2
+        args = []
+        for _ in xrange(count):
+            end = buf.find('\r\n', pos)
+            if end == -1:
+                return None
+            length = int(buf[pos + 1:end])
+            pos = end + 2
+            if len(buf) < pos + length + 2:
+                return None
+            args.append(buf[pos:pos + length])
+            pos += length + 2
+        self._buffer = buf[pos:]
+        return args
+
+
+class FakeRedisServer(protocol.ServerFactory):
+    """An in-process stand-in for a Redis server, for testing clients
+    against server behaviour a local Redis can't easily be made to show.
+
+    Commands are handled by methods named after them, e.g. cmd_GET, called
+    with the connection and the command arguments; their return value is
+    sent as the reply (see encodeReply). Other commands get an error reply.
+    """
+
+    protocol = FakeRedisConnection
+
+    def __init__(self):
+        self.connections = []
+        self.commands = []
+        self.port = None
+        self._listening = None
+
+    def listen(self):
+        """Listen on a free local port, stored in the port attribute."""
+        self._listening = reactor.listenTCP(0, self, interface=REDIS_HOST)
+        self.port = self._listening.getHost().port
+        return self.port
+
+    def stop(self):
+        """Stop listening and drop all connections."""
+        stopped = []
+        for connection in list(self.connections):
+            stopped.append(connection.lost)
+            connection.transport.loseConnection()
+        if self._listening is not None:
+            stopped.append(
+                defer.maybeDeferred(self._listening.stopListening))
+            self._listening = None
+        return defer.DeferredList(stopped)
+
+    def handle(self, connection, args):
+        self.commands.append(args)
+        handler = getattr(self, 'cmd_' + args[0].upper(), None)
+        if handler is None:
+            return exceptions.ResponseError(
+                "ERR unknown command '%s'" % args[0])
+        return handler(connection, *args[1:])
+
+    def cmd_PING(self, connection):
+        return Status('PONG')
@@ -18,6 +18,21 @@ class LargeMultiBulkTestCase(CommandsBaseTestCase):
         res = yield r.smembers('s')
         t(res, set(map(str, data)))
 
+    @defer.inlineCallbacks
+    def test_large_multibulk_batches(self):
+        r = self.redis
+        t = self.assertEqual
+
+        yield r.delete('s')
+        data = set(xrange(1, 100000))
+        for i in data:
+            r.sadd('s', i)
+        batches = []
+        res = yield r.smembers_batches('s', batches.append, 1000)
+        t(res, len(data))
+        t(max(map(len, batches)), 1000)
+        t(set(m for batch in batches for m in batch), set(map(str, data)))
+
 
 class MultiBulkTestCase(CommandsBaseTestCase):
     @defer.inlineCallbacks
@@ -0,0 +1,99 @@
+from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.trial import unittest
+
+from txredis.client import Redis
+from txredis.exceptions import ResponseError
+from txredis.testing import CommandsBaseTestCase
+
+
+class PipelineTestCase(CommandsBaseTestCase):
+    """Test commands queued on a pipeline.
+    """
+
+    @defer.inlineCallbacks
+    def test_pipeline(self):
+        r = self.redis
+        t = self.assertEqual
+
+        yield r.delete('a', 'h', 'z', 'missing')
+        yield r.set('a', 'x')
+        yield r.hmset('h', {'f1': 'v1', 'f2': 'v2'})
+        yield r.zadd('z', 1, 'one', 2, 'two')
+
+        p = r.pipeline()
+        get = p.get('a')
+        p.hgetall('h')
+        p.zrange('z', 0, -1, withscores=True)
+        p.zscore('z', 'two')
+        p.get('missing')
+        p.incr('counter')
+        t(len(p), 6)
+
+        a = yield p.execute()
+        t(a[:5], ['x', {'f1': 'v1', 'f2': 'v2'},
+                  [('one', 1.0), ('two', 2.0)], 2.0, None])
+        t(len(p), 0)
+        a = yield get
+        t(a, 'x')
+
+    @defer.inlineCallbacks
+    def test_errors_are_collected(self):
+        r = self.redis
+        t = self.assertEqual
+
+        yield r.delete('a', 'l')
+        yield r.set('a', 'x')
+
+        p = r.pipeline()
+        p.lpush('a', 'y')
+        p.lpush('l', 'y')
+        a = yield p.execute()
+        t(len(a), 2)
+        self.assertTrue(isinstance(a[0], ResponseError))
+        t(a[1], 1)
+
+    @defer.inlineCallbacks
+    def test_empty(self):
+        a = yield self.redis.pipeline().execute()
+        self.assertEqual(a, [])
+
+
+class PipelineWriteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.proto = Redis()
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.writes = []
+        self.transport.write = self.writes.append
+        self.proto.makeConnection(self.transport)
+
+    @defer.inlineCallbacks
+    def test_single_write(self):
+        p = self.proto.pipeline()
+        p.get('a')
+        p.smembers('s')
+        p.dbsize()
+        self.assertEquals(self.writes, [])
+        d = p.execute()
+        self.assertEquals(self.writes, [
+            '*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+            '*2\r\n$8\r\nSMEMBERS\r\n$1\r\ns\r\n'
+            '*1\r\n$6\r\nDBSIZE\r\n'])
+        self.proto.dataReceived(
+            '$1\r\nx\r\n*2\r\n$1\r\n1\r\n$1\r\n2\r\n:3\r\n')
+        a = yield d
+        self.assertEquals(a, ['x', set(['1', '2']), 3])
+
+    @defer.inlineCallbacks
+    def test_streaming(self):
+        chunks = []
+        p = self.proto.pipeline()
+        p.get_stream('a', chunks.append)
+        p.get('b')
+        d = p.execute()
+        self.proto.dataReceived('$3\r\nfoo\r\n$3\r\nbar\r\n')
+        a = yield d
+        self.assertEquals(a, [3, 'bar'])
+        self.assertEquals(chunks, ['foo'])
@@ -0,0 +1,106 @@
+from twisted.internet import defer
+from twisted.internet import task
+
+from txredis.client import Scanner
+from txredis.testing import CommandsBaseTestCase
+
+
+class ScanCommandsTestCase(CommandsBaseTestCase):
+    """Test the commands of the SCAN family and the iterators over them.
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield CommandsBaseTestCase.setUp(self)
+        keys = yield self.redis.keys('scan:*')
+        if keys:
+            yield self.redis.delete(*keys)
+        yield self.redis.delete('s', 'h', 'z')
+
+    @defer.inlineCallbacks
+    def test_keys_unsorted(self):
+        r = self.redis
+        yield r.mset(dict(('scan:%d' % i, i) for i in range(20)))
+        a = yield r.keys('scan:*', sort=False)
+        self.assertEqual(sorted(a), ['scan:%d' % i for i in sorted(
+            range(20), key=str)])
+
+    @defer.inlineCallbacks
+    def test_scan(self):
+        r = self.redis
+        yield r.mset(dict(('scan:%d' % i, i) for i in range(50)))
+        found = []
+        cursor = None
+        while cursor != 0:
+            cursor, keys = yield r.scan(cursor or 0, 'scan:*', 10)
+            found.extend(keys)
+        self.assertEqual(set(found), set('scan:%d' % i for i in range(50)))
+
+    @defer.inlineCallbacks
+    def test_scan_iter(self):
+        r = self.redis
+        yield r.mset(dict(('scan:%d' % i, i) for i in range(50)))
+        for prefetch in (False, True):
+            it = r.scan_iter('scan:*', 10, prefetch)
+            found = []
+            page = yield it.next()
+            while page is not None:
+                self.assertTrue(page)
+                found.extend(page)
+                page = yield it.next()
+            self.assertTrue(it.done)
+            self.assertEqual(set(found),
+                             set('scan:%d' % i for i in range(50)))
+            page = yield it.next()
+            self.assertEqual(page, None)
+
+    @defer.inlineCallbacks
+    def test_collection_iters(self):
+        r = self.redis
+        yield r.sadd('s', *['m%d' % i for i in range(300)])
+        yield r.hmset('h', dict(('f%d' % i, 'v%d' % i) for i in range(300)))
+        for i in range(300):
+            yield r.zadd('z', 'm%d' % i, i)
+        pages = []
+        n = yield r.sscan_iter('s', count=50).foreach(pages.append)
+        self.assertEqual(n, 300)
+        self.assertTrue(len(pages) > 1)
+        self.assertEqual(len(set(sum(pages, []))), 300)
+        pairs = []
+        n = yield r.hscan_iter('h', 'f1*', prefetch=True).foreach(pairs.extend)
+        self.assertEqual(dict(pairs), dict(('f%d' % i, 'v%d' % i)
+                                           for i in range(300)
+                                           if str(i).startswith('1')))
+        pairs = []
+        yield r.zscan_iter('z').foreach(pairs.extend)
+        self.assertEqual(dict(pairs), dict(('m%d' % i, float(i))
+                                           for i in range(300)))
+
+    def test_backpressure(self):
+        pages = [(3, ['a']), (5, []), (7, ['b', 'c']), (0, ['d'])]
+        fetched = []
+
+        def fetch(cursor):
+            fetched.append(cursor)
+            return defer.succeed(pages[len(fetched) - 1])
+
+        clock = task.Clock()
+        delivered = []
+
+        def consume(page):
+            delivered.append(page)
+            return task.deferLater(clock, 1, lambda: None)
+
+        d = Scanner(fetch, prefetch=True).foreach(consume)
+        self.assertEqual(delivered, [['a']])
+        # one page is fetched in advance, the empty one skipped
+        self.assertEqual(fetched, [0, 3, 5])
+        clock.advance(1)
+        self.assertEqual(delivered, [['a'], ['b', 'c']])
+        self.assertEqual(fetched, [0, 3, 5, 7])
+        clock.advance(1)
+        clock.advance(1)
+        self.assertEqual(delivered, [['a'], ['b', 'c'], ['d']])
+        self.assertEqual(fetched, [0, 3, 5, 7])
+        d.addCallback(self.assertEqual, 4)
+        return d
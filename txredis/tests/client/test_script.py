@@ -1,10 +1,11 @@
 import hashlib
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.trial.unittest import SkipTest
 
+from txredis.client import RedisClientFactory
 from txredis.exceptions import ResponseError, NoScript
-from txredis.testing import CommandsBaseTestCase
+from txredis.testing import CommandsBaseTestCase, REDIS_HOST, REDIS_PORT
 
 
 class ScriptingCommandsTestCase(CommandsBaseTestCase):
@@ -139,4 +140,69 @@ class ScriptingCommandsTestCase(CommandsBaseTestCase):
         d.addErrback(eb)
         self.assertFailure(d, ResponseError)
 
-        return d
\ No newline at end of file
+        return d
+
+    @defer.inlineCallbacks
+    def test_register_script(self):
+        r = self.redis
+        t = self.assertEqual
+
+        source = u'return {KEYS[1], ARGV[1]} -- \u3235'
+        script = r.register_script(source)
+        t(script.sha1, hashlib.sha1(source.encode('utf8')).hexdigest())
+        t(r.scripts, {script.sha1: source.encode('utf8')})
+
+        # not loaded yet: run with EVAL, then with EVALSHA
+        yield r.script_flush()
+        a = yield script(('k',), ('a',))
+        t(a, ['k', 'a'])
+        a = yield r.script_exists(script.sha1)
+        t(a, [True])
+        a = yield script(('k',), ('b',))
+        t(a, ['k', 'b'])
+
+    @defer.inlineCallbacks
+    def test_script_retry_order(self):
+        r = self.redis
+        t = self.assertEqual
+
+        yield r.delete('test_script_order')
+        script = r.register_script(
+            'return redis.call("RPUSH", KEYS[1], ARGV[1])')
+        yield r.script_flush()
+        calls = [script(('test_script_order',), (i,)) for i in range(5)]
+        yield defer.gatherResults(calls)
+        a = yield r.lrange('test_script_order', 0, -1)
+        t(a, [str(i) for i in range(5)])
+
+    @defer.inlineCallbacks
+    def test_register_when_connected(self):
+        r = self.redis
+        t = self.assertEqual
+
+        yield r.delete('test_script_order')
+        yield r.script_flush()
+        script = r.register_script(
+            'return redis.call("RPUSH", KEYS[1], ARGV[1])')
+        calls = [script(('test_script_order',), ('x',)),
+                 r.rpush('test_script_order', 'y')]
+        yield defer.gatherResults(calls)
+        a = yield r.lrange('test_script_order', 0, -1)
+        t(a, ['x', 'y'])
+
+    @defer.inlineCallbacks
+    def test_load_on_reconnect(self):
+        factory = RedisClientFactory()
+        factory.initialDelay = 0.01
+        reactor.connectTCP(REDIS_HOST, REDIS_PORT, factory)
+        client = yield factory.deferred
+        try:
+            script = client.register_script('return "reloaded"')
+            yield client.script_flush()
+            client.transport.loseConnection()
+            client = yield factory.deferred
+            a = yield client.script_exists(script.sha1)
+            self.assertEqual(a, [True])
+        finally:
+            factory.stopTrying()
+            client.transport.loseConnection()
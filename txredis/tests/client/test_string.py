@@ -91,6 +91,29 @@ class StringsCommandTestCase(CommandsBaseTestCase):
         ex = u'pippo'
         t(a, ex)
 
+    @defer.inlineCallbacks
+    def test_get_stream(self):
+        r = self.redis
+        t = self.assertEqual
+
+        value = ''.join(chr(i % 256) for i in xrange(200000))
+        yield r.set('big', value)
+        yield r.delete('missing')
+
+        chunks = []
+        d = r.get_stream('big', chunks.append)
+        after = r.get('big')
+        a = yield d
+        t(a, len(value))
+        t(''.join(chunks), value)
+        a = yield after
+        t(a, value)
+
+        chunks = []
+        a = yield r.get_stream('missing', chunks.append)
+        t(a, None)
+        t(chunks, [])
+
     @defer.inlineCallbacks
     def test_mget(self):
         r = self.redis
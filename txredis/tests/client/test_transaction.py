@@ -0,0 +1,150 @@
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.trial import unittest
+
+from txredis.client import Redis
+from txredis.exceptions import ResponseError, WatchError
+from txredis.testing import CommandsBaseTestCase, REDIS_HOST, REDIS_PORT
+
+
+class TransactionTestCase(CommandsBaseTestCase):
+    """Test commands run in a MULTI/EXEC transaction.
+    """
+
+    @defer.inlineCallbacks
+    def test_transaction(self):
+        r = self.redis
+        t = self.assertEqual
+
+        yield r.delete('h', 'z', 's')
+        yield r.hmset('h', {'f1': 'v1', 'f2': 'v2'})
+        yield r.zadd('z', 1, 'one', 2, 'two')
+        yield r.sadd('s', 'a')
+
+        tx = r.transaction()
+        hgetall = tx.hgetall('h')
+        tx.zrange('z', 0, -1, withscores=True)
+        tx.zscore('z', 'two')
+        tx.smembers('s')
+        a = yield tx.execute()
+        t(a, [{'f1': 'v1', 'f2': 'v2'}, [('one', 1.0), ('two', 2.0)], 2.0,
+              set(['a'])])
+        a = yield hgetall
+        t(a, {'f1': 'v1', 'f2': 'v2'})
+
+    @defer.inlineCallbacks
+    def test_command_error(self):
+        r = self.redis
+        yield r.delete('a', 'l')
+        yield r.set('a', 'x')
+
+        tx = r.transaction()
+        lpush = self.assertFailure(tx.lpush('a', 'y'), ResponseError)
+        tx.lpush('l', 'y')
+        a = yield tx.execute()
+        self.assertTrue(isinstance(a[0], ResponseError))
+        self.assertEqual(a[1], 1)
+        yield lpush
+
+    @defer.inlineCallbacks
+    def test_exec_abort(self):
+        tx = self.redis.transaction()
+        get = self.assertFailure(tx.get('a'), ResponseError)
+        tx._send('NOSUCHCOMMAND')
+        tx.getResponse()
+        yield self.assertFailure(tx.execute(), ResponseError)
+        yield get
+        a = yield self.redis.ping()
+        self.assertEqual(a, 'PONG')
+
+    @defer.inlineCallbacks
+    def test_empty(self):
+        a = yield self.redis.transaction().execute()
+        self.assertEqual(a, [])
+
+
+class TransactTestCase(CommandsBaseTestCase):
+    """Test optimistic transactions retried on WATCH conflicts.
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield CommandsBaseTestCase.setUp(self)
+        creator = protocol.ClientCreator(reactor, Redis)
+        self.other = yield creator.connectTCP(REDIS_HOST, REDIS_PORT)
+        yield self.redis.delete('counter')
+
+    def tearDown(self):
+        self.other.transport.loseConnection()
+        return CommandsBaseTestCase.tearDown(self)
+
+    @defer.inlineCallbacks
+    def test_retry(self):
+        r = self.redis
+        attempts = []
+
+        def read(p):
+            p.get('counter')
+
+        def build(tx, values):
+            attempts.append(values[0])
+            tx.set('counter', int(values[0] or 0) + 10)
+            if len(attempts) < 3:
+                # a concurrent client changes the watched key
+                return self.other.incr('counter')
+
+        a = yield r.transact(['counter'], read, build)
+        self.assertEqual(a, ['OK'])
+        self.assertEqual(attempts, [None, '1', '2'])
+        a = yield self.other.get('counter')
+        self.assertEqual(a, '12')
+
+    @defer.inlineCallbacks
+    def test_give_up(self):
+        def build(tx, values):
+            tx.incr('counter')
+            return self.other.incr('counter')
+
+        yield self.assertFailure(
+            self.redis.transact(['counter'], lambda p: None, build,
+                                max_attempts=2),
+            WatchError)
+        a = yield self.other.get('counter')
+        self.assertEqual(a, '2')
+
+
+class TransactionWriteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.proto = Redis()
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.writes = []
+        self.transport.write = self.writes.append
+        self.proto.makeConnection(self.transport)
+
+    @defer.inlineCallbacks
+    def test_single_write(self):
+        tx = self.proto.transaction()
+        tx.get('a')
+        tx.hgetall('h')
+        d = tx.execute()
+        self.assertEquals(self.writes, [
+            '*1\r\n$5\r\nMULTI\r\n'
+            '*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+            '*2\r\n$7\r\nHGETALL\r\n$1\r\nh\r\n'
+            '*1\r\n$4\r\nEXEC\r\n'])
+        self.proto.dataReceived(
+            '+OK\r\n+QUEUED\r\n+QUEUED\r\n'
+            '*2\r\n$1\r\nx\r\n*2\r\n$1\r\nf\r\n$1\r\nv\r\n')
+        a = yield d
+        self.assertEquals(a, ['x', {'f': 'v'}])
+
+    def test_watch_error(self):
+        tx = self.proto.transaction()
+        get = self.assertFailure(tx.get('a'), WatchError)
+        d = tx.execute()
+        self.proto.dataReceived('+OK\r\n+QUEUED\r\n*-1\r\n')
+        return defer.gatherResults([get, self.assertFailure(d, WatchError)])
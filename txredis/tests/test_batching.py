@@ -0,0 +1,78 @@
+from twisted.internet import defer
+from twisted.internet import task
+
+from txredis.batching import AutoBatcher
+from txredis.exceptions import ResponseError
+from txredis.testing import CommandsBaseTestCase
+
+
+class AutoBatcherTestCase(CommandsBaseTestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield CommandsBaseTestCase.setUp(self)
+        yield self.redis.delete('a', 'b', 'c', 'h', 'l')
+        self.batcher = AutoBatcher(self.redis)
+
+    def requests(self):
+        return len(self.redis._request_queue)
+
+    @defer.inlineCallbacks
+    def test_get(self):
+        b = self.batcher
+        yield self.redis.mset({'a': 'x', 'b': 'y'})
+        reads = [b.get('a'), b.get('b'), b.get('c'), b.get('a')]
+        self.assertEqual(self.requests(), 0)
+        a = yield defer.gatherResults(reads)
+        self.assertEqual(a, ['x', 'y', None, 'x'])
+        self.assertEqual((b.batches, b.batchedRequests), (1, 4))
+
+    @defer.inlineCallbacks
+    def test_hget(self):
+        b = self.batcher
+        yield self.redis.hset('h', 'f', 'x')
+        yield self.redis.hset('h', 'g', 'y')
+        reads = [b.hget_value('h', 'f'), b.hget('h', 'g'),
+                 b.hget_value('h', 'z'), b.get('a'), b.hget_value('i', 'f')]
+        a = yield defer.gatherResults(reads)
+        self.assertEqual(a, ['x', {'g': 'y'}, None, None, None])
+        self.assertEqual(b.batches, 3)
+
+    @defer.inlineCallbacks
+    def test_max_batch_size(self):
+        b = self.batcher
+        b.maxBatchSize = 2
+        yield self.redis.mset({'a': 'x', 'b': 'y', 'c': 'z'})
+        first, second, third = b.get('a'), b.get('b'), b.get('c')
+        self.assertEqual(self.requests(), 1)
+        a = yield defer.gatherResults([first, second, third])
+        self.assertEqual(a, ['x', 'y', 'z'])
+        self.assertEqual(b.batches, 2)
+
+    def test_flush_delay(self):
+        clock = task.Clock()
+        b = AutoBatcher(self.redis, flushDelay=0.01, reactor=clock)
+        d = b.get('a')
+        clock.advance(0.005)
+        self.assertEqual(self.requests(), 0)
+        clock.advance(0.005)
+        self.assertEqual(self.requests(), 1)
+        return d
+
+    @defer.inlineCallbacks
+    def test_order(self):
+        b = self.batcher
+        yield self.redis.set('a', 'x')
+        before = b.get('a')
+        write = b.set('a', 'y')
+        after = b.get('a')
+        a = yield defer.gatherResults([before, write, after])
+        self.assertEqual(a, ['x', 'OK', 'y'])
+
+    @defer.inlineCallbacks
+    def test_errors(self):
+        b = self.batcher
+        yield self.redis.set('a', 'x')
+        reads = [b.hget_value('a', 'f'), b.hget_value('a', 'g')]
+        for d in reads:
+            yield self.assertFailure(d, ResponseError)
@@ -0,0 +1,143 @@
+from twisted.internet import defer
+from twisted.internet import task
+
+from txredis.cache import NearCache
+from txredis.exceptions import ResponseError
+from txredis.testing import CommandsBaseTestCase
+
+
+class NearCacheTestCase(CommandsBaseTestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield CommandsBaseTestCase.setUp(self)
+        yield self.redis.delete('a', 'b', 'c', 'h')
+        self.clock = task.Clock()
+        self.cache = NearCache(self.redis, ttl=10, reactor=self.clock)
+
+    @defer.inlineCallbacks
+    def test_hits(self):
+        c = self.cache
+        yield self.redis.set('a', 'v')
+        yield self.redis.hset('h', 'f', 'x')
+        for _ in range(2):
+            a = yield c.get('a')
+            self.assertEqual(a, 'v')
+            a = yield c.hget_value('h', 'f')
+            self.assertEqual(a, 'x')
+            a = yield c.hget('h', ['f', 'g'])
+            self.assertEqual(a, {'f': 'x', 'g': None})
+            a = yield c.hgetall('h')
+            self.assertEqual(a, {'f': 'x'})
+        stats = c.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (4, 4))
+        self.assertEqual(stats['entries'], 4)
+        self.assertTrue(stats['bytes'] > 0)
+
+    @defer.inlineCallbacks
+    def test_write_invalidates(self):
+        c = self.cache
+        yield c.set('a', 'v1')
+        a = yield c.get('a')
+        self.assertEqual(a, 'v1')
+        yield c.set('a', 'v2')
+        a = yield c.get('a')
+        self.assertEqual(a, 'v2')
+        yield c.hset('h', 'f', 'x')
+        a = yield c.hgetall('h')
+        self.assertEqual(a, {'f': 'x'})
+        yield c.hdel('h', 'f')
+        a = yield c.hgetall('h')
+        self.assertEqual(a, {})
+        yield c.delete('a')
+        a = yield c.get('a')
+        self.assertEqual(a, None)
+        self.assertEqual(c.stats()['hits'], 0)
+        self.assertEqual(c.stats()['invalidations'], 3)
+        # writes by other clients are only seen once invalidated
+        yield self.redis.set('a', 'v3')
+        a = yield c.get('a')
+        self.assertEqual(a, None)
+        c.invalidate('a')
+        a = yield c.get('a')
+        self.assertEqual(a, 'v3')
+
+    @defer.inlineCallbacks
+    def test_ttl_and_stale_window(self):
+        c = self.cache
+        c.staleWindow = 5
+        yield self.redis.set('a', 'v1')
+        yield c.get('a')
+        yield self.redis.set('a', 'v2')
+        self.clock.advance(11)
+        # stale: served while one refresh is sent
+        a = yield c.get('a')
+        self.assertEqual(a, 'v1')
+        self.assertEqual(len(c._fills), 1)
+        a = yield c.get('a')
+        self.assertEqual(a, 'v1')
+        self.assertEqual(len(c._fills), 1)
+        yield c.ping()
+        a = yield c.get('a')
+        self.assertEqual(a, 'v2')
+        self.assertEqual(c.stats()['staleHits'], 2)
+        self.assertEqual(c.stats()['hits'], 1)
+        # past the stale window the value is fetched again
+        yield self.redis.set('a', 'v3')
+        self.clock.advance(16)
+        a = yield c.get('a')
+        self.assertEqual(a, 'v3')
+        self.assertEqual(c.stats()['misses'], 2)
+
+    @defer.inlineCallbacks
+    def test_eviction(self):
+        c = self.cache
+        c.maxEntries = 2
+        yield self.redis.mset({'a': 'x', 'b': 'y', 'c': 'z'})
+        yield c.get('a')
+        yield c.get('b')
+        yield c.get('a')
+        yield c.get('c')
+        self.assertEqual(c.stats()['evictions'], 1)
+        self.assertEqual(sorted(c._entries), [('GET', 'a'), ('GET', 'c')])
+        self.assertEqual(sorted(c._byKey), ['a', 'c'])
+        c.maxEntries = 10
+        c.maxBytes = c.stats()['bytes']
+        yield self.redis.set('b', 'y' * 20)
+        yield c.get('b')
+        self.assertEqual(sorted(c._entries), [('GET', 'b')])
+        self.assertTrue(c.stats()['bytes'] <= c.maxBytes)
+        c.maxBytes = 10
+        yield c.get('a')
+        self.assertEqual(c.stats()['entries'], 0)
+        self.assertEqual(c.stats()['bytes'], 0)
+
+    @defer.inlineCallbacks
+    def test_concurrent_fills(self):
+        c = self.cache
+        yield self.redis.set('a', 'v1')
+        reads = [c.get('a') for _ in range(3)]
+        self.assertEqual(len(c._fills), 1)
+        a = yield defer.gatherResults(reads)
+        self.assertEqual(a, ['v1'] * 3)
+        self.assertEqual(c.stats()['misses'], 3)
+        # a value read before a write is not cached
+        c.invalidate('a')
+        read = c.get('a')
+        write = c.set('a', 'v2')
+        a = yield read
+        self.assertEqual(a, 'v1')
+        yield write
+        self.assertEqual(c.stats()['entries'], 0)
+        a = yield c.get('a')
+        self.assertEqual(a, 'v2')
+
+    @defer.inlineCallbacks
+    def test_errors(self):
+        c = self.cache
+        yield self.redis.hset('h', 'f', 'x')
+        reads = [c.get('h'), c.get('h')]
+        for d in reads:
+            yield self.assertFailure(d, ResponseError)
+        self.assertEqual(c.stats()['entries'], 0)
+        self.assertEqual(c._byKey, {})
@@ -0,0 +1,185 @@
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from txredis.cluster import RedisCluster, crc16, keySlot
+from txredis.exceptions import (
+    AskError, InvalidCommand, MovedError, ResponseError)
+from txredis.testing import FakeRedisServer, Status, REDIS_HOST
+
+
+class FakeClusterNode(FakeRedisServer):
+    """A cluster master serving the slots the fake cluster gives it."""
+
+    def __init__(self, cluster):
+        FakeRedisServer.__init__(self)
+        self.cluster = cluster
+        self.data = {}
+        # slots being migrated away, mapped to the node they move to
+        self.migrating = {}
+
+    def _redirect(self, connection, key):
+        slot = keySlot(key)
+        owner = self.cluster.owner(slot)
+        asking = connection.state.pop('asking', False)
+        if owner is self:
+            target = self.migrating.get(slot)
+            if target is not None and key not in self.data:
+                return AskError(
+                    'ASK %d %s:%d' % (slot, REDIS_HOST, target.port))
+        elif not asking:
+            return MovedError(
+                'MOVED %d %s:%d' % (slot, REDIS_HOST, owner.port))
+
+    def cmd_CLUSTER(self, connection, subcommand):
+        return self.cluster.slotRanges()
+
+    def cmd_ASKING(self, connection):
+        connection.state['asking'] = True
+        return Status('OK')
+
+    def cmd_GET(self, connection, key):
+        return self._redirect(connection, key) or self.data.get(key)
+
+    def cmd_SET(self, connection, key, value):
+        error = self._redirect(connection, key)
+        if error:
+            return error
+        self.data[key] = value
+        return Status('OK')
+
+    def cmd_MSET(self, connection, *args):
+        keys = args[::2]
+        if len(set(keySlot(key) for key in keys)) > 1:
+            return ResponseError("CROSSSLOT Keys don't hash to the same slot")
+        error = self._redirect(connection, keys[0])
+        if error:
+            return error
+        self.data.update(zip(keys, args[1::2]))
+        return Status('OK')
+
+    def cmd_MGET(self, connection, *keys):
+        if len(set(keySlot(key) for key in keys)) > 1:
+            return ResponseError("CROSSSLOT Keys don't hash to the same slot")
+        return self._redirect(connection, keys[0]) or [
+            self.data.get(key) for key in keys]
+
+
+class FakeCluster(object):
+
+    def __init__(self, size):
+        self.nodes = [FakeClusterNode(self) for _ in range(size)]
+        for node in self.nodes:
+            node.listen()
+        share = 16384 // size + 1
+        self.slots = [self.nodes[slot // share] for slot in xrange(16384)]
+
+    def owner(self, slot):
+        return self.slots[slot]
+
+    def slotRanges(self):
+        ranges = []
+        for slot, node in enumerate(self.slots):
+            if ranges and ranges[-1][2] is node and ranges[-1][1] == slot - 1:
+                ranges[-1][1] = slot
+            else:
+                ranges.append([slot, slot, node])
+        return [[start, end, ['', node.port, 'id%d' % node.port]]
+                for start, end, node in ranges]
+
+    def moveSlot(self, slot, target):
+        source = self.slots[slot]
+        for key in source.data.keys():
+            if keySlot(key) == slot:
+                target.data[key] = source.data.pop(key)
+        self.slots[slot] = target
+
+    def stop(self):
+        return defer.gatherResults([node.stop() for node in self.nodes])
+
+
+class SlotTestCase(unittest.TestCase):
+
+    def test_crc16(self):
+        self.assertEqual(crc16('123456789'), 0x31c3)
+
+    def test_key_slot(self):
+        self.assertEqual(keySlot('foo'), 12182)
+        self.assertEqual(keySlot(u'foo'), 12182)
+        self.assertEqual(keySlot('{user1000}.following'),
+                         keySlot('{user1000}.followers'))
+        self.assertEqual(keySlot('{user1000}.following'),
+                         keySlot('user1000'))
+
+
+class ClusterTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.cluster = FakeCluster(3)
+        self.redis = RedisCluster([(REDIS_HOST, self.cluster.nodes[0].port)])
+        yield self.redis.connect()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.redis.disconnect()
+        yield self.cluster.stop()
+
+    def keysOn(self, node, count):
+        keys = ('key%d' % i for i in xrange(1000))
+        return [key for key in keys
+                if self.cluster.owner(keySlot(key)) is node][:count]
+
+    @defer.inlineCallbacks
+    def test_routing(self):
+        for node in self.cluster.nodes:
+            for key in self.keysOn(node, 3):
+                yield self.redis.set(key, 'v')
+            self.assertEqual(sorted(node.data), sorted(self.keysOn(node, 3)))
+        for node in self.cluster.nodes:
+            for key in self.keysOn(node, 3):
+                a = yield self.redis.get(key)
+                self.assertEqual(a, 'v')
+
+    @defer.inlineCallbacks
+    def test_moved(self):
+        a, b, _ = self.cluster.nodes
+        key = self.keysOn(a, 1)[0]
+        yield self.redis.set(key, 'v')
+        self.cluster.moveSlot(keySlot(key), b)
+        gets = [self.redis.get(key) for _ in range(3)]
+        others = [self.redis.get(k) for k in self.keysOn(a, 3)]
+        result = yield defer.gatherResults(gets + others)
+        self.assertEqual(result, ['v'] * 3 + [None] * 3)
+
+        # the slot map follows the move
+        del a.commands[:]
+        result = yield self.redis.get(key)
+        self.assertEqual(result, 'v')
+        self.assertEqual(a.commands, [])
+        self.assertEqual(b.commands[-1], ['GET', key])
+
+    @defer.inlineCallbacks
+    def test_ask(self):
+        a, b, _ = self.cluster.nodes
+        key, other = self.keysOn(a, 2)
+        yield self.redis.set(other, 'o')
+        a.migrating[keySlot(key)] = b
+        b.data[key] = 'v'
+        result = yield self.redis.get(key)
+        self.assertEqual(result, 'v')
+        self.assertEqual(b.commands[-2:], [['ASKING'], ['GET', key]])
+        # keys not migrated yet are still served by the source
+        result = yield self.redis.get(other)
+        self.assertEqual(result, 'o')
+        self.assertEqual(a.commands[-1], ['GET', other])
+
+    @defer.inlineCallbacks
+    def test_split(self):
+        keys = ['key%d' % i for i in range(20)]
+        result = yield self.redis.mset(dict((key, key) for key in keys))
+        self.assertEqual(result, 'OK')
+        result = yield self.redis.mget(*(keys + ['missing']))
+        self.assertEqual(result, keys + [None])
+        self.assertRaises(InvalidCommand, self.redis.sinter, *keys)
+        result = yield self.redis.mget('{a}1', '{a}2')
+        self.assertEqual(result, [None, None])
@@ -0,0 +1,41 @@
+# run the client test cases again with write coalescing enabled
+from txredis.client import RedisClient
+from txredis.tests.client import (
+    test_general, test_string, test_list, test_hash, test_set, test_bulk)
+
+
+class CoalescingRedisClient(RedisClient):
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('coalesce_writes', True)
+        RedisClient.__init__(self, *args, **kwargs)
+
+
+class CoalescingGeneral(test_general.GeneralCommandTestCase):
+
+    protocol = CoalescingRedisClient
+
+
+class CoalescingStrings(test_string.StringsCommandTestCase):
+
+    protocol = CoalescingRedisClient
+
+
+class CoalescingLists(test_list.ListsCommandsTestCase):
+
+    protocol = CoalescingRedisClient
+
+
+class CoalescingHash(test_hash.HashCommandsTestCase):
+
+    protocol = CoalescingRedisClient
+
+
+class CoalescingSets(test_set.SetsCommandsTestCase):
+
+    protocol = CoalescingRedisClient
+
+
+class CoalescingMultiBulk(test_bulk.MultiBulkTestCase):
+
+    protocol = CoalescingRedisClient
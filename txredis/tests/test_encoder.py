@@ -0,0 +1,96 @@
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+
+from txredis import encoder
+from txredis.client import Redis
+from txredis.exceptions import InvalidData
+
+
+class CommandEncoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = encoder.CommandEncoder()
+
+    def test_encode(self):
+        self.assertEquals(
+            self.encoder.encode(('SET', 'foo', 'bar')),
+            '*3\r\n$3\r\nSET\r\n$3\r\nfoo\r\n$3\r\nbar\r\n')
+
+    def test_cached_prefix(self):
+        self.encoder.encode(('GET', 'foo'))
+        self.assertEquals(
+            self.encoder.encode(('GET', 'barbaz')),
+            '*2\r\n$3\r\nGET\r\n$6\r\nbarbaz\r\n')
+        self.assertEquals(
+            self.encoder.encode(('GET',)), '*1\r\n$3\r\nGET\r\n')
+
+    def test_values(self):
+        self.assertEquals(
+            self.encoder.encode(
+                ('CMD', 7, 5000, -1, 1.5, True, u'\xe9', 2 ** 70)),
+            '*8\r\n$3\r\nCMD\r\n$1\r\n7\r\n$4\r\n5000\r\n$2\r\n-1\r\n'
+            '$3\r\n1.5\r\n$4\r\nTrue\r\n$2\r\n\xc3\xa9\r\n'
+            '$22\r\n1180591620717411303424\r\n')
+
+    def test_many_arguments(self):
+        args = ('DEL',) + tuple('k%d' % i for i in xrange(40))
+        self.assertEquals(
+            self.encoder.encode(args),
+            '*41\r\n' + ''.join('$%d\r\n%s\r\n' % (len(a), a) for a in args))
+
+    def test_unencodable(self):
+        ascii = encoder.CommandEncoder(charset='ascii')
+        self.assertRaises(InvalidData, ascii.encode, ('GET', u'\xe9'))
+
+    def test_pluggable(self):
+        class UpperEncoder(encoder.CommandEncoder):
+            def encode(self, args):
+                return encoder.CommandEncoder.encode(self, args).upper()
+
+        class UpperRedis(Redis):
+            commandEncoder = UpperEncoder
+
+        transport = StringTransport()
+        proto = UpperRedis()
+        proto.makeConnection(transport)
+        proto.get('foo')
+        self.assertEquals(
+            transport.value(), '*2\r\n$3\r\nGET\r\n$3\r\nFOO\r\n')
+
+
+class FakeHiRedis(object):
+    """Stands in for a hiredis release with pack_command."""
+
+    def __init__(self):
+        self.packed = []
+
+    def pack_command(self, args):
+        self.packed.append(args)
+        return encoder.CommandEncoder().encode(args)
+
+
+class HiRedisEncoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.hiredis = FakeHiRedis()
+        self.patch(encoder, 'hiredis', self.hiredis)
+        self.encoder = encoder.HiRedisEncoder()
+
+    def test_available(self):
+        self.assertTrue(encoder.hiRedisEncoderAvailable())
+        self.patch(encoder, 'hiredis', None)
+        self.assertFalse(encoder.hiRedisEncoderAvailable())
+
+    def test_arguments(self):
+        self.assertEquals(
+            self.encoder.encode(('SET', u'\xe9', 7, 1.5, True, 2 ** 70)),
+            '*6\r\n$3\r\nSET\r\n$2\r\n\xc3\xa9\r\n$1\r\n7\r\n$3\r\n1.5\r\n'
+            '$4\r\nTrue\r\n$22\r\n1180591620717411303424\r\n')
+        # ints are left to hiredis, everything else is passed as str
+        self.assertEquals(self.hiredis.packed, [
+            ('SET', '\xc3\xa9', 7, '1.5', 'True', '1180591620717411303424')])
+
+    def test_unencodable(self):
+        ascii = encoder.HiRedisEncoder(charset='ascii')
+        self.assertRaises(InvalidData, ascii.encode, ('GET', u'\xe9'))
+        self.assertEquals(self.hiredis.packed, [])
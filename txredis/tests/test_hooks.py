@@ -0,0 +1,331 @@
+from twisted.internet import defer, protocol, reactor
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.trial import unittest
+
+from txredis.client import Redis, HiRedisClient
+from txredis.exceptions import ResponseError, RequestTimeout
+from txredis.hooks import RequestHooks, HookSet, combineHooks
+from txredis.testing import REDIS_HOST, REDIS_PORT
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+class RecordingHooks(RequestHooks):
+
+    def __init__(self):
+        self.events = []
+        self.received = 0
+
+    def command_sent(self, cmd, nargs, nbytes):
+        self.events.append(('sent', cmd, nargs, nbytes))
+
+    def bytes_received(self, nbytes):
+        self.received += nbytes
+
+    def reply_received(self, cmd, latency, reply_size):
+        self.events.append(('reply', cmd, latency, reply_size))
+
+    def request_failed(self, cmd, reason):
+        self.events.append(('failed', cmd, reason.type))
+
+
+class HooksTestCase(unittest.TestCase):
+
+    protocol = Redis
+    # what the sizes of status replies are off by
+    statusExtra = 0
+
+    def setUp(self):
+        self.hooks = RecordingHooks()
+        self.proto = self.protocol(hooks=[self.hooks])
+        self.clock = Clock()
+        self.proto.clock = self.clock
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+
+    @defer.inlineCallbacks
+    def test_commands(self):
+        d = self.proto.get('a')
+        self.clock.advance(0.5)
+        self.proto.dataReceived('$3\r\nabc\r\n')
+        yield d
+        d = self.proto.set('a', 'b')
+        self.proto.dataReceived('+OK\r\n')
+        yield d
+        d = self.proto.lpush('a', 'x')
+        self.proto.dataReceived('-WRONGTYPE wrong kind of value\r\n')
+        yield self.assertFailure(d, ResponseError)
+        d = self.proto.with_timeout(1).ping()
+        self.clock.advance(1)
+        yield self.assertFailure(d, RequestTimeout)
+        self.proto.dataReceived('+PONG\r\n')
+        d = self.proto.lrange('l', 0, -1)
+        self.proto.dataReceived('*3\r\n$1\r\nx\r\n+OK\r\n*-1\r\n')
+        yield d
+        extra = self.statusExtra
+        self.assertEquals(self.hooks.events, [
+            ('sent', 'GET', 1, 20),
+            ('reply', 'GET', 0.5, 9),
+            ('sent', 'SET', 2, 27),
+            ('reply', 'SET', 0, 5 + extra),
+            ('sent', 'LPUSH', 2, 29),
+            ('failed', 'LPUSH', ResponseError),
+            ('sent', 'PING', 0, 14),
+            ('failed', 'PING', RequestTimeout),
+            ('sent', 'LRANGE', 3, 38),
+            ('reply', 'LRANGE', 0, 21 + extra),
+        ])
+        self.assertEquals(self.hooks.received, 9 + 5 + 32 + 7 + 21)
+
+    @defer.inlineCallbacks
+    def test_batches(self):
+        p = self.proto.pipeline()
+        p.incr('a')
+        p.get('a')
+        d = p.execute()
+        self.proto.dataReceived(':1\r\n$1\r\n1\r\n')
+        yield d
+        t = self.proto.transaction()
+        t.set('a', '2')
+        d = t.execute()
+        self.proto.dataReceived('+OK\r\n+QUEUED\r\n*1\r\n+OK\r\n')
+        yield d
+        extra = self.statusExtra
+        self.assertEquals(self.hooks.events, [
+            ('sent', 'INCR', 1, 21),
+            ('sent', 'GET', 1, 20),
+            ('reply', 'INCR', 0, 4),
+            ('reply', 'GET', 0, 7),
+            ('sent', 'MULTI', 0, 15),
+            ('sent', 'SET', 2, 27),
+            ('sent', 'EXEC', 0, 14),
+            ('reply', 'MULTI', 0, 5 + extra),
+            ('reply', 'SET', 0, 9 + extra),
+            ('reply', 'EXEC', 0, 9 + extra),
+        ])
+
+    @defer.inlineCallbacks
+    def test_not_sent(self):
+        d = self.proto.ping()
+        self.transport.loseConnection()
+        yield self.assertFailure(d, Exception)
+        d = self.proto.ping()
+        yield self.assertFailure(d, RuntimeError)
+        self.assertEquals([e[:2] for e in self.hooks.events], [
+            ('sent', 'PING'), ('failed', 'PING'), ('failed', 'PING')])
+
+    @defer.inlineCallbacks
+    def test_add_remove(self):
+        other = RecordingHooks()
+        self.proto.add_hook(other)
+        self.assertTrue(isinstance(self.proto._hooks, HookSet))
+        d = self.proto.ping()
+        self.proto.remove_hook(self.hooks)
+        self.assertTrue(self.proto._hooks is other)
+        self.proto.dataReceived('+PONG\r\n')
+        yield d
+        self.assertEquals(self.hooks.events, [('sent', 'PING', 0, 14)])
+        self.assertEquals(other.events, [
+            ('sent', 'PING', 0, 14),
+            ('reply', 'PING', 0, 7 + self.statusExtra)])
+        self.proto.remove_hook(other)
+        self.assertEquals(self.proto._hooks, None)
+        d = self.proto.ping()
+        self.proto.dataReceived('+PONG\r\n')
+        yield d
+        self.assertEquals(len(other.events), 2)
+        self.assertEquals(len(self.proto._sampled), 0)
+
+    @defer.inlineCallbacks
+    def test_clock_reads(self):
+        reads = []
+        seconds = self.clock.seconds
+
+        def counted():
+            reads.append(None)
+            return seconds()
+        self.clock.seconds = counted
+        ds = [self.proto.get('a') for _ in range(100)]
+        self.proto.dataReceived('$1\r\na\r\n' * 50)
+        self.proto.dataReceived('$1\r\na\r\n' * 50)
+        yield defer.gatherResults(ds)
+        # once for each command sent, then once for each data received
+        self.assertEquals(len(reads), 102)
+
+    @defer.inlineCallbacks
+    def test_sampled(self):
+        reads = []
+        seconds = self.clock.seconds
+
+        def counted():
+            reads.append(None)
+            return seconds()
+        self.clock.seconds = counted
+        self.hooks.sampleEvery = 10
+        self.proto.remove_hook(self.hooks)
+        self.proto.add_hook(self.hooks)
+        ds = [self.proto.get('a') for _ in range(100)]
+        self.clock.advance(1)
+        self.proto.dataReceived('$1\r\na\r\n' * 50)
+        self.proto.dataReceived('$1\r\na\r\n' * 50)
+        yield defer.gatherResults(ds)
+        sent = [e for e in self.hooks.events if e[0] == 'sent']
+        replies = [e for e in self.hooks.events if e[0] == 'reply']
+        self.assertEquals((len(sent), len(replies)), (100, 10))
+        self.assertEquals(set(e[2] for e in replies), set([1]))
+        self.assertEquals(self.hooks.received, 700)
+        # once for each command sampled, then once for each data received
+        self.assertEquals(len(reads), 12)
+
+    @defer.inlineCallbacks
+    def test_added_after_replies(self):
+        self.proto.remove_hook(self.hooks)
+        ds = [self.proto.get('a') for _ in range(3)]
+        self.proto.dataReceived('$5\r\nhello\r\n' * 3)
+        yield defer.gatherResults(ds)
+        self.proto.add_hook(self.hooks)
+        d = self.proto.get('a')
+        self.proto.dataReceived('$5\r\nhello\r\n')
+        yield d
+        self.assertEquals(self.hooks.events, [('sent', 'GET', 1, 20),
+                                              ('reply', 'GET', 0, 11)])
+
+    @defer.inlineCallbacks
+    def test_toggled_with_requests_pending(self):
+        d1 = self.proto.get('a')
+        self.proto.remove_hook(self.hooks)
+        d2 = self.proto.get('b')
+        self.proto.add_hook(self.hooks)
+        d3 = self.proto.with_timeout(1).get('c')
+        d4 = self.proto.get('d')
+        # d1 is forgotten when the hooks are removed
+        self.assertEquals(len(self.proto._sampled), 2)
+        self.clock.advance(1)
+        yield self.assertFailure(d3, RequestTimeout)
+        self.proto.dataReceived(
+            '$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n$2\r\ndd\r\n')
+        results = yield defer.gatherResults([d1, d2, d4])
+        self.assertEquals(results, ['a', 'b', 'dd'])
+        self.assertEquals(self.hooks.events, [
+            ('sent', 'GET', 1, 20),
+            ('sent', 'GET', 1, 20),
+            ('sent', 'GET', 1, 20),
+            ('failed', 'GET', RequestTimeout),
+            ('reply', 'GET', 1, 8),
+        ])
+        self.assertEquals(len(self.proto._sampled), 0)
+
+    def test_combine(self):
+        hooks = RecordingHooks()
+        self.assertEquals(combineHooks(()), None)
+        self.assertTrue(combineHooks([hooks]) is hooks)
+        self.assertEquals(combineHooks([hooks, hooks]).hooks, (hooks, hooks))
+        sampled = RecordingHooks()
+        sampled.sampleEvery = 8
+        self.assertEquals(combineHooks([hooks, sampled]).sampleEvery, 1)
+        hooks.sampleEvery = 4
+        self.assertEquals(combineHooks([hooks, sampled]).sampleEvery, 4)
+
+
+if hiredis is not None:
+
+    class HiRedisHooksTestCase(HooksTestCase):
+
+        protocol = HiRedisClient
+        # the replies are sized from their parsed values, which counts
+        # status replies as bulk strings
+        statusExtra = 3
+
+        @defer.inlineCallbacks
+        def test_chunks(self):
+            data = '*2\r\n$5\r\nhello\r\n+OK\r\n' + ':1\r\n' * 20000
+            ds = [self.proto.lrange('l', 0, -1)]
+            ds += [self.proto.incr('a') for _ in xrange(20000)]
+            for i in xrange(0, len(data), 7):
+                self.proto.dataReceived(data[i:i + 7])
+            yield defer.gatherResults(ds)
+            sizes = [e[3] for e in self.hooks.events if e[0] == 'reply']
+            self.assertEquals(sizes, [20 + self.statusExtra] + [4] * 20000)
+            self.assertEquals(self.hooks.received, len(data))
+
+        @defer.inlineCallbacks
+        def test_chunks_mixed(self):
+            replies = ['$300\r\n' + 'x' * 300 + '\r\n', '$-1\r\n',
+                       '*2\r\n*2\r\n:1\r\n$-1\r\n*-1\r\n',
+                       '-ERR wrong\r\n', '*0\r\n', ':-12\r\n']
+            ds = [self.proto.get('a'), self.proto.get('b'),
+                  self.proto.lrange('l', 0, -1), self.proto.incr('a'),
+                  self.proto.lrange('l', 0, -1), self.proto.incr('a')]
+            data = ''.join(replies)
+            for i in xrange(0, len(data), 3):
+                self.proto.dataReceived(data[i:i + 3])
+            for d in ds:
+                d.addErrback(lambda reason: reason.trap(ResponseError))
+            yield defer.gatherResults(ds)
+            sizes = [e[3] for e in self.hooks.events if e[0] == 'reply']
+            self.assertEquals(sizes, [len(r) for r in replies
+                                      if not r.startswith('-')])
+
+        @defer.inlineCallbacks
+        def test_added_mid_reply(self):
+            self.proto.remove_hook(self.hooks)
+            d1 = self.proto.lrange('l', 0, -1)
+            self.proto.dataReceived('*2\r\n$1\r\na')
+            self.proto.add_hook(self.hooks)
+            d2 = self.proto.set('a', 'b')
+            d3 = self.proto.get('a')
+            self.proto.dataReceived('\r\n$1\r\nb\r\n+OK\r\n')
+            self.proto.dataReceived('$1\r\nx\r\n')
+            yield defer.gatherResults([d1, d2, d3])
+            sizes = [e[3] for e in self.hooks.events if e[0] == 'reply']
+            self.assertEquals(sizes, [5 + self.statusExtra, 7])
+            self.assertEquals(self.hooks.received, 21)
+
+
+class IdenticalHooksTestCase(unittest.TestCase):
+    """The hooks see the same events whichever protocol is used."""
+
+    @defer.inlineCallbacks
+    def record(self, protocolClass):
+        hooks = RecordingHooks()
+        creator = protocol.ClientCreator(reactor, protocolClass,
+                                         hooks=[hooks])
+        try:
+            redis = yield creator.connectTCP(REDIS_HOST, REDIS_PORT)
+        except Exception:
+            raise unittest.SkipTest('Redis server not running')
+        try:
+            yield redis.delete('hooks_a', 'hooks_l')
+            yield redis.set('hooks_a', 'v')
+            yield redis.rpush('hooks_l', 'x', 'yy')
+            yield self.assertFailure(redis.lpush('hooks_a', 'x'),
+                                     ResponseError)
+            p = redis.pipeline()
+            p.get('hooks_a')
+            p.lrange('hooks_l', 0, -1)
+            p.get('hooks_missing')
+            yield p.execute()
+            t = redis.transaction()
+            t.incr('hooks_a')
+            t.append('hooks_a', 'w')
+            yield t.execute()
+        finally:
+            redis.transport.loseConnection()
+        # HiRedisClient estimates the sizes of the replies
+        defer.returnValue(([e[:2] if e[0] == 'reply' else e
+                            for e in hooks.events], hooks.received))
+
+    @defer.inlineCallbacks
+    def test_identical(self):
+        if hiredis is None:
+            raise unittest.SkipTest('hiredis is not installed')
+        events = yield self.record(Redis)
+        hiredisEvents = yield self.record(HiRedisClient)
+        self.assertEquals(events, hiredisEvents)
+        self.assertEquals(events[0][-2:], [('reply', 'APPEND'),
+                                           ('reply', 'EXEC')])
@@ -0,0 +1,239 @@
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+
+from txredis.client import Redis, HiRedisClient
+from txredis.exceptions import RequestTimeout, ResponseError
+from txredis.metrics import CommandMetrics, Histogram, prometheusText
+from txredis.prometheus import MetricsResource
+from txredis.testing import CommandsBaseTestCase
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+GET_A = '*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_buckets(self):
+        h = Histogram()
+        for value in (0, 1e-6, 0.0015, 0.003, 3, 1e6):
+            h.add(value)
+        buckets = dict(h.cumulative())
+        self.assertEquals(buckets[2.0 ** -20], 1)
+        self.assertEquals(buckets[2.0 ** -19], 2)
+        self.assertEquals(buckets[2.0 ** -9], 3)
+        self.assertEquals(buckets[2.0 ** -8], 4)
+        self.assertEquals(buckets[2.0 ** 2], 5)
+        self.assertEquals(buckets[float('inf')], 6)
+        self.assertEquals(h.count, 6)
+        self.assertEquals(h.quantile(0.5), 2.0 ** -9)
+        self.assertEquals(Histogram().quantile(0.5), None)
+
+    def test_inclusive_bounds(self):
+        h = Histogram()
+        for value in (2.0 ** -21, 2.0 ** -20, 0.5, 64):
+            h.add(value)
+        buckets = h.cumulative()
+        self.assertEquals(buckets[0], (2.0 ** -20, 2))
+        self.assertEquals(dict(buckets)[0.5], 3)
+        self.assertEquals(buckets[-2], (64, 4))
+        self.assertEquals(buckets[-1], (float('inf'), 4))
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    protocol = Redis
+
+    def setUp(self):
+        self.metrics = CommandMetrics()
+        self.proto = self.protocol(hooks=[self.metrics])
+        self.clock = Clock()
+        self.proto.clock = self.clock
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+
+    @defer.inlineCallbacks
+    def test_latency_and_bytes(self):
+        d = self.proto.get('a')
+        self.clock.advance(0.003)
+        self.proto.dataReceived('$3\r\nabc\r\n')
+        r = yield d
+        self.assertEquals(r, 'abc')
+        d = self.proto.lrange('l', 0, -1)
+        self.proto.dataReceived('*2\r\n$1\r\nx\r\n:5\r\n')
+        yield d
+        get = self.metrics.snapshot()['GET']
+        self.assertEquals((get['sent'], get['replies']), (1, 1))
+        self.assertEquals(get['bytesOut'], len(GET_A))
+        self.assertAlmostEqual(get['latencySum'], 0.003)
+        self.assertEquals(dict(get['buckets'])[2.0 ** -8], 1)
+        self.assertEquals(self.metrics.bytesIn, 9 + 15)
+        self.assertEquals(len(self.proto._sampled), 0)
+
+    @defer.inlineCallbacks
+    def test_failures(self):
+        d = self.proto.get('a')
+        self.proto.dataReceived('-ERR wrong\r\n')
+        yield self.assertFailure(d, ResponseError)
+        d = self.proto.with_timeout(1).get('a')
+        self.clock.advance(1)
+        yield self.assertFailure(d, RequestTimeout)
+        self.proto.dataReceived('$1\r\nx\r\n')
+        get = self.metrics.snapshot()['GET']
+        self.assertEquals((get['sent'], get['replies']), (2, 0))
+        self.assertEquals((get['errors'], get['timeouts']), (1, 1))
+        d = self.proto.ping()
+        self.transport.loseConnection()
+        yield self.assertFailure(d, Exception)
+        d = self.proto.ping()
+        yield self.assertFailure(d, RuntimeError)
+        self.assertEquals(self.metrics.snapshot()['PING']['errors'], 2)
+        self.assertEquals(len(self.proto._sampled), 0)
+
+    @defer.inlineCallbacks
+    def test_chunked_replies(self):
+        values = ['x' * 100000, 'y' * 10, None, 'z' * 70000]
+        data = ''.join('$-1\r\n' if v is None else
+                       '$%d\r\n%s\r\n' % (len(v), v) for v in values)
+        ds = [self.proto.get('a') for _ in values]
+        for i in xrange(0, len(data), 4096):
+            self.proto.dataReceived(data[i:i + 4096])
+        r = yield defer.gatherResults(ds)
+        self.assertEquals(r, values)
+        self.assertEquals(self.metrics.bytesIn, len(data))
+
+    @defer.inlineCallbacks
+    def test_pipeline(self):
+        p = self.proto.pipeline()
+        p.set('a', '1')
+        p.get('a')
+        d = p.execute()
+        replies = '+OK\r\n$1\r\n1\r\n'
+        self.proto.dataReceived(replies)
+        r = yield d
+        self.assertEquals(r, ['OK', '1'])
+        t = self.proto.transaction()
+        t.incr('a')
+        t.get('a')
+        d = t.execute()
+        data = '+OK\r\n+QUEUED\r\n+QUEUED\r\n*2\r\n:2\r\n$1\r\n2\r\n'
+        replies += data
+        self.proto.dataReceived(data)
+        r = yield d
+        self.assertEquals(r, [2, '2'])
+        snapshot = self.metrics.snapshot()
+        for cmd in ('SET', 'INCR', 'MULTI', 'EXEC'):
+            self.assertEquals(snapshot[cmd]['replies'], 1)
+        self.assertEquals(snapshot['GET']['replies'], 2)
+        self.assertEquals(snapshot['GET']['bytesOut'], 2 * len(GET_A))
+        self.assertEquals(self.metrics.bytesIn, len(replies))
+
+    @defer.inlineCallbacks
+    def test_sampled(self):
+        metrics = CommandMetrics(sampleEvery=4)
+        proto = self.protocol(hooks=[metrics], clock=self.clock)
+        proto.makeConnection(StringTransportWithDisconnection())
+        ds = [proto.get('a') for _ in range(8)]
+        self.clock.advance(0.5)
+        proto.dataReceived('$1\r\nx\r\n' * 8)
+        yield defer.gatherResults(ds)
+        get = metrics.snapshot()['GET']
+        # only the sampled requests are followed until their replies
+        self.assertEquals((get['sent'], get['replies']), (8, 2))
+        self.assertEquals(get['latencySum'], 1)
+        self.assertEquals(metrics.bytesIn, 8 * 7)
+        self.assertIn('redis_client_request_duration_seconds_count'
+                      '{command="GET"} 2\n', prometheusText(metrics))
+        self.assertEquals(len(proto._sampled), 0)
+
+    def test_disabled(self):
+        proto = self.protocol()
+        proto.makeConnection(StringTransportWithDisconnection())
+        proto.get('a')
+        p = proto.pipeline()
+        p.get('a')
+        self.assertEquals((proto._command_args, proto._followed), (None, 0))
+        self.assertEquals(p._labels, [])
+
+    def test_reset(self):
+        self.proto.get('a')
+        self.proto.dataReceived('$1\r\nx\r\n')
+        self.assertEquals(self.metrics.snapshot().keys(), ['GET'])
+        self.assertEquals(self.metrics.bytesIn, 7)
+        self.metrics.reset()
+        self.assertEquals(self.metrics.snapshot(), {})
+        self.assertEquals(self.metrics.bytesIn, 0)
+
+
+if hiredis is not None:
+
+    class HiRedisMetricsTestCase(MetricsTestCase):
+
+        protocol = HiRedisClient
+
+
+class PrometheusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = CommandMetrics()
+        self.metrics.command_sent('GET', 1, 22)
+        self.metrics.bytes_received(9)
+        self.metrics.reply_received('GET', 0.003, 9)
+
+    def test_text(self):
+        text = prometheusText(self.metrics)
+        self.assertIn('redis_client_commands_sent_total{command="GET"} 1\n',
+                      text)
+        self.assertIn('redis_client_sent_bytes_total{command="GET"} 22\n',
+                      text)
+        self.assertIn('redis_client_received_bytes_total 9\n', text)
+        self.assertIn('redis_client_request_duration_seconds_bucket'
+                      '{command="GET",le="0.00390625"} 1\n', text)
+        self.assertIn('redis_client_request_duration_seconds_bucket'
+                      '{command="GET",le="+Inf"} 1\n', text)
+        self.assertIn('redis_client_request_duration_seconds_count'
+                      '{command="GET"} 1\n', text)
+        self.assertIn('# HELP redis_client_errors_total Commands failed '
+                      'with an error reply or without a reply.\n', text)
+
+    def test_resource(self):
+        request = DummyRequest([''])
+        text = MetricsResource(self.metrics).render_GET(request)
+        self.assertEquals(text, prometheusText(self.metrics))
+        self.assertEquals(
+            request.responseHeaders.getRawHeaders('content-type'),
+            ['text/plain; version=0.0.4'])
+
+
+class MetricsCommandsTestCase(CommandsBaseTestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield CommandsBaseTestCase.setUp(self)
+        self.metrics = CommandMetrics()
+        self.redis.add_hook(self.metrics)
+
+    @defer.inlineCallbacks
+    def test_commands(self):
+        r = self.redis
+        yield r.delete('a')
+        yield r.set('a', 'v')
+        t = r.transaction()
+        t.get('a')
+        t.append('a', 'w')
+        yield t.execute()
+        a = yield r.get('a')
+        self.assertEquals(a, 'vw')
+        snapshot = self.metrics.snapshot()
+        self.assertEquals(snapshot['GET']['replies'], 2)
+        for cmd in ('DEL', 'SET', 'MULTI', 'APPEND', 'EXEC'):
+            self.assertEquals(snapshot[cmd]['sent'], 1)
+            self.assertEquals(snapshot[cmd]['replies'], 1)
@@ -0,0 +1,136 @@
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from txredis.exceptions import ConnectionError
+from txredis.pool import RedisConnectionPool
+from txredis.testing import REDIS_HOST, REDIS_PORT
+
+
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pools = []
+
+    def tearDown(self):
+        return defer.gatherResults([p.disconnect() for p in self.pools])
+
+    def makePool(self, **kwargs):
+        pool = RedisConnectionPool(REDIS_HOST, REDIS_PORT, **kwargs)
+        self.pools.append(pool)
+        return pool
+
+
+class ConnectionPoolTestCase(PoolTestCase):
+
+    @defer.inlineCallbacks
+    def test_commands(self):
+        pool = yield self.makePool(minSize=2).connect()
+        self.assertEqual(pool.stats()['connected'], 2)
+        yield pool.set('pool:a', 'x')
+        a = yield pool.get('pool:a')
+        self.assertEqual(a, 'x')
+        a = yield pool.hgetall('pool:missing')
+        self.assertEqual(a, {})
+        yield pool.delete('pool:a')
+
+    @defer.inlineCallbacks
+    def test_least_outstanding(self):
+        pool = yield self.makePool(minSize=2, maxSize=2).connect()
+        pings = [pool.ping()]
+        self.assertEqual(pool.stats()['pending'], [1, 0])
+        pings.append(pool.ping())
+        self.assertEqual(pool.stats()['pending'], [1, 1])
+        pings.append(pool.ping())
+        self.assertEqual(pool.stats()['pending'], [2, 1])
+        a = yield defer.gatherResults(pings)
+        self.assertEqual(a, ['PONG'] * 3)
+        self.assertEqual(pool.stats()['pending'], [0, 0])
+
+    @defer.inlineCallbacks
+    def test_grows_to_max_size(self):
+        pool = yield self.makePool(minSize=1, maxSize=3).connect()
+        requests = 0
+        while pool.stats()['connected'] < 3 and requests < 300:
+            yield defer.gatherResults([pool.ping() for i in range(3)])
+            requests += 3
+        yield defer.gatherResults([pool.ping() for i in range(6)])
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 3)
+        self.assertEqual(stats['connected'], 3)
+        self.assertEqual(stats['connections'], 3)
+        self.assertEqual(stats['requests'], requests + 6)
+
+    @defer.inlineCallbacks
+    def test_requests_wait_for_connection(self):
+        pool = self.makePool()
+        d = pool.ping()
+        self.assertEqual(pool.stats()['waiting'], 1)
+        a = yield d
+        self.assertEqual(a, 'PONG')
+        self.assertEqual(pool.stats()['waiting'], 0)
+
+    @defer.inlineCallbacks
+    def test_disconnect_fails_waiting(self):
+        pool = self.makePool()
+        d = pool.ping()
+        yield pool.disconnect()
+        yield self.assertFailure(d, ConnectionError)
+        yield self.assertFailure(pool.ping(), ConnectionError)
+
+    @defer.inlineCallbacks
+    def test_pipeline(self):
+        pool = yield self.makePool().connect()
+        p = pool.pipeline()
+        p.set('pool:a', 'y')
+        p.get('pool:a')
+        p.delete('pool:a')
+        a = yield p.execute()
+        self.assertEqual(a, ['OK', 'y', 1])
+
+
+    @defer.inlineCallbacks
+    def test_register_script(self):
+        pool = yield self.makePool(minSize=1, maxSize=1).connect()
+        yield pool.script_flush()
+        script = pool.register_script('return "pooled"')
+        # loaded at once on the open connection
+        a = yield pool.script_exists(script.sha1)
+        self.assertEqual(a, [True])
+        a = yield script()
+        self.assertEqual(a, 'pooled')
+
+class BlockingLaneTestCase(PoolTestCase):
+
+    @defer.inlineCallbacks
+    def test_blocking_does_not_stall(self):
+        pool = yield self.makePool(maxSize=1, maxBlocking=3).connect()
+        keys = ['pool:list%d' % i for i in range(3)]
+        yield pool.delete(*keys)
+        blocked = [pool.bpop([key], timeout=5) for key in keys]
+        blocked.append(pool.brpoplpush('pool:list0', 'pool:list1', 5))
+        for i in range(50):
+            a = yield pool.ping()
+            self.assertEqual(a, 'PONG')
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['blocking'], 3)
+        self.assertEqual(stats['blockingWaiting'], 1)
+        self.assertFalse([d for d in blocked if d.called])
+
+        for key in keys:
+            yield pool.rpush(key, 'v')
+        yield pool.rpush('pool:list0', 'w')
+        a = yield defer.gatherResults(blocked)
+        self.assertEqual(a, [[key, 'v'] for key in keys] + ['w'])
+        stats = pool.stats()
+        self.assertEqual(stats['blocking'], 0)
+        self.assertEqual(stats['blockingIdle'], 1)
+        yield pool.delete(*keys)
+
+    @defer.inlineCallbacks
+    def test_blocking_timeout(self):
+        pool = yield self.makePool(maxBlocking=1).connect()
+        yield pool.delete('pool:list')
+        a = yield pool.brpop(['pool:list'], timeout=1)
+        self.assertEqual(a, None)
+        self.assertEqual(pool.stats()['blockingIdle'], 1)
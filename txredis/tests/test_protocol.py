@@ -2,12 +2,15 @@
 # module. They don't seem to actually be test cases for the protocol module,
 # despite the name. They should probably be moved, and this test case module
 # should actually contain unit tests for RedisBase and HiRedisBase.
-from twisted.internet import defer
+from twisted.internet import defer, error
+from twisted.internet.task import Clock
 from twisted.test.proto_helpers import StringTransportWithDisconnection
 from twisted.trial import unittest
 
-from txredis.exceptions import ResponseError
+from txredis.exceptions import (
+    AskError, BackpressureError, MovedError, RequestTimeout, ResponseError)
 from txredis.client import Redis
+from txredis.hooks import RequestHooks
 
 
 class ProtocolTestCase(unittest.TestCase):
@@ -76,4 +79,598 @@ class ProtocolBufferingTestCase(ProtocolTestCase):
     def sendResponse(self, data):
         """Send a response one character at a time to test buffering"""
         for char in data:
-            self.proto.dataReceived(char)
\ No newline at end of file
+            self.proto.dataReceived(char)
+
+
+class ChunkedResponseTestCase(unittest.TestCase):
+
+    protocolKwargs = {}
+
+    def setUp(self):
+        self.proto = Redis(**self.protocolKwargs)
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+
+    def sendChunked(self, data, size):
+        for i in xrange(0, len(data), size):
+            self.proto.dataReceived(data[i:i + size])
+
+
+class ProtocolChunkingTestCase(ChunkedResponseTestCase):
+
+    @defer.inlineCallbacks
+    def test_large_multibulk_in_chunks(self):
+        elements = ['%d' % i * 10 for i in xrange(5000)]
+        reply = '*%d\r\n' % len(elements) + ''.join(
+            '$%d\r\n%s\r\n' % (len(e), e) for e in elements)
+        d = self.proto.lrange("foo", 0, -1)
+        self.sendChunked(reply, 4096)
+        r = yield d
+        self.assertEquals(r, elements)
+        self.assertEquals(len(self.proto._buffer), 0)
+
+    @defer.inlineCallbacks
+    def test_pipelined_replies_compact_buffer(self):
+        value = 'x' * 1000
+        count = 200
+        ds = [self.proto.get("foo") for _ in xrange(count)]
+        reply = ('$%d\r\n%s\r\n' % (len(value), value)) * count
+        # keep the last reply incomplete so the buffer is not emptied
+        self.proto.dataReceived(reply + '$3\r\nba')
+        self.assertTrue(len(self.proto._buffer) <=
+                        self.proto.COMPACT_THRESHOLD + 10)
+        results = yield defer.gatherResults(ds)
+        self.assertEquals(results, [value] * count)
+        d = self.proto.get("foo")
+        self.proto.dataReceived('r\r\n')
+        r = yield d
+        self.assertEquals(r, 'bar')
+
+
+class ProtocolParserTestCase(ChunkedResponseTestCase):
+
+    @defer.inlineCallbacks
+    def test_deeply_nested_multibulk(self):
+        depth = 5000
+        d = self.proto.execute()
+        self.proto.dataReceived('*1\r\n' * depth + ':1\r\n')
+        r = yield d
+        for _ in xrange(depth):
+            self.assertEquals(len(r), 1)
+            r = r[0]
+        self.assertEquals(r, 1)
+
+    @defer.inlineCallbacks
+    def test_many_replies_in_one_chunk(self):
+        ds = [self.proto.execute(), self.proto.get("foo"),
+              self.proto.lrange("foo", 0, -1), self.proto.dbsize()]
+        self.proto.dataReceived(
+            '*-1\r\n$3\r\nbar\r\n*0\r\n:7\r\n')
+        results = yield defer.gatherResults(ds)
+        self.assertEquals(results, [None, 'bar', [], 7])
+
+    @defer.inlineCallbacks
+    def test_error_inside_multibulk(self):
+        d1 = self.proto.execute()
+        d2 = self.proto.ping()
+        self.sendChunked(
+            '*3\r\n+OK\r\n-ERR wrong kind\r\n*2\r\n$-1\r\n:3\r\n+PONG\r\n', 3)
+        r = yield d1
+        self.assertEquals(r[0], 'OK')
+        self.assertTrue(isinstance(r[1], ResponseError))
+        self.assertEquals(str(r[1]), 'ERR wrong kind')
+        self.assertEquals(r[2], [None, 3])
+        r = yield d2
+        self.assertEquals(r, 'PONG')
+
+    @defer.inlineCallbacks
+    def test_redirect_errors(self):
+        d1 = self.proto.get("foo")
+        d2 = self.proto.get("bar")
+        self.proto.dataReceived('-MOVED 3999 127.0.0.1:6381\r\n'
+                                '-ASK 5061 10.0.0.2:7000\r\n')
+        e = yield self.assertFailure(d1, MovedError)
+        self.assertEquals((e.slot, e.host, e.port), (3999, '127.0.0.1', 6381))
+        e = yield self.assertFailure(d2, AskError)
+        self.assertEquals((e.slot, e.host, e.port), (5061, '10.0.0.2', 7000))
+        self.assertTrue(isinstance(e, ResponseError))
+
+    @defer.inlineCallbacks
+    def test_large_set(self):
+        members = [str(i) for i in xrange(100000)]
+        reply = '*%d\r\n' % len(members) + ''.join(
+            '$%d\r\n%s\r\n' % (len(m), m) for m in members)
+        d = self.proto.smembers("foo")
+        self.sendChunked(reply, 64 * 1024)
+        r = yield d
+        self.assertEquals(r, set(members))
+
+
+class ZeroCopyTestCase(ChunkedResponseTestCase):
+
+    protocolKwargs = {'zero_copy_threshold': 10}
+
+    @defer.inlineCallbacks
+    def test_large_bulk_is_a_buffer(self):
+        value = 'x' * 100
+        d1 = self.proto.get_buffer("big")
+        d2 = self.proto.get_buffer("small")
+        d3 = self.proto.get_buffer("big2")
+        self.sendChunked(
+            '$100\r\n%s\r\n$3\r\nbar\r\n$100\r\n%s\r\n' % (
+                value, value.upper()), 7)
+        r1, r2, r3 = yield defer.gatherResults([d1, d2, d3])
+        self.assertTrue(isinstance(r1, buffer))
+        self.assertEquals(str(r1), value)
+        self.assertTrue(isinstance(r2, buffer))
+        self.assertEquals(str(r2), 'bar')
+        self.assertEquals(str(r3), value.upper())
+
+    @defer.inlineCallbacks
+    def test_payload_survives_later_data(self):
+        value = 'y' * 50
+        d1 = self.proto.get_buffer("big")
+        d2 = self.proto.get("big2")
+        self.proto.dataReceived('$50\r\n%s\r\n$60\r\n%s' % (value, 'z' * 30))
+        r1 = yield d1
+        self.proto.dataReceived('%s\r\n' % ('z' * 30))
+        r2 = yield d2
+        self.assertEquals(str(r1), value)
+        self.assertEquals(r2, 'z' * 60)
+
+    @defer.inlineCallbacks
+    def test_other_requests_get_str(self):
+        value = 'v' * 50
+        d1 = self.proto.get("big")
+        d2 = self.proto.lrange("list", 0, -1)
+        d3 = self.proto.get_buffer("missing")
+        self.proto.dataReceived('$50\r\n%s\r\n*2\r\n$3\r\nfoo\r\n'
+                                '$60\r\n%s\r\n$-1\r\n' % (value, 'z' * 60))
+        r1, r2, r3 = yield defer.gatherResults([d1, d2, d3])
+        self.assertEquals(type(r1), str)
+        self.assertEquals(r1, value)
+        self.assertEquals(r2, ['foo', 'z' * 60])
+        self.assertEquals(type(r2[1]), str)
+        self.assertEquals(r3, None)
+
+    @defer.inlineCallbacks
+    def test_post_processed_replies(self):
+        info = ('# Server\r\nredis_version:2.6.0\r\n'
+                'uptime_in_seconds:%s\r\n' % ('1' * 20))
+        d1 = self.proto.info()
+        d2 = self.proto.hgetall("hash")
+        self.proto.dataReceived('$%d\r\n%s\r\n' % (len(info), info))
+        self.proto.dataReceived('*2\r\n$11\r\nfield-field\r\n'
+                                '$11\r\nvalue-value\r\n')
+        r1, r2 = yield defer.gatherResults([d1, d2])
+        self.assertEquals(r1, {'redis_version': '2.6.0',
+                               'uptime_in_seconds': int('1' * 20)})
+        self.assertEquals(r2, {'field-field': 'value-value'})
+
+
+class BulkStreamTestCase(ChunkedResponseTestCase):
+
+    @defer.inlineCallbacks
+    def test_stream_in_pieces(self):
+        value = ''.join(chr(i % 256) for i in xrange(10000))
+        chunks = []
+        d1 = self.proto.get_stream("big", chunks.append)
+        d2 = self.proto.get("small")
+        self.sendChunked('$%d\r\n%s\r\n$3\r\nbar\r\n' % (
+            len(value), value), 1000)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(''.join(chunks), value)
+        self.assertEquals(len(self.proto._buffer), 0)
+        r = yield d1
+        self.assertEquals(r, len(value))
+        r = yield d2
+        self.assertEquals(r, 'bar')
+
+    @defer.inlineCallbacks
+    def test_stream_split_trailer(self):
+        chunks = []
+        d1 = self.proto.get_stream("foo", chunks.append)
+        d2 = self.proto.ping()
+        self.sendChunked('$3\r\nbar\r\n+PONG\r\n', 1)
+        r = yield d1
+        self.assertEquals((r, chunks), (3, ['b', 'a', 'r']))
+        r = yield d2
+        self.assertEquals(r, 'PONG')
+
+    @defer.inlineCallbacks
+    def test_stream_not_bulk(self):
+        d1 = self.proto.get_stream("foo", self.fail)
+        d2 = self.proto.get_stream("bar", self.fail)
+        d3 = self.proto.get("baz")
+        self.proto.dataReceived(
+            '$-1\r\n-ERR wrong kind\r\n$3\r\nbaz\r\n')
+        r = yield d1
+        self.assertEquals(r, None)
+        yield self.assertFailure(d2, ResponseError)
+        r = yield d3
+        self.assertEquals(r, 'baz')
+        self.assertEquals(self.proto._reply_consumers, {})
+
+    @defer.inlineCallbacks
+    def test_consumer_error(self):
+        def consumer(data):
+            raise ValueError(data)
+        d1 = self.proto.get_stream("foo", consumer)
+        d2 = self.proto.get("bar")
+        self.proto.dataReceived('$6\r\nfoo')
+        self.proto.dataReceived('bar\r\n$3\r\nbar\r\n')
+        yield self.assertFailure(d1, ValueError)
+        r = yield d2
+        self.assertEquals(r, 'bar')
+
+
+class ElementBatchesTestCase(ChunkedResponseTestCase):
+
+    @defer.inlineCallbacks
+    def test_batches(self):
+        elements = [str(i) for i in xrange(25)]
+        reply = '*%d\r\n' % len(elements) + ''.join(
+            '$%d\r\n%s\r\n' % (len(e), e) for e in elements)
+        batches = []
+        d1 = self.proto.lrange_batches("foo", 0, -1, batches.append, 10)
+        d2 = self.proto.get("bar")
+        self.sendChunked(reply + '$3\r\nbar\r\n', 5)
+        r = yield d1
+        self.assertEquals(r, 25)
+        self.assertEquals(batches,
+            [elements[:10], elements[10:20], elements[20:]])
+        r = yield d2
+        self.assertEquals(r, 'bar')
+
+    @defer.inlineCallbacks
+    def test_batches_are_delivered_early(self):
+        batches = []
+        d = self.proto.smembers_batches("foo", batches.append, 2)
+        self.proto.dataReceived('*5\r\n$1\r\na\r\n$1\r\nb\r\n$1\r\nc')
+        self.assertEquals(batches, [['a', 'b']])
+        self.assertFalse(d.called)
+        self.proto.dataReceived('\r\n*2\r\n:1\r\n:2\r\n$1\r\nd\r\n')
+        self.assertEquals(batches, [['a', 'b'], ['c', [1, 2]], ['d']])
+        r = yield d
+        self.assertEquals(r, 5)
+
+    @defer.inlineCallbacks
+    def test_pair_batches(self):
+        batches = []
+        d = self.proto.zrange_batches("foo", 0, -1, batches.append, 2,
+                                      withscores=True)
+        self.proto.dataReceived('*6\r\n$1\r\na\r\n$1\r\n1\r\n'
+                                '$1\r\nb\r\n$1\r\n2\r\n'
+                                '$1\r\nc\r\n$3\r\n2.5\r\n')
+        r = yield d
+        self.assertEquals(r, 3)
+        self.assertEquals(batches,
+            [[('a', 1.0), ('b', 2.0)], [('c', 2.5)]])
+
+    @defer.inlineCallbacks
+    def test_batches_not_multibulk(self):
+        d1 = self.proto.hgetall_batches("foo", self.fail)
+        d2 = self.proto.lrange_batches("bar", 0, -1, self.fail)
+        d3 = self.proto.execute()
+        self.proto.dataReceived('*0\r\n-ERR wrong kind\r\n*-1\r\n')
+        r = yield d1
+        self.assertEquals(r, 0)
+        yield self.assertFailure(d2, ResponseError)
+        r = yield d3
+        self.assertEquals(r, None)
+        self.assertEquals(self.proto._reply_consumers, {})
+
+    @defer.inlineCallbacks
+    def test_callback_error(self):
+        def callback(batch):
+            raise ValueError(batch)
+        d1 = self.proto.lrange_batches("foo", 0, -1, callback, 1)
+        d2 = self.proto.get("bar")
+        self.proto.dataReceived(
+            '*2\r\n$1\r\na\r\n$1\r\nb\r\n$3\r\nbar\r\n')
+        yield self.assertFailure(d1, ValueError)
+        r = yield d2
+        self.assertEquals(r, 'bar')
+
+
+class WriteCoalescingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.proto = Redis(coalesce_writes=True, clock=self.clock)
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.writes = []
+        self.transport.writeSequence = self.writes.append
+        self.proto.makeConnection(self.transport)
+
+    def test_one_write_per_iteration(self):
+        self.proto.get("foo")
+        self.assertEquals(
+            self.transport.value(), '*2\r\n$3\r\nGET\r\n$3\r\nfoo\r\n')
+        self.proto.hget_value("bar", "baz")
+        self.proto.ping()
+        self.assertEquals(self.writes, [])
+        self.clock.advance(0)
+        self.assertEquals(self.writes, [[
+            '*3\r\n$4\r\nHGET\r\n$3\r\nbar\r\n$3\r\nbaz\r\n',
+            '*1\r\n$4\r\nPING\r\n']])
+        self.clock.advance(0)
+        self.assertEquals(len(self.writes), 1)
+
+    def test_lone_commands_are_not_delayed(self):
+        self.proto.get("foo")
+        self.clock.advance(0)
+        self.proto.get("bar")
+        self.assertEquals(
+            self.transport.value(),
+            '*2\r\n$3\r\nGET\r\n$3\r\nfoo\r\n'
+            '*2\r\n$3\r\nGET\r\n$3\r\nbar\r\n')
+        self.clock.advance(0)
+        self.assertEquals(self.writes, [])
+
+    def test_flush_at_threshold(self):
+        value = 'x' * (self.proto.MAX_COALESCED_BYTES // 2)
+        self.proto.ping()
+        self.proto.set("foo", value)
+        self.assertEquals(self.writes, [])
+        self.proto.set("bar", value)
+        self.assertEquals(len(self.writes), 1)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    @defer.inlineCallbacks
+    def test_replies(self):
+        d = self.proto.ping()
+        self.clock.advance(0)
+        self.proto.dataReceived("+PONG\r\n")
+        r = yield d
+        self.assertEquals(r, 'PONG')
+
+    @defer.inlineCallbacks
+    def test_disconnect_drops_buffer(self):
+        d1 = self.proto.ping()
+        d2 = self.proto.get("foo")
+        self.transport.loseConnection()
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.assertEquals(self.writes, [])
+        yield self.assertFailure(d1, error.ConnectionDone)
+        yield self.assertFailure(d2, error.ConnectionDone)
+
+
+class DeadlineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.proto = Redis(max_late_replies=3, clock=self.clock)
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+
+    @defer.inlineCallbacks
+    def test_late_reply_discarded(self):
+        fast = self.proto.with_timeout(0.05)
+        d1 = fast.get("foo")
+        d2 = self.proto.get("bar")
+        self.clock.advance(0.05)
+        d3 = fast.get("baz")
+        yield self.assertFailure(d1, RequestTimeout)
+        self.assertFalse(d2.called)
+        self.proto.dataReceived("$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n")
+        r = yield d2
+        self.assertEquals(r, 'b')
+        r = yield d3
+        self.assertEquals(r, 'c')
+        self.assertEquals((self.proto.timed_out, self.proto.late_replies),
+                          (1, 1))
+        self.assertTrue(self.transport.connected)
+        self.assertEquals(self.proto._expired, set())
+
+    @defer.inlineCallbacks
+    def test_overrides_kept(self):
+        logged = []
+
+        class Logged(Redis):
+            def _transmit(self, data):
+                logged.append(data)
+                Redis._transmit(self, data)
+
+            def responseReceived(self, reply):
+                logged.append(reply)
+                Redis.responseReceived(self, reply)
+
+        proto = Logged(single_flight=True, max_in_flight=2,
+                       coalesce_writes=True, hooks=[RequestHooks()])
+        proto.makeConnection(StringTransportWithDisconnection())
+        d = proto.get("foo")
+        proto.dataReceived("$3\r\nbar\r\n")
+        r = yield d
+        self.assertEquals(r, 'bar')
+        self.assertEquals(logged,
+                          ['*2\r\n$3\r\nGET\r\n$3\r\nfoo\r\n', 'bar'])
+
+    @defer.inlineCallbacks
+    def test_default_timeout(self):
+        self.proto.setTimeout(1)
+        d1 = self.proto.get("foo")
+        d2 = self.proto.with_timeout(5).get("bar")
+        self.clock.advance(1)
+        yield self.assertFailure(d1, RequestTimeout)
+        self.assertFalse(d2.called)
+        self.proto.setTimeout(None)
+        d3 = self.proto.get("baz")
+        self.clock.advance(5)
+        yield self.assertFailure(d2, RequestTimeout)
+        self.assertFalse(d3.called)
+        self.assertTrue(self.transport.connected)
+
+    def test_single_timer(self):
+        fast = self.proto.with_timeout(1)
+        for _ in range(10):
+            fast.ping()
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.proto.with_timeout(0.5).ping()
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.proto.dataReceived("+PONG\r\n" * 11)
+        self.clock.advance(1)
+        self.assertEquals(self.proto.timed_out, 0)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    @defer.inlineCallbacks
+    def test_answered_requests_released(self):
+        fast = self.proto.with_timeout(30)
+        ds = [fast.get("foo") for _ in range(20)]
+        self.proto.dataReceived("$3\r\nbar\r\n" * 20)
+        yield defer.gatherResults(ds)
+        self.assertEquals([e for e in self.proto._deadlines
+                           if e[2] is not None], [])
+        self.assertTrue(len(self.proto._deadlines) <= 10)
+        d = fast.get("foo")
+        self.clock.advance(30)
+        yield self.assertFailure(d, RequestTimeout)
+        self.assertEquals(self.proto._deadlines, [])
+        self.assertEquals(self.proto.timed_out, 1)
+
+    @defer.inlineCallbacks
+    def test_streamed_reply_discarded(self):
+        pieces = []
+        d = self.proto.with_timeout(0.05).get_stream("foo", pieces.append)
+        self.proto.dataReceived("$6\r\nabc")
+        self.clock.advance(0.05)
+        yield self.assertFailure(d, RequestTimeout)
+        self.proto.dataReceived("def\r\n")
+        d = self.proto.ping()
+        self.proto.dataReceived("+PONG\r\n")
+        r = yield d
+        self.assertEquals(r, 'PONG')
+        self.assertEquals(pieces, ['abc'])
+
+    @defer.inlineCallbacks
+    def test_recycle_after_late_replies(self):
+        fast = self.proto.with_timeout(0.05)
+        ds = [fast.get("foo") for _ in range(2)]
+        other = self.proto.get("bar")
+        self.clock.advance(0.05)
+        self.assertTrue(self.transport.connected)
+        ds.append(fast.get("foo"))
+        self.clock.advance(0.05)
+        self.assertFalse(self.transport.connected)
+        for d in ds:
+            yield self.assertFailure(d, RequestTimeout)
+        yield self.assertFailure(other, error.ConnectionDone)
+
+
+class BackpressureTestCase(unittest.TestCase):
+
+    def connect(self, **kwargs):
+        self.proto = Redis(**kwargs)
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+        return self.proto
+
+    def written(self):
+        value = self.transport.value()
+        self.transport.clear()
+        return value
+
+    @defer.inlineCallbacks
+    def test_max_in_flight(self):
+        proto = self.connect(max_in_flight=2)
+        ds = [proto.get(key) for key in 'abcd']
+        self.assertEquals(self.written(),
+                          '*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+                          '*2\r\n$3\r\nGET\r\n$1\r\nb\r\n')
+        stats = proto.queue_stats()
+        self.assertEquals((stats['in_flight'], stats['held']), (2, 2))
+        self.assertEquals(stats['held_bytes'], 40)
+        proto.dataReceived("$1\r\nA\r\n")
+        self.assertEquals(self.written(), '*2\r\n$3\r\nGET\r\n$1\r\nc\r\n')
+        proto.dataReceived("$1\r\nB\r\n$1\r\nC\r\n$1\r\nD\r\n")
+        self.assertEquals(self.written(), '*2\r\n$3\r\nGET\r\n$1\r\nd\r\n')
+        r = yield defer.gatherResults(ds)
+        self.assertEquals(r, ['A', 'B', 'C', 'D'])
+        stats = proto.queue_stats()
+        self.assertEquals((stats['in_flight'], stats['held']), (0, 0))
+
+    @defer.inlineCallbacks
+    def test_pipeline_held(self):
+        proto = self.connect(max_in_flight=1)
+        d = proto.ping()
+        p = proto.pipeline()
+        p.get('a')
+        p.get('b')
+        p.execute()
+        self.assertEquals(proto.queue_stats()['held'], 2)
+        self.written()
+        proto.dataReceived("+PONG\r\n")
+        self.assertEquals(self.written(),
+                          '*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+                          '*2\r\n$3\r\nGET\r\n$1\r\nb\r\n')
+        proto.dataReceived("$1\r\nA\r\n$1\r\nB\r\n")
+        r = yield d
+        self.assertEquals(r, 'PONG')
+
+    @defer.inlineCallbacks
+    def test_fail(self):
+        proto = self.connect(max_in_flight=1, backpressure='fail')
+        d1 = proto.get('a')
+        d2 = proto.get('b')
+        yield self.assertFailure(d2, BackpressureError)
+        self.assertEquals(self.written(), '*2\r\n$3\r\nGET\r\n$1\r\na\r\n')
+        proto.dataReceived("$1\r\nA\r\n")
+        r = yield d1
+        self.assertEquals(r, 'A')
+        self.assertEquals(proto.queue_stats()['rejected'], 1)
+
+    @defer.inlineCallbacks
+    def test_setup_not_limited(self):
+        proto = Redis(db=3, password='pw', max_in_flight=1,
+                      backpressure='fail')
+        sha = 'e0e1f9fabfc9d4800c877a703b823ac0578ff8db'
+        proto.scripts[sha] = 'return 1'
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = proto
+        proto.makeConnection(self.transport)
+        self.assertEquals(self.written(),
+                          '*2\r\n$4\r\nAUTH\r\n$2\r\npw\r\n'
+                          '*2\r\n$6\r\nSELECT\r\n$1\r\n3\r\n'
+                          '*3\r\n$6\r\nSCRIPT\r\n$4\r\nLOAD\r\n'
+                          '$8\r\nreturn 1\r\n')
+        self.assertEquals(proto.queue_stats()['rejected'], 0)
+        proto.dataReceived('+OK\r\n+OK\r\n$40\r\n%s\r\n' % sha)
+        d = proto.get('a')
+        self.assertEquals(self.written(),
+                          '*2\r\n$3\r\nGET\r\n$1\r\na\r\n')
+        proto.dataReceived('$1\r\nA\r\n')
+        r = yield d
+        self.assertEquals(r, 'A')
+
+    @defer.inlineCallbacks
+    def test_max_queued_bytes(self):
+        proto = self.connect(max_in_flight=1, max_queued_bytes=30)
+        proto.get('a')
+        proto.get('b')
+        d = proto.get('c')
+        yield self.assertFailure(d, BackpressureError)
+        self.assertEquals(proto.queue_stats()['held_bytes'], 20)
+        self.assertRaises(ValueError, Redis, backpressure='drop')
+
+    def test_producer(self):
+        proto = self.connect(max_queued_bytes=1024)
+        self.assertIdentical(self.transport.producer, proto)
+        proto.pauseProducing()
+        proto.get('a')
+        self.assertEquals(self.written(), '')
+        self.assertTrue(proto.queue_stats()['paused'])
+        proto.resumeProducing()
+        self.assertEquals(self.written(), '*2\r\n$3\r\nGET\r\n$1\r\na\r\n')
+
+    @defer.inlineCallbacks
+    def test_disconnect(self):
+        proto = self.connect(max_in_flight=1)
+        ds = [proto.get(key) for key in 'ab']
+        self.transport.loseConnection()
+        for d in ds:
+            yield self.assertFailure(d, error.ConnectionDone)
+        self.assertEquals(proto.queue_stats()['held'], 0)
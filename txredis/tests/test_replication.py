@@ -0,0 +1,138 @@
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.trial import unittest
+
+from txredis.client import Redis
+from txredis.exceptions import ResponseError
+from txredis.replication import ReplicatedRedis
+from txredis.testing import FakeRedisServer, Status, REDIS_HOST
+
+
+class FakeNode(FakeRedisServer):
+    """Answers GET with its own name, or a scripted error, and queues the
+    GETs of a MULTI until EXEC."""
+
+    def __init__(self, name):
+        FakeRedisServer.__init__(self)
+        self.name = name
+        self.error = None
+
+    def cmd_GET(self, connection, key):
+        reply = self.error or self.name
+        if 'queued' in connection.state:
+            connection.state['queued'].append(reply)
+            return Status('QUEUED')
+        return reply
+
+    def cmd_SET(self, connection, key, value):
+        return Status('OK')
+
+    def cmd_WATCH(self, connection, *keys):
+        return Status('OK')
+
+    def cmd_UNWATCH(self, connection):
+        return Status('OK')
+
+    def cmd_MULTI(self, connection):
+        connection.state['queued'] = []
+        return Status('OK')
+
+    def cmd_EXEC(self, connection):
+        return connection.state.pop('queued')
+
+
+class ReplicatedRedisTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.servers = [FakeNode(name)
+                        for name in ('master', 'replica1', 'replica2')]
+        self.clients = []
+        for server in self.servers:
+            server.listen()
+            client = yield protocol.ClientCreator(reactor, Redis).connectTCP(
+                REDIS_HOST, server.port)
+            self.clients.append(client)
+        self.redis = ReplicatedRedis(self.clients[0], self.clients[1:])
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            client.transport.loseConnection()
+        yield defer.gatherResults([s.stop() for s in self.servers])
+
+    @defer.inlineCallbacks
+    def test_split(self):
+        r = self.redis
+        a = yield r.set('k', 'v')
+        self.assertEqual(a, 'OK')
+        self.assertEqual(self.servers[0].commands, [['SET', 'k', 'v']])
+        reads = yield defer.gatherResults([r.get('k') for _ in range(20)])
+        self.assertEqual(set(reads), set(['replica1', 'replica2']))
+        self.assertEqual(len(self.servers[0].commands), 1)
+        for replica in self.clients[1:]:
+            self.assertTrue(r.latency(replica) >= 0)
+
+    def test_latency_weights(self):
+        r = self.redis
+        fast, slow = self.clients[1:]
+        r._latency[fast] = 0.001
+        r._latency[slow] = 0.009
+        r._random.seed(0)
+        picks = [r._pickReplica() for _ in range(1000)]
+        self.assertTrue(850 < picks.count(fast) < 950, picks.count(fast))
+
+    @defer.inlineCallbacks
+    def test_unavailable_replicas(self):
+        r = self.redis
+        for server in self.servers[1:]:
+            server.error = ResponseError('LOADING Redis is loading')
+        # one at a time, so that each read sees the replicas left out
+        for _ in range(2):
+            a = yield r.get('k')
+            self.assertEqual(a, 'master')
+        self.assertEqual(r.healthyReplicas(), [])
+
+        self.servers[1].error = None
+        r._downUntil.clear()
+        self.clients[2].transport.loseConnection()
+        yield self.servers[2].stop()
+        while not self.clients[2]._disconnected:
+            yield task.deferLater(reactor, 0, lambda: None)
+        reads = yield defer.gatherResults([r.get('k') for _ in range(4)])
+        self.assertEqual(reads, ['replica1'] * 4)
+
+    @defer.inlineCallbacks
+    def test_other_errors(self):
+        self.servers[1].error = ResponseError('ERR wrong kind')
+        self.servers[2].error = ResponseError('ERR wrong kind')
+        yield self.assertFailure(self.redis.get('k'), ResponseError)
+
+    @defer.inlineCallbacks
+    def test_pin_reads(self):
+        r = self.redis
+        yield r.watch('k')
+        a = yield r.get('k')
+        self.assertEqual(a, 'master')
+        yield r.unwatch()
+        a = yield r.get('k')
+        self.assertNotEqual(a, 'master')
+
+        r.pinReads = False
+        yield r.watch('k')
+        a = yield r.get('k')
+        self.assertNotEqual(a, 'master')
+
+    @defer.inlineCallbacks
+    def test_multi_reads_on_master(self):
+        r = self.redis
+        r.pinReads = False
+        yield r.multi()
+        a = yield r.get('k')
+        self.assertEqual(a, 'QUEUED')
+        a = yield r.execute()
+        self.assertEqual(a, ['master'])
+        a = yield r.get('k')
+        self.assertNotEqual(a, 'master')
@@ -0,0 +1,30 @@
+from twisted.trial import unittest
+
+from txredis.routing import commandKeys, hashTag
+
+
+class CommandKeysTestCase(unittest.TestCase):
+
+    def test_command_keys(self):
+        t = self.assertEqual
+        t(commandKeys(('GET', 'a')), ['a'])
+        t(commandKeys(('HSET', 'h', 'f', 'v')), ['h'])
+        t(commandKeys(('PING',)), [])
+        t(commandKeys(('MGET', 'a', 'b')), ['a', 'b'])
+        t(commandKeys(('msetnx', 'a', 1, 'b', 2)), ['a', 'b'])
+        t(commandKeys(('BLPOP', 'a', 'b', '30')), ['a', 'b'])
+        t(commandKeys(('BRPOPLPUSH', 'a', 'b', '30')), ['a', 'b'])
+        t(commandKeys(('SMOVE', 'a', 'b', 'm')), ['a', 'b'])
+        t(commandKeys(('ZUNIONSTORE', 'd', 2, 'a', 'b', 'WEIGHTS', 1, 2)),
+          ['d', 'a', 'b'])
+        t(commandKeys(('EVALSHA', 'sha', 1, 'a', 'arg')), ['a'])
+        t(commandKeys(('OBJECT', 'ENCODING', 'a')), ['a'])
+
+    def test_hash_tag(self):
+        t = self.assertEqual
+        t(hashTag('{user42}:name'), 'user42')
+        t(hashTag('profile:{user42}'), 'user42')
+        t(hashTag('{}user42'), '{}user42')
+        t(hashTag('user{42'), 'user{42')
+        t(hashTag('{a}{b}'), 'a')
+        t(hashTag(42), '42')
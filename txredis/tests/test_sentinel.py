@@ -0,0 +1,167 @@
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from txredis.exceptions import ConnectionError
+from txredis.sentinel import SentinelClientFactory, discoverMaster
+from txredis.testing import FakeRedisServer, Status, encodeReply, REDIS_HOST
+
+
+class FakeMaster(FakeRedisServer):
+
+    def __init__(self, name):
+        FakeRedisServer.__init__(self)
+        self.name = name
+
+    def cmd_AUTH(self, connection, password):
+        return Status('OK')
+
+    def cmd_SELECT(self, connection, db):
+        return Status('OK')
+
+    def cmd_GET(self, connection, key):
+        return self.name
+
+
+class FakeSentinel(FakeRedisServer):
+    """Stand-in Sentinel monitoring the service mymaster."""
+
+    def __init__(self, master=None):
+        FakeRedisServer.__init__(self)
+        self.master = master
+        self.subscribers = []
+
+    def cmd_SENTINEL(self, connection, subcommand, name):
+        if name != 'mymaster' or self.master is None:
+            return None
+        return [REDIS_HOST, str(self.master.port)]
+
+    def cmd_SUBSCRIBE(self, connection, channel):
+        self.subscribers.append(connection)
+        return ['subscribe', channel, 1]
+
+    def switch(self, master):
+        old, self.master = self.master, master
+        message = 'mymaster %s %d %s %d' % (REDIS_HOST, old.port,
+                                            REDIS_HOST, master.port)
+        for connection in self.subscribers:
+            if connection in self.connections:
+                connection.transport.write(encodeReply(
+                    ['message', '+switch-master', message]))
+
+
+class SentinelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.masters = [FakeMaster('m1'), FakeMaster('m2')]
+        self.sentinels = [FakeSentinel(), FakeSentinel(self.masters[0])]
+        self.servers = self.masters + self.sentinels
+        for server in self.servers:
+            server.listen()
+        self.factory = None
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        if self.factory is not None:
+            yield self.factory.disconnect()
+        yield defer.gatherResults([s.stop() for s in self.servers])
+
+    def addresses(self):
+        return [(REDIS_HOST, s.port) for s in self.sentinels]
+
+    @defer.inlineCallbacks
+    def test_discover_master(self):
+        # the first Sentinel does not know the service
+        address = yield discoverMaster(self.addresses(), 'mymaster')
+        self.assertEqual(address, (REDIS_HOST, self.masters[0].port))
+        yield self.assertFailure(
+            discoverMaster(self.addresses(), 'other'), ConnectionError)
+
+    @defer.inlineCallbacks
+    def test_failover(self):
+        m1, m2 = self.masters
+        self.sentinels[0].master = m1
+        self.factory = SentinelClientFactory(
+            self.addresses(), 'mymaster', db=3, password='secret')
+        client = yield self.factory.connect()
+        a = yield client.get('k')
+        self.assertEqual(a, 'm1')
+        self.assertEqual(m1.commands[:2], [['AUTH', 'secret'],
+                                           ['SELECT', '3']])
+        while not self.sentinels[0].subscribers:
+            yield client.ping()
+
+        start = time.time()
+        connected = self.factory.deferred
+        self.sentinels[0].switch(m2)
+        client = yield connected
+        # reconnects at once, not after the reconnection delay
+        self.assertTrue(time.time() - start < self.factory.initialDelay)
+        a = yield client.get('k')
+        self.assertEqual(a, 'm2')
+        self.assertEqual(m2.commands[:2], [['AUTH', 'secret'],
+                                           ['SELECT', '3']])
+        self.assertEqual(self.factory.address, (REDIS_HOST, m2.port))
+
+    @defer.inlineCallbacks
+    def test_rediscover_on_connection_lost(self):
+        m1, m2 = self.masters
+        self.factory = SentinelClientFactory(self.addresses(), 'mymaster')
+        self.factory.initialDelay = self.factory.delay = 0.05
+        self.factory.factor = 1
+        client = yield self.factory.connect()
+        a = yield client.get('k')
+        self.assertEqual(a, 'm1')
+
+        # the Sentinels know of the new master but the switch message
+        # is missed
+        self.sentinels[1].master = m2
+        connected = self.factory.deferred
+        yield m1.stop()
+        client = yield connected
+        a = yield client.get('k')
+        self.assertEqual(a, 'm2')
+
+    @defer.inlineCallbacks
+    def test_switch_missed_by_watcher(self):
+        m1, m2 = self.masters
+        self.sentinels[0].master = m1
+        self.factory = SentinelClientFactory(self.addresses(), 'mymaster')
+        watcher = self.factory._watcher
+        watcher.initialDelay = watcher.delay = 0.05
+        client = yield self.factory.connect()
+        a = yield client.get('k')
+        self.assertEqual(a, 'm1')
+        while not self.sentinels[0].subscribers:
+            yield client.ping()
+
+        # the master switches while the watcher is not subscribed, and the
+        # connection to the old master stays up
+        connected = self.factory.deferred
+        watcher.client.transport.loseConnection()
+        for sentinel in self.sentinels:
+            sentinel.master = m2
+        client = yield connected
+        a = yield client.get('k')
+        self.assertEqual(a, 'm2')
+        self.assertEqual(self.factory.address, (REDIS_HOST, m2.port))
+
+    @defer.inlineCallbacks
+    def test_master_announced_after_failed_connect(self):
+        m1, m2 = self.masters
+        self.sentinels[1].master = None
+        self.factory = SentinelClientFactory(
+            self.addresses(), 'mymaster', reactor=reactor)
+        yield self.assertFailure(self.factory.connect(), ConnectionError)
+        while not self.sentinels[0].subscribers:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+        # the watcher stays subscribed and connects on the next switch
+        connected = self.factory.deferred
+        self.sentinels[0].master = m1
+        self.sentinels[0].switch(m2)
+        client = yield connected
+        a = yield client.get('k')
+        self.assertEqual(a, 'm2')
+        self.assertEqual(self.factory.address, (REDIS_HOST, m2.port))
@@ -0,0 +1,120 @@
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from txredis.client import Redis
+from txredis.exceptions import InvalidCommand
+from txredis.sharding import HashRing, ShardedRedis
+from txredis.testing import REDIS_HOST, REDIS_PORT
+
+
+class HashRingTestCase(unittest.TestCase):
+
+    keys = ['key:%d' % i for i in range(10000)]
+
+    def test_distribution(self):
+        ring = HashRing()
+        for name in ('a', 'b', 'c', 'd'):
+            ring.add_node(name)
+        counts = {}
+        for key in self.keys:
+            node = ring.get_node(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(sorted(counts), ['a', 'b', 'c', 'd'])
+        for count in counts.itervalues():
+            self.assertTrue(1500 < count < 3500, counts)
+
+    def test_add_node_remaps_share(self):
+        ring = HashRing()
+        for name in ('a', 'b', 'c', 'd'):
+            ring.add_node(name)
+        before = [ring.get_node(key) for key in self.keys]
+        ring.add_node('e')
+        after = [ring.get_node(key) for key in self.keys]
+        moved = [(b, a) for b, a in zip(before, after) if b != a]
+        # only keys moving to the new node change, about 1/5 of them
+        self.assertEqual(set(a for _, a in moved), set(['e']))
+        self.assertTrue(1000 < len(moved) < 3000, len(moved))
+
+        ring.remove_node('e')
+        self.assertEqual([ring.get_node(key) for key in self.keys], before)
+
+    def test_weights(self):
+        ring = HashRing()
+        ring.add_node('a', 3)
+        ring.add_node('b', 1)
+        a = len([key for key in self.keys if ring.get_node(key) == 'a'])
+        self.assertTrue(6500 < a < 8500, a)
+
+
+class ShardedRedisTestCase(unittest.TestCase):
+
+    dbs = [13, 14, 15]
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        creator = protocol.ClientCreator(reactor, Redis)
+        self.clients = []
+        for db in self.dbs:
+            client = yield creator.connectTCP(REDIS_HOST, REDIS_PORT)
+            yield client.select(db)
+            yield client.flush()
+            self.clients.append(client)
+        self.redis = ShardedRedis(dict(
+            ('node%d' % db, client)
+            for db, client in zip(self.dbs, self.clients)))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            yield client.flush()
+            client.transport.loseConnection()
+
+    @defer.inlineCallbacks
+    def test_single_key(self):
+        r = self.redis
+        keys = ['key%d' % i for i in range(30)]
+        for key in keys:
+            yield r.set(key, key)
+        for key in keys:
+            a = yield r.get(key)
+            self.assertEqual(a, key)
+            a = yield r.node_for(key).get(key)
+            self.assertEqual(a, key)
+        sizes = yield defer.gatherResults([c.dbsize() for c in self.clients])
+        self.assertEqual(sum(sizes), 30)
+        self.assertEqual(len([s for s in sizes if s]), 3)
+
+    @defer.inlineCallbacks
+    def test_multi_key(self):
+        r = self.redis
+        mapping = dict(('key%d' % i, 'v%d' % i) for i in range(20))
+        a = yield r.mset(mapping)
+        self.assertEqual(a, 'OK')
+        keys = sorted(mapping) + ['missing']
+        a = yield r.mget(*keys)
+        self.assertEqual(a, [mapping.get(key) for key in keys])
+        a = yield r.delete(*keys)
+        self.assertEqual(a, 20)
+        a = yield r.mget(*keys)
+        self.assertEqual(a, [None] * 21)
+
+    @defer.inlineCallbacks
+    def test_hash_tags(self):
+        r = self.redis
+        keys = ['{user42}:%d' % i for i in range(10)]
+        nodes = set(r.node_for(key) for key in keys)
+        self.assertEqual(len(nodes), 1)
+        yield r.sadd(keys[0], 'a', 'b')
+        yield r.sadd(keys[1], 'b', 'c')
+        a = yield r.sinter(keys[0], keys[1])
+        self.assertEqual(a, set(['b']))
+
+    def test_cross_node(self):
+        r = self.redis
+        keys = ['key%d' % i for i in range(10)]
+        self.assertRaises(InvalidCommand, r.sinter, *keys)
+        self.assertRaises(InvalidCommand, r.mset, dict.fromkeys(keys, 1),
+                          preserve=True)
+        self.assertRaises(InvalidCommand, r.ping)
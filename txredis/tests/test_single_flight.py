@@ -0,0 +1,156 @@
+# run the client test cases again with single-flight reads enabled
+from twisted.internet import defer
+
+from txredis.client import RedisClient
+from txredis.exceptions import ResponseError
+from txredis.testing import CommandsBaseTestCase
+from txredis.tests.client import (
+    test_general, test_string, test_list, test_hash, test_set, test_bulk)
+
+
+class SingleFlightRedisClient(RedisClient):
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('single_flight', True)
+        RedisClient.__init__(self, *args, **kwargs)
+
+
+class SingleFlightGeneral(test_general.GeneralCommandTestCase):
+
+    protocol = SingleFlightRedisClient
+
+
+class SingleFlightStrings(test_string.StringsCommandTestCase):
+
+    protocol = SingleFlightRedisClient
+
+
+class SingleFlightLists(test_list.ListsCommandsTestCase):
+
+    protocol = SingleFlightRedisClient
+
+
+class SingleFlightHash(test_hash.HashCommandsTestCase):
+
+    protocol = SingleFlightRedisClient
+
+
+class SingleFlightSets(test_set.SetsCommandsTestCase):
+
+    protocol = SingleFlightRedisClient
+
+
+class SingleFlightMultiBulk(test_bulk.MultiBulkTestCase):
+
+    protocol = SingleFlightRedisClient
+
+
+class SingleFlightTestCase(CommandsBaseTestCase):
+
+    protocol = SingleFlightRedisClient
+
+    @defer.inlineCallbacks
+    def test_shared(self):
+        r = self.redis
+        yield r.delete('b')
+        yield r.set('a', 'v')
+        reads = [r.get('a') for _ in range(5)] + [r.get('b')]
+        self.assertEqual(len(r._request_queue), 2)
+        a = yield defer.gatherResults(reads)
+        self.assertEqual(a, ['v'] * 5 + [None])
+        self.assertEqual(r.saved_requests, 4)
+        # nothing in flight any more
+        a = yield r.get('a')
+        self.assertEqual(a, 'v')
+        self.assertEqual(r.saved_requests, 4)
+
+    @defer.inlineCallbacks
+    def test_issue_order(self):
+        r = self.redis
+        yield r.set('a', 'v')
+        fired = []
+        reads = [r.get('a').addCallback(lambda _, i=i: fired.append(i))
+                 for i in range(3)]
+        yield defer.gatherResults(reads)
+        self.assertEqual(fired, [0, 1, 2])
+        self.assertEqual(r.saved_requests, 2)
+
+    @defer.inlineCallbacks
+    def test_write_ends_sharing(self):
+        r = self.redis
+        yield r.set('a', 'v1')
+        before = r.get('a')
+        write = r.set('a', 'v2')
+        after = r.get('a')
+        a = yield defer.gatherResults([before, write, after])
+        self.assertEqual(a, ['v1', 'OK', 'v2'])
+        self.assertEqual(r.saved_requests, 0)
+        # so do pipelines
+        before = r.get('a')
+        p = r.pipeline()
+        p.set('a', 'v3')
+        p.execute()
+        after = r.get('a')
+        a = yield defer.gatherResults([before, after])
+        self.assertEqual(a, ['v2', 'v3'])
+        self.assertEqual(r.saved_requests, 0)
+
+    @defer.inlineCallbacks
+    def test_errors(self):
+        r = self.redis
+        yield r.delete('h')
+        yield r.hset('h', 'f', 'x')
+        reads = [r.get('h') for _ in range(3)]
+        for d in reads:
+            yield self.assertFailure(d, ResponseError)
+        self.assertEqual(r.saved_requests, 2)
+
+    @defer.inlineCallbacks
+    def test_copies(self):
+        r = self.redis
+        yield r.delete('l')
+        yield r.rpush('l', 'x', 'y')
+        first, second = r.lrange('l', 0, -1), r.lrange('l', 0, -1)
+        first.addCallback(lambda values: values.append('z'))
+        a = yield second
+        self.assertEqual(a, ['x', 'y'])
+
+    @defer.inlineCallbacks
+    def test_streamed_not_shared(self):
+        r = self.redis
+        yield r.set('a', 'v')
+        pieces = []
+        streamed = r.get_stream('a', pieces.append)
+        read = r.get('a')
+        a = yield defer.gatherResults([streamed, read])
+        self.assertEqual(a, [1, 'v'])
+        self.assertEqual(pieces, ['v'])
+        self.assertEqual(r.saved_requests, 0)
+
+    @defer.inlineCallbacks
+    def test_multi_not_shared(self):
+        r = self.redis
+        yield r.set('a', 'v')
+        yield r.multi()
+        reads = [r.get('a'), r.get('a')]
+        result = r.execute()
+        after = [r.get('a'), r.get('a')]
+        a = yield defer.gatherResults(reads + [result])
+        self.assertEqual(a, ['QUEUED', 'QUEUED', ['v', 'v']])
+        a = yield defer.gatherResults(after)
+        self.assertEqual(a, ['v', 'v'])
+        self.assertEqual(r.saved_requests, 1)
+
+    @defer.inlineCallbacks
+    def test_pipelined_multi_not_shared(self):
+        r = self.redis
+        yield r.set('a', 'v')
+        p = r.pipeline()
+        p.multi()
+        p.execute()
+        reads = [r.get('a'), r.get('a')]
+        a = yield defer.gatherResults(reads)
+        self.assertEqual(a, ['QUEUED', 'QUEUED'])
+        a = yield r.execute()
+        self.assertEqual(a, ['v', 'v'])
+        self.assertEqual(r.saved_requests, 0)
@@ -0,0 +1,201 @@
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.trial import unittest
+
+from txredis.client import Redis, HiRedisClient
+from txredis.exceptions import RequestTimeout
+from txredis.slowlog import SlowLog
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+
+class SlowLogTestCase(unittest.TestCase):
+
+    protocol = Redis
+    okReplySize = 5
+
+    def setUp(self):
+        self.slowlog = SlowLog(threshold=1)
+        self.proto = self.protocol(slowlog=self.slowlog)
+        self.clock = Clock()
+        self.proto.clock = self.clock
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+
+    @defer.inlineCallbacks
+    def test_threshold(self):
+        d1 = self.proto.get('a')
+        d2 = self.proto.set('b', 'x' * 200)
+        self.clock.advance(2)
+        self.proto.dataReceived('$1\r\na\r\n+OK\r\n')
+        yield defer.gatherResults([d1, d2])
+        d = self.proto.ping()
+        self.proto.dataReceived('+PONG\r\n')
+        yield d
+        entries = self.slowlog.get()
+        self.assertEquals([e.command for e in entries], ['SET', 'GET'])
+        self.assertEquals(entries[0].args,
+                          ('b', 'x' * 128 + '... (72 more bytes)'))
+        self.assertEquals(entries[0].queueDepth, 1)
+        self.assertEquals(entries[0].elapsed, 2)
+        self.assertEquals(entries[0].parseTime, 0)
+        self.assertEquals(entries[0].replySize, self.okReplySize)
+        self.assertEquals(entries[1].args, ('a',))
+        self.assertEquals(entries[1].queueDepth, 0)
+        self.assertEquals(entries[1].replySize, 7)
+        self.assertEquals(entries[1].error, None)
+        self.assertEquals((self.slowlog.sampled, self.slowlog.logged), (3, 2))
+        self.assertEquals(len(self.slowlog.get(1)), 1)
+        self.slowlog.reset()
+        self.assertEquals(len(self.slowlog), 0)
+
+    @defer.inlineCallbacks
+    def test_parse_time(self):
+        self.slowlog.threshold = 0
+        big = '$10\r\n0123456789\r\n'
+        d1 = self.proto.get('a')
+        d2 = self.proto.get('b')
+        d3 = self.proto.get('c')
+        self.proto.dataReceived(big[:8])
+        self.clock.advance(0.25)
+        self.proto.dataReceived(big[8:] + big[:8])
+        self.clock.advance(0.5)
+        self.proto.dataReceived(big[8:] + big)
+        yield defer.gatherResults([d1, d2, d3])
+        entries = self.slowlog.get()
+        self.assertEquals([e.parseTime for e in entries], [0, 0.5, 0.25])
+        self.assertEquals([e.elapsed for e in entries], [0.75, 0.75, 0.25])
+        self.assertEquals([e.queueDepth for e in entries], [2, 1, 0])
+        # idle time before a reply arrives is not parse time
+        d = self.proto.get('a')
+        self.clock.advance(3)
+        self.proto.dataReceived(big)
+        yield d
+        self.assertEquals(self.slowlog.get(1)[0].parseTime, 0)
+        self.assertEquals(self.slowlog.get(1)[0].elapsed, 3)
+
+    @defer.inlineCallbacks
+    def test_sampling(self):
+        self.slowlog.sampleEvery = 3
+        self.proto.set_slowlog(self.slowlog)
+        ds = [self.proto.ping() for _ in range(7)]
+        self.clock.advance(1)
+        self.proto.dataReceived('+PONG\r\n' * 7)
+        yield defer.gatherResults(ds)
+        self.assertEquals(self.slowlog.sampled, 3)
+        self.assertEquals([e.queueDepth for e in self.slowlog.get()],
+                          [6, 3, 0])
+        self.proto.set_slowlog(None)
+        self.assertFalse(self.proto._tracked)
+        d = self.proto.ping()
+        self.proto.dataReceived('+PONG\r\n')
+        yield d
+        self.assertEquals(len(self.proto._sampled), 0)
+
+    @defer.inlineCallbacks
+    def test_sampled_clock_reads(self):
+        reads = []
+        seconds = self.clock.seconds
+
+        def counted():
+            reads.append(None)
+            return seconds()
+        self.clock.seconds = counted
+        self.slowlog.sampleEvery = 100
+        self.proto.set_slowlog(self.slowlog)
+        ds = [self.proto.get('a') for _ in range(1000)]
+        self.proto.dataReceived('$1\r\na\r\n' * 1000)
+        yield defer.gatherResults(ds)
+        self.assertEquals(self.slowlog.sampled, 10)
+        # when the sampled requests were sent, when the data arrived and
+        # when their replies were handed out
+        self.assertEquals(len(reads), 21)
+
+    @defer.inlineCallbacks
+    def test_head_of_line_delay(self):
+        self.slowlog.threshold = 0
+        d1 = self.proto.lrange('l', 0, -1)
+        d1.addCallback(lambda _: self.clock.advance(100))
+        d2 = self.proto.get('a')
+        self.clock.advance(1)
+        self.proto.dataReceived('*1\r\n$1\r\nx\r\n$1\r\na\r\n')
+        yield defer.gatherResults([d1, d2])
+        entry = self.slowlog.get(1)[0]
+        self.assertEquals((entry.command, entry.elapsed, entry.parseTime),
+                          ('GET', 101, 100))
+
+    @defer.inlineCallbacks
+    def test_failures(self):
+        d = self.proto.with_timeout(2).get('a')
+        self.clock.advance(2)
+        yield self.assertFailure(d, RequestTimeout)
+        self.proto.dataReceived('$1\r\na\r\n')
+        entry, = self.slowlog.get()
+        self.assertEquals((entry.command, entry.elapsed), ('GET', 2))
+        self.assertEquals((entry.parseTime, entry.replySize), (None, None))
+        self.assertTrue(isinstance(entry.error, RequestTimeout))
+        self.assertEquals(self.slowlog.sampled, 1)
+
+    @defer.inlineCallbacks
+    def test_toggled_with_requests_pending(self):
+        self.slowlog.threshold = 0
+        d1 = self.proto.get('a')
+        self.proto.set_slowlog(None)
+        d2 = self.proto.with_timeout(1).get('b')
+        self.proto.set_slowlog(self.slowlog)
+        d3 = self.proto.with_timeout(1).get('c')
+        self.clock.advance(1)
+        yield self.assertFailure(d2, RequestTimeout)
+        yield self.assertFailure(d3, RequestTimeout)
+        self.proto.dataReceived('$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n')
+        yield d1
+        self.assertEquals(
+            [(e.args, e.error.__class__) for e in self.slowlog.get()],
+            [(('c',), RequestTimeout)])
+        self.assertEquals(len(self.proto._sampled), 0)
+
+    @defer.inlineCallbacks
+    def test_batches(self):
+        p = self.proto.pipeline()
+        p.set('a', '1')
+        p.get('a')
+        d = p.execute()
+        t = self.proto.transaction()
+        t.incr('a')
+        d2 = t.execute()
+        self.clock.advance(1)
+        self.proto.dataReceived('+OK\r\n$1\r\n1\r\n'
+                                '+OK\r\n+QUEUED\r\n*1\r\n:2\r\n')
+        yield defer.gatherResults([d, d2])
+        self.assertEquals(
+            [(e.command, e.args, e.queueDepth)
+             for e in reversed(self.slowlog.get())],
+            [('SET', ('a', '1'), 0), ('GET', ('a',), 1), ('MULTI', (), 2),
+             ('INCR', ('a',), 3), ('EXEC', (), 4)])
+
+    def test_summary(self):
+        slowlog = SlowLog(threshold=0, maxArgs=4, maxArgLength=3)
+        slowlog.record(('rpush', 'list', 1, u'\xe9', 3, 4), 0, 0, 0, 4)
+        slowlog.record(('rpush', 'list', 'abcd', 2.5), 0, 0, 0, 4)
+        self.assertEquals([e.args for e in slowlog.get()], [
+            ('lis... (1 more bytes)', 'abc... (1 more bytes)', '2.5'),
+            ('lis... (1 more bytes)', '1', '... (3 more arguments)')])
+        self.assertEquals(slowlog.get()[0].command, 'RPUSH')
+        slowlog = SlowLog(threshold=0, maxEntries=2)
+        for name in ('a', 'b', 'c'):
+            slowlog.record((name,), 0, 0, 0, 4)
+        self.assertEquals([e.command for e in slowlog.get()], ['C', 'B'])
+
+
+if hiredis is not None:
+
+    class HiRedisSlowLogTestCase(SlowLogTestCase):
+
+        protocol = HiRedisClient
+        # estimated as a bulk string
+        okReplySize = 8